@@ -3,17 +3,18 @@
 
 import logging
 import os
+import time
 import uuid
 from contextlib import asynccontextmanager
 
-import psycopg2
 from dotenv import load_dotenv
 from fastapi import Depends, FastAPI
 from tortoise import Tortoise
 
 load_dotenv()
 
-from db_config import DB_CONFIG
+from db_config import db_config
+from shared.schema import verify_schema
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,22 +22,42 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    import asyncio
+
+    from shared.db import monitor_replica
+    from shared.spool import replay_spools
+
     await startup_event()
+
+    # messages spooled while redis was down are sent once it is back, even if nothing new is sent
+    stop_replaying = asyncio.Event()
+    replaying = asyncio.create_task(replay_spools(stop_replaying))
+
+    # read-only requests are served by the replica only while it keeps up
+    stop_monitoring = asyncio.Event()
+    monitoring = asyncio.create_task(monitor_replica(stop_monitoring))
+
     yield
+
+    stop_replaying.set()
+    stop_monitoring.set()
+    await replaying
+    await monitoring
     await shutdown_event()
 
 
 async def startup_event():
     logger.info("Starting up...")
 
+    started = time.perf_counter()
+    timings = {}
+
     test_mode = os.getenv("TEST_MODE", "false").lower() == "true"
 
     test_mode_pfx = 'test_' if test_mode else ''
 
     db_name = f"{test_mode_pfx}{os.getenv('DB_NAME')}"
 
-    db_url = f"postgres://{os.getenv('DB_USERNAME')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{db_name}"
-
     if test_mode:
         terminate_sessions_sql = f"""
                         SELECT pg_terminate_backend(pg_stat_activity.pid)
@@ -45,6 +66,8 @@ async def startup_event():
                           AND pid <> pg_backend_pid();
                         """
 
+        import psycopg2
+
         conn = psycopg2.connect(user=os.getenv('DB_USERNAME'), password=os.getenv('DB_PASSWORD'), database='template1', host=os.getenv('DB_HOST'))
 
         conn.autocommit = True
@@ -62,18 +85,26 @@ async def startup_event():
         cur.close()
         conn.close()
 
+        timings['test database'] = time.perf_counter() - started
+
     # Initialize Tortoise ORM
-    await Tortoise.init(
-        db_url=db_url,
-        modules={"models": ["conferences.models"]}  # Assuming models.py is in the same directory
-    )
+    # the test database is created above on the primary, tests never read from a replica
+    mark = time.perf_counter()
+    await Tortoise.init(config=db_config(db_name, replica=not test_mode))
+    timings['tortoise init'] = time.perf_counter() - mark
 
-    # Generate the database schema
-    try:
+    mark = time.perf_counter()
+    if test_mode:
+        # the test database is new on every start
         await Tortoise.generate_schemas()
-    except Exception as e:
-        raise
-    ...
+        timings['generate schemas'] = time.perf_counter() - mark
+    else:
+        # the schema is owned by the aerich migrations (applied by start.sh), the api only checks its version
+        await verify_schema()
+        timings['schema check'] = time.perf_counter() - mark
+
+    timings['total'] = time.perf_counter() - started
+    logger.info("Started up :: " + ", ".join(f"{step} {seconds * 1000:.1f}ms" for step, seconds in timings.items()))
 
     # if os.getenv('TEST_MODE', 'false').lower() == 'true':
     #     yield
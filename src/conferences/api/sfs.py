@@ -14,6 +14,7 @@ import conferences.controller as controller
 import conferences.models as models
 from app import get_app
 from conferences.controller import ConferenceImportRequestResponse
+from shared.db import read_only_request
 
 app = get_app()
 
@@ -99,9 +100,7 @@ async def create_authorization_post():
 @app.post('/api/notification-token')
 async def store_notification_token(request: PushNotificationRequest, token: str = Depends(oauth2_scheme)):
     decoded = await verify_token(token)
-    user = await controller.get_user(decoded['id_user'])
-    user.push_notification_token = request.push_notification_token
-    await user.save()
+    await controller.store_notification_token(decoded['id_user'], request.push_notification_token)
 
 
 @app.get('/api/me')
@@ -139,6 +138,8 @@ async def import_conference_xml_api(_request: Request, request: ImportConference
 
 
 
+# not read-only: the user's own bookmarks and rates, and the averages including them, must not lag behind
+# the user's last toggle or rating, which the app re-fetches right away
 @app.get('/api/conference')
 async def get_current_conference(last_updated: Optional[str] = Query(default=None),
                                  token: str = Depends(oauth2_scheme)):
@@ -149,7 +150,7 @@ async def get_current_conference(last_updated: Optional[str] = Query(default=Non
                                                          last_updated=last_updated)
 
 
-@app.get('/api/conference/static')
+@app.get('/api/conference/static', dependencies=[Depends(read_only_request)])
 async def get_current_conference_static(_request: Request):
     if  _request.client.host not in ('localhost', '127.0.0.1', '::1'):
         raise HTTPException(status_code=401, detail={"code": "INVALID_HOST", "message": "Invalid host"})
@@ -174,6 +175,16 @@ async def toggle_bookmark_for_session(id_session: uuid.UUID, token: str = Depend
     return await controller.bookmark_session(id_user=decoded['id_user'], id_session=id_session)
 
 
+@app.get('/api/leaderboards/{board}', dependencies=[Depends(read_only_request)])
+async def get_leaderboard(board: models.Leaderboard,
+                          day: Optional[str] = None,
+                          id_track: Optional[uuid.UUID] = None,
+                          limit: int = 10,
+                          token: str = Depends(oauth2_scheme)):
+    await verify_token(token)
+    return await controller.get_leaderboard(board, day=day, id_track=id_track, limit=limit)
+
+
 class AdminLoginRequest(pydantic.BaseModel):
     username: str
     password: str
@@ -198,36 +209,89 @@ async def login_admin(request: AdminLoginRequest):
     return {'token': encoded_jwt}
 
 
-@app.get('/api/admin/dashboard')
-async def get_dashboard():
+@app.get('/api/admin/dashboard', dependencies=[Depends(read_only_request)])
+async def get_dashboard(token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
     return await controller.get_dashboard()
 
-@app.get('/api/admin/users')
+@app.get('/api/admin/users', dependencies=[Depends(read_only_request)])
 async def get_users_with_bookmarks(
         csv: Optional[bool] = False,
+        ndjson: Optional[bool] = False,
         order_field: Optional[str] = None,
         order_direction: Optional[models.SortOrder] = None,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        min_bookmarks: int = 0,
+        min_ratings: int = 0,
+        registered_from: Optional[datetime.datetime] = None,
+        registered_to: Optional[datetime.datetime] = None,
         token: str = Depends(oauth2_scheme_admin)):
     await verify_admin_token(token)
-    if csv:
-        return await controller.csv_users()
+    if csv or ndjson:
+        return await controller.export_users('ndjson' if ndjson else 'csv')
 
-    return {'data': await controller.get_all_anonymous_users_with_bookmarked_sessions(order_field, order_direction)}
+    return await controller.get_all_anonymous_users_with_bookmarked_sessions(order_field, order_direction,
+                                                                             limit=limit, after=after,
+                                                                             min_bookmarks=min_bookmarks,
+                                                                             min_ratings=min_ratings,
+                                                                             registered_from=registered_from,
+                                                                             registered_to=registered_to)
 
 
-@app.get('/api/admin/sessions')
+@app.get('/api/admin/sessions', dependencies=[Depends(read_only_request)])
 async def get_sessions_by_rate(
         csv: Optional[bool] = False,
+        ndjson: Optional[bool] = False,
         order_field: Optional[str] = None,
         order_direction: Optional[models.SortOrder] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
         token: str = Depends(oauth2_scheme_admin)):
     await verify_admin_token(token)
-    if csv:
-        return await controller.csv_sessions()
-    return {'data': await controller.get_sessions_by_rate(order_field, order_direction)}
+    if csv or ndjson:
+        return await controller.export_sessions('ndjson' if ndjson else 'csv')
+    return await controller.get_sessions_by_rate(order_field, order_direction, limit=limit, offset=offset)
+
+
+@app.get('/api/admin/conferences/{acronym}/sessions', dependencies=[Depends(read_only_request)])
+async def get_conference_sessions(acronym: str, token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return await controller.get_conference_sessions(acronym)
+
+
+@app.get('/api/admin/leaderboards/{board}', dependencies=[Depends(read_only_request)])
+async def get_admin_leaderboard(board: models.Leaderboard,
+                                day: Optional[str] = None,
+                                id_track: Optional[uuid.UUID] = None,
+                                limit: int = 10,
+                                token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return await controller.get_leaderboard(board, day=day, id_track=id_track, limit=limit)
+
+
+@app.get('/api/admin/engagement', dependencies=[Depends(read_only_request)])
+async def get_engagement(resolution: models.BucketResolution = models.BucketResolution.HOUR,
+                         since: Optional[datetime.datetime] = None,
+                         until: Optional[datetime.datetime] = None,
+                         token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return await controller.get_engagement(resolution, since=since, until=until)
+
+
+@app.get('/api/admin/push-queue')
+async def get_push_queue_status(token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return await controller.get_push_queue_status()
+
+
+@app.get('/api/admin/redis')
+async def get_redis_status(token: str = Depends(oauth2_scheme_admin)):
+    await verify_admin_token(token)
+    return await controller.get_redis_status()
 
 
-@app.get('/api/admin/summary')
+@app.get('/api/admin/summary', dependencies=[Depends(read_only_request)])
 async def get_event_summary(token: str = Depends(oauth2_scheme_admin)):
     await verify_admin_token(token)
     return await controller.get_event_summary()
\ No newline at end of file
@@ -2,3 +2,4 @@
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 
 from .conference import *
+from .engagement import get_engagement
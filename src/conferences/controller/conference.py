@@ -1,27 +1,24 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
-import csv
+import base64
 import datetime
-import io
 import json
 import logging
 import os
 import random
 import re
+import time
 import uuid
 from typing import Optional
 
-import httpx
 import pydantic
-import redis
-import slugify
 import tortoise.timezone
-import xmltodict
 import yaml
 from fastapi import HTTPException, status
 from fastapi.responses import StreamingResponse
 
 import conferences.models as models
+import shared.cache
 import shared.ex as ex
 
 log = logging.getLogger('conference_logger')
@@ -62,12 +59,16 @@ async def db_add_conference(name, acronym, source_uri):
 
 
 async def read_xml_file(fname='sfscon2023.xml'):
+    import xmltodict
+
     with open(fname, 'r') as f:
         content = xmltodict.parse(f.read(), encoding='utf-8')
     return content['schedule']
 
 
 async def db_add_or_update_tracks(conference, content_tracks):
+    import slugify
+
     order = 0
 
     tracks_by_name = {}
@@ -116,6 +117,8 @@ async def db_add_or_update_tracks(conference, content_tracks):
 
 
 async def convert_xml_to_dict(xml_text):
+    import xmltodict
+
     content = xmltodict.parse(xml_text, encoding='utf-8')
     return content['schedule']
 
@@ -157,6 +160,8 @@ def remove_html(text):
 
 
 async def fetch_xml_content(use_local_xml=False, local_xml_fname='sfscon2024.xml'):
+    import httpx
+
     if use_local_xml:
         current_file_folder = os.path.dirname(os.path.realpath(__file__))
         if use_local_xml:
@@ -190,6 +195,8 @@ async def fetch_xml_content(use_local_xml=False, local_xml_fname='sfscon2024.xml
 
 
 async def add_sessions(conference, content, tracks_by_name):
+    import slugify
+
     db_location = await models.Location.filter(conference=conference, slug='noi').get_or_none()
 
     changes = {}
@@ -405,6 +412,8 @@ async def add_sessions(conference, content, tracks_by_name):
                         if event_start != db_event.start_date:
                             changes[str(db_event.id)] = {'old_start_timestamp': db_event.start_date,
                                                          'new_start_timestamp': event_start}
+                            # a moved session is reminded again before its new start
+                            db_event.notification5min_sent = False
 
                         await db_event.update_from_dict({'title': title, 'abstract': abstract,
                                                          'description': description,
@@ -510,112 +519,256 @@ async def add_sessions(conference, content, tracks_by_name):
     return changes, to_delete
 
 
-async def send_changes_to_bookmakers(changes, group_4_user=True):
-    log.info('-' * 100)
-    log.info("send_changes_to_bookmakers")
+def clean_text(text):
+    from html import unescape
 
-    changed_sessions = changes.keys()
-    # all_anonymous_bookmarks = await models.AnonymousBookmark.filter(session_id__in=changed_sessions).all()
+    # Unescape any HTML entities (like &#8211;)
+    text = unescape(text)
 
-    notification2token = {}
+    # Remove special characters (adjust regex pattern as needed)
+    cleaned_text = re.sub(r'[^\w\s.,:;!?-]', '', text)
 
-    from html import unescape
-    def clean_text(text):
-        # Unescape any HTML entities (like &#8211;)
-        text = unescape(text)
+    return cleaned_text
 
-        # Remove special characters (adjust regex pattern as needed)
-        cleaned_text = re.sub(r'[^\w\s.,:;!?-]', '', text)
 
-        return cleaned_text
+# grouped notifications for the same device within this many seconds are merged into one, 0 disables merging
+PUSH_COALESCE_WINDOW = float(os.getenv('PUSH_COALESCE_WINDOW', 0))
 
-    from shared.redis_client import RedisClientHandler
-    redis_client = RedisClientHandler.get_redis_client()
-    # with redis.Redis(host=os.getenv('REDIS_SERVER'), port=6379, db=0) as r:
+# above this many undelivered push notifications, imports notify every device only once
+PUSH_BACKLOG_THRESHOLD = int(os.getenv('PUSH_BACKLOG_THRESHOLD', 10000))
+PUSH_CONSUMER_GROUP = os.getenv('PUSH_CONSUMER_GROUP', 'push_notifications')
 
-    if True:
+# one row per (device token, changed session), streamed through a server-side cursor
+FANOUT_TARGETS_SQL = """
+    SELECT DISTINCT u.push_notification_token AS token, s.id AS session_id, s.title, r.name AS room
+      FROM conferences_event_sessions s
+      JOIN conferences_rooms r ON r.id = s.room_id
+      JOIN conferences_anonymous_bookmarks b ON b.session_id = s.id
+      JOIN conferences_users_anonymous u ON u.id = b.user_id
+     WHERE s.id = ANY($1::uuid[])
+       AND u.push_notification_token IS NOT NULL
+"""
 
-        q = models.EventSession.filter(id__in=changed_sessions)
-        for session in await q:
-            print("S1", session.id)
-            log.info(f"S1 {session.id}")
+# one row per device token with its changed sessions
+GROUPED_FANOUT_TARGETS_SQL = """
+    SELECT u.push_notification_token AS token, array_agg(DISTINCT b.session_id) AS sessions
+      FROM conferences_anonymous_bookmarks b
+      JOIN conferences_users_anonymous u ON u.id = b.user_id
+     WHERE b.session_id = ANY($1::uuid[])
+       AND u.push_notification_token IS NOT NULL
+     GROUP BY u.push_notification_token
+"""
 
-        q = models.EventSession.filter(id__in=changed_sessions,
-                                       anonymous_bookmarks__user__push_notification_token__isnull=False
-                                       ).prefetch_related('anonymous_bookmarks',
-                                                          'room',
-                                                          'anonymous_bookmarks__user'
-                                                          ).distinct()
 
-        s = q.sql()
+async def fanout_targets(changes):
+    """
+    Yield (token, session_id, title, room, old_start_timestamp, new_start_timestamp) for every
+    device which bookmarked one of the changed sessions.
 
-        log.info("X")
+    Tokens come from the Redis subscriber sets when they are complete, otherwise from Postgres.
+    """
+    import shared.db
+    from .subscribers import SessionSubscribers
 
-        notify_users = {}
-        for session in await q:
+    tokens_by_session = await subscribers_of(SessionSubscribers(), changes.keys())
 
-            log.info('-' * 100)
-            log.info(f"Session {session.id}")
+    if tokens_by_session is not None:
+        sessions = await models.EventSession.filter(id__in=[id_session for id_session, tokens
+                                                            in tokens_by_session.items() if tokens]) \
+            .values('id', 'title', 'room__name')
 
-            for bookmarks4session in session.anonymous_bookmarks:
+        for session in sessions:
+            change = changes[str(session['id'])]
+            for token in tokens_by_session[str(session['id'])]:
+                yield (token, str(session['id']), session['title'], session['room__name'],
+                       change['old_start_timestamp'], change['new_start_timestamp'])
+        return
 
-                # log.info(f"    bookmarks4session {bookmarks4session}")
+    async for row in shared.db.stream_rows(FANOUT_TARGETS_SQL, [list(changes.keys())]):
+        change = changes[str(row['session_id'])]
+        yield (row['token'], str(row['session_id']), row['title'], row['room'],
+               change['old_start_timestamp'], change['new_start_timestamp'])
 
-                _from = changes[str(session.id)]['old_start_timestamp'].strftime('%m.%d. %H:%M')
-                _to = changes[str(session.id)]['new_start_timestamp'].strftime('%m.%d. %H:%M') if \
-                    changes[str(session.id)]['new_start_timestamp'] else None
 
-                if changes[str(session.id)]['new_start_timestamp'] and changes[str(session.id)][
-                    'old_start_timestamp'].date() == changes[str(session.id)][
-                    'new_start_timestamp'].date():
-                    _from = changes[str(session.id)]['old_start_timestamp'].strftime('%H:%M')
-                    _to = changes[str(session.id)]['new_start_timestamp'].strftime('%H:%M')
+async def grouped_fanout_targets(changes):
+    """
+    Yield (token, ids of changed sessions) for every device which bookmarked one of the changed sessions.
+    """
+    import shared.db
+    from .subscribers import SessionSubscribers
 
-                if not _to:
-                    notification = "Session '" + clean_text(session.title) + "' has been cancelled"
-                else:
-                    notification = "Session '" + clean_text(
-                        session.title) + "' has been rescheduled from " + _from + " to " + _to + f' in room {session.room.name}'
-
-                if bookmarks4session.user.push_notification_token not in notification2token:
-                    notification2token[bookmarks4session.user.push_notification_token] = []
-                notification2token[bookmarks4session.user.push_notification_token].append(notification)
-
-                if not group_4_user:
-                    pn_payload = {'id': bookmarks4session.user.push_notification_token,
-                                  'expo_push_notification_token': bookmarks4session.user.push_notification_token,
-                                  'subject': "Event rescheduled",
-                                  'message': notification,
-                                  'data': {
-                                      'command': 'SESSION_START_CHANGED',
-                                      'session_id': str(session.id),
-                                      'value': changes[str(session.id)]['new_start_timestamp'].strftime(
-                                          '%Y-%m-%d %H:%M:%S')
-                                  }
-                                  }
-
-                    log.info(f"SENDING PUSH NOTIFICATION TO {bookmarks4session.user.push_notification_token}")
-                    redis_client.push_message('opencon_push_notification', pn_payload)
+    tokens_by_session = await subscribers_of(SessionSubscribers(), changes.keys())
 
-                else:
-                    if bookmarks4session.user_id not in notify_users:
-                        notify_users[bookmarks4session.user_id] = {
-                            'token': bookmarks4session.user.push_notification_token, 'sessions': set()}
-                    notify_users[bookmarks4session.user_id]['sessions'].add(bookmarks4session.session_id)
-
-        if group_4_user and notify_users:
-            for id_user in notify_users:
-                pn_payload = {'id': notify_users[id_user]['token'],
-                              'expo_push_notification_token': notify_users[id_user]['token'],
-                              'subject': "Event rescheduled" if len(
-                                  notify_users[id_user]['sessions']) == 1 else "Events rescheduled",
-                              'message': "Some of your bookmarked events have been rescheduled",
-                              'data': {
-                                  'command': 'OPEN_BOOKMARKS',
-                              }
-                              }
-                log.info(f"SENDING PUSH NOTIFICATION TO {notify_users[id_user]['token']}")
-                redis_client.push_message('opencon_push_notification', pn_payload)
+    if tokens_by_session is not None:
+        sessions_by_token = {}
+        for id_session, tokens in tokens_by_session.items():
+            for token in tokens:
+                sessions_by_token.setdefault(token, []).append(id_session)
+
+        for token, sessions in sessions_by_token.items():
+            yield token, sessions
+        return
+
+    async for row in shared.db.stream_rows(GROUPED_FANOUT_TARGETS_SQL, [list(changes.keys())]):
+        yield row['token'], [str(id_session) for id_session in row['sessions']]
+
+
+async def subscribers_of(subscribers, session_ids):
+    # None means the subscriber sets can not be trusted and Postgres has to be asked
+    try:
+        if await subscribers.is_ready():
+            return await subscribers.tokens_by_session(session_ids)
+    except Exception as e:
+        log.critical(f'Error reading session subscribers :: {str(e)}')
+    return None
+
+
+def session_change_notification(title, room, old_start_timestamp, new_start_timestamp):
+    if not new_start_timestamp:
+        return "Session '" + clean_text(title) + "' has been cancelled"
+
+    if old_start_timestamp.date() == new_start_timestamp.date():
+        _from = old_start_timestamp.strftime('%H:%M')
+        _to = new_start_timestamp.strftime('%H:%M')
+    else:
+        _from = old_start_timestamp.strftime('%m.%d. %H:%M')
+        _to = new_start_timestamp.strftime('%m.%d. %H:%M')
+
+    return "Session '" + clean_text(title) + "' has been rescheduled from " + _from + " to " + _to + f' in room {room}'
+
+
+def grouped_notification(token, nr_sessions):
+    return {'id': token,
+            'expo_push_notification_token': token,
+            'subject': "Event rescheduled" if nr_sessions == 1 else "Events rescheduled",
+            'message': "Some of your bookmarked events have been rescheduled",
+            'data': {
+                'command': 'OPEN_BOOKMARKS',
+            }
+            }
+
+
+async def coalesce_grouped_notifications(redis_client, targets, window=PUSH_COALESCE_WINDOW):
+    """
+    Merge grouped notifications into one pending notification per device token.
+
+    The push worker sends the pending notification once the window, which starts with the
+    first change, is over. Sessions changed again within the window are counted only once.
+
+    :param redis_client: AsyncRedisClientHandler
+    :param targets: List of (token, ids of changed sessions)
+    :param window: Seconds to wait for further changes
+    """
+    if not targets:
+        return
+
+    stream = 'opencon_push_notification'
+
+    async with redis_client.redis_client.pipeline(transaction=False) as pipe:
+        for token, sessions in targets:
+            pipe.sadd(f'{stream}:coalesced:{token}', *sessions)
+            pipe.scard(f'{stream}:coalesced:{token}')
+        nr_sessions = (await pipe.execute())[1::2]
+
+    # only the first change of a device opens its window
+    due_at = time.time() + window
+    async with redis_client.redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(f'{stream}:coalesced', mapping={token: json.dumps(grouped_notification(token, count))
+                                                  for (token, _), count in zip(targets, nr_sessions)})
+        pipe.zadd(f'{stream}:coalesce_due', {token: due_at for token, _ in targets}, nx=True)
+        await pipe.execute()
+
+
+async def send_changes_to_bookmakers(changes, group_4_user=True):
+    log.info('-' * 100)
+    log.info("send_changes_to_bookmakers")
+
+    from shared.redis_client import PIPELINE_BATCH_SIZE, AsyncRedisClientHandler
+    redis_client = AsyncRedisClientHandler.get_redis_client()
+
+    # several anonymous users can share a device token, the queries return every token only once,
+    # and payloads are pushed while rows are streamed so memory does not grow with the audience
+    pn_payloads = []
+    nr_sent = 0
+
+    # grouped notifications of consecutive imports are merged per device when a window is configured
+    coalesce = group_4_user and PUSH_COALESCE_WINDOW > 0
+
+    async def flush():
+        nonlocal pn_payloads, nr_sent
+        if pn_payloads:
+            if coalesce:
+                try:
+                    await coalesce_grouped_notifications(redis_client, pn_payloads)
+                except Exception as e:
+                    # without redis there is nothing to merge with, notifications are sent (or spooled) right away
+                    log.critical(f'Error coalescing push notifications :: {str(e)}')
+                    await redis_client.add_stream_messages('opencon_push_notification',
+                                                           [grouped_notification(token, len(sessions))
+                                                            for token, sessions in pn_payloads])
+            else:
+                await redis_client.add_stream_messages('opencon_push_notification', pn_payloads)
+            nr_sent += len(pn_payloads)
+            pn_payloads = []
+
+    if group_4_user:
+        async for token, sessions in grouped_fanout_targets(changes):
+            pn_payloads.append((token, sessions) if coalesce else grouped_notification(token, len(sessions)))
+            if len(pn_payloads) >= PIPELINE_BATCH_SIZE:
+                await flush()
+    else:
+        # notification text depends only on the session, so it is built once per session
+        templates = {}
+        async for token, session_id, title, room, old_start, new_start in fanout_targets(changes):
+            if session_id not in templates:
+                templates[session_id] = {'subject': "Event rescheduled",
+                                         'message': session_change_notification(title, room, old_start, new_start),
+                                         'data': {
+                                             'command': 'SESSION_START_CHANGED',
+                                             'session_id': session_id,
+                                             'value': new_start.strftime('%Y-%m-%d %H:%M:%S') if new_start else None
+                                         }
+                                         }
+
+            pn_payloads.append(dict(templates[session_id], id=token, expo_push_notification_token=token))
+            if len(pn_payloads) >= PIPELINE_BATCH_SIZE:
+                await flush()
+
+    await flush()
+
+    log.info(f"{'COALESCED' if coalesce else 'SENT'} {nr_sent} PUSH NOTIFICATIONS")
+
+
+async def get_push_queue_status():
+    from shared.redis_client import AsyncRedisClientHandler
+    return await AsyncRedisClientHandler.get_redis_client().get_stream_backlog('opencon_push_notification',
+                                                                              PUSH_CONSUMER_GROUP)
+
+
+async def get_redis_status():
+    from shared.redis_client import AsyncRedisClientHandler, pool_stats
+    from shared.spool import spool_metrics
+
+    try:
+        ping_ms = await AsyncRedisClientHandler.get_redis_client().ping()
+    except Exception as e:
+        log.critical(f'Error pinging redis :: {str(e)}')
+        ping_ms = None
+
+    return {'ping_ms': ping_ms,
+            'pools': pool_stats(),
+            'spools': spool_metrics()}
+
+
+async def push_queue_is_backlogged():
+    try:
+        queue_status = await get_push_queue_status()
+    except Exception as e:
+        log.critical(f'Error reading push notification queue status :: {str(e)}')
+        return False
+
+    # acknowledged notifications are deleted from the stream, so its length is what is still to be sent
+    return queue_status['length'] > PUSH_BACKLOG_THRESHOLD
 
 
 async def add_conference(content: dict, source_uri: str, force: bool = False, group_notifications_by_user=True):
@@ -654,11 +807,21 @@ async def add_conference(content: dict, source_uri: str, force: bool = False, gr
         changes = {}
 
     changes_updated = None
+    if changes and not group_notifications_by_user and await push_queue_is_backlogged():
+        log.info("PUSH NOTIFICATION QUEUE IS BACKLOGGED, GROUPING NOTIFICATIONS BY USER")
+        group_notifications_by_user = True
+
     if changes:
         changes_updated = await send_changes_to_bookmakers(changes, group_4_user=group_notifications_by_user)
 
     if to_delete:
+        from .subscribers import SessionSubscribers
+        deleted_sessions = await models.EventSession.filter(unique_id__in=to_delete).values_list('id', flat=True)
+
         await models.EventSession.filter(unique_id__in=to_delete).delete()
+        await SessionSubscribers().remove_sessions(deleted_sessions)
+
+    await rebuild_leaderboards(conference)
 
     return {'conference': conference,
             'created': created,
@@ -668,44 +831,121 @@ async def add_conference(content: dict, source_uri: str, force: bool = False, gr
             }
 
 
-async def get_conference_sessions(conference_acronym):
-    conference = await models.Conference.filter(acronym=conference_acronym).get_or_none()
-    if not conference:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail={"code": "CONFERENCE_NOT_FOUND", "message": "conference not found"})
+async def rebuild_leaderboards(conference):
+    # sessions may have moved to another day or track, or been removed
+    from .leaderboards import Leaderboards
+
+    try:
+        await Leaderboards().rebuild(conference.id)
+    except Exception as e:
+        log.critical(f'Error rebuilding leaderboards of {conference.id} :: {str(e)}')
+        await Leaderboards().invalidate(conference.id)
+
+
+# top sessions of one board, for when the Redis leaderboards are not ready
+LEADERBOARD_SQL = """
+    SELECT id, score
+      FROM (SELECT s.id,
+                   CASE $5::text
+                       WHEN 'bookmarks' THEN (SELECT count(*)::float FROM conferences_anonymous_bookmarks b
+                                               WHERE b.session_id = s.id)
+                       WHEN 'rates' THEN (SELECT count(*)::float FROM conferences_anonymous_rates r
+                                           WHERE r.session_id = s.id)
+                       ELSE (SELECT avg(r.rate)::float FROM conferences_anonymous_rates r WHERE r.session_id = s.id)
+                   END AS score
+              FROM conferences_event_sessions s
+             WHERE s.conference_id = $1
+               AND ($2::text IS NULL OR to_char(s.start_date AT TIME ZONE 'UTC', 'YYYY-MM-DD') = $2)
+               AND ($3::uuid IS NULL OR s.track_id = $3)) sessions
+     WHERE score > 0
+     ORDER BY score DESC, id
+     LIMIT $4
+"""
+
+LEADERBOARD_MAX_LIMIT = 100
+
+
+async def get_leaderboard(board: models.Leaderboard, day: Optional[str] = None, id_track: Optional[uuid.UUID] = None,
+                          limit: int = 10):
+    """
+    Top sessions of the current conference by bookmarks, number of ratings or average rating.
+
+    :param board: bookmarks, rates or rating
+    :param day: Only sessions of this day, YYYY-MM-DD
+    :param id_track: Only sessions of this track
+    :param limit: Number of sessions, at most LEADERBOARD_MAX_LIMIT
+    :return: {'data': [{'id', 'title', 'score'}, ...]} with the highest score first
+    """
+    import shared.db
+
+    from .leaderboards import Leaderboards
+
+    id_conference = await models.Conference.all().order_by('-created').first().values_list('id', flat=True)
+    if not id_conference:
+        raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
+
+    board = models.Leaderboard(board).value
+    id_track = str(id_track) if id_track else None
+    limit = min(max(limit, 1), LEADERBOARD_MAX_LIMIT)
+
+    leaderboards = Leaderboards()
+    try:
+        top = await leaderboards.top(id_conference, board, day, id_track, limit) \
+            if await leaderboards.is_ready(id_conference) else None
+    except Exception as e:
+        log.critical(f'Error reading leaderboard {board} :: {str(e)}')
+        top = None
+
+    if top is None:
+        rows = await shared.db.read_connection().execute_query_dict(LEADERBOARD_SQL,
+                                                                    [id_conference, day, id_track, limit, board])
+        top = [(str(row['id']), row['score']) for row in rows]
+
+    titles = {str(session['id']): session['title'] for session in
+              await models.EventSession.filter(id__in=[id_session for id_session, _ in top]).values('id', 'title')}
+
+    return {'data': [{'id': id_session, 'title': titles[id_session], 'score': score}
+                     for id_session, score in top if id_session in titles]}
 
-    conference = await get_conference(conference.id)
-    serialized = await opencon_serialize(conference)
 
-    sessions = []
+# per-session bookmarks and average rating of one conference, in schedule order
+CONFERENCE_SESSIONS_SQL = """
+    SELECT s.title,
+           (SELECT string_agg(l.display_name, ', ' ORDER BY l.display_name)
+              FROM conferences_lecturers_conferences_event_sessions ls
+              JOIN conferences_lecturers l ON l.id = ls.conferences_lecturers_id
+             WHERE ls.eventsession_id = s.id) AS speakers,
+           s.start_date,
+           (SELECT count(*) FROM conferences_anonymous_bookmarks b WHERE b.session_id = s.id) AS bookmarks,
+           (SELECT avg(r.rate)::float FROM conferences_anonymous_rates r WHERE r.session_id = s.id) AS rating
+      FROM conferences_event_sessions s
+     WHERE s.conference_id = $1
+     ORDER BY s.start_date, s.id
+"""
 
-    bookmark_per_event = {}
-    for bpe in await models.Bookmark.filter(pretix_order__conference=conference).prefetch_related('pretix_order').all():
-        if str(bpe.event_session_id) not in bookmark_per_event:
-            bookmark_per_event[str(bpe.event_session_id)] = 0
-        bookmark_per_event[str(bpe.event_session_id)] += 1
 
-    rate_per_event = {}
-    for rpe in await models.StarredSession.filter(event_session__conference=conference).prefetch_related(
-            'event_session').all():
-        rate_per_event[str(rpe.event_session_id)] = rpe.total_stars / rpe.nr_votes if rpe.nr_votes else ' '
+async def get_conference_sessions(conference_acronym):
+    """
+    Report of all sessions of a conference with speakers, date, number of bookmarks and average rating.
+
+    Takes two queries whatever the size of the conference, one for the conference and one for the report.
+    """
+    import shared.db
 
-    for day in serialized['conference']['idx']['ordered_sessions_by_days']:
-        for id_session in serialized['conference']['idx']['ordered_sessions_by_days'][day]:
-            session = serialized['conference']['db']['sessions'][id_session]
+    conference = await models.Conference.filter(acronym=conference_acronym).order_by('-created').first()
+    if not conference:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"code": "CONFERENCE_NOT_FOUND", "message": "conference not found"})
 
-            sessions.append({
-                'event': session['title'],
-                'speakers': ', '.join(
-                    [serialized['conference']['db']['lecturers'][id_lecturer]['display_name'] for id_lecturer in
-                     session['id_lecturers']]),
-                'date': session['date'],
-                'bookmarks': bookmark_per_event[str(id_session)] if id_session in bookmark_per_event else 0,
-                'rating': rate_per_event[str(id_session)] if str(id_session) in rate_per_event else ' '
+    rows = await shared.db.read_connection().execute_query_dict(CONFERENCE_SESSIONS_SQL, [conference.id])
 
-                # 'bookmarks': random.randint(0, 100),
-                # 'rating': round(random.randint(0, 500) / 100, 2)
-            })
+    sessions = [{
+        'event': row['title'],
+        'speakers': row['speakers'] or '',
+        'date': row['start_date'].strftime('%Y-%m-%d'),
+        'bookmarks': row['bookmarks'],
+        'rating': round(row['rating'], 2) if row['rating'] is not None else ' '
+    } for row in rows]
 
     return {'header': [
         {'name': 'Event', 'key': 'event', 'width': '100px'},
@@ -742,171 +982,313 @@ async def get_pretix_order(conference: models.Conference, id_pretix_order: str):
 
 
 async def get_dashboard():
+    summary = await event_summary()
+
     return {
-        'total_users': 33,
-        'total_bookmarks': 34,
-        'total_ratings': 35,
+        'total_users': summary['all_users'],
+        'total_bookmarks': summary['total_bookmarks'],
+        'total_ratings': summary['total_rates'],
     }
 
 
-async def csv_users():
-    conference = await get_current_conference()
-    if not conference:
-        raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
-
-    all_users = await models.UserAnonymous.all().prefetch_related('bookmarks', 'bookmarks__session', 'rates')
+USERS_EXPORT_SQL = """
+    SELECT u.id, u.created,
+           (SELECT count(*) FROM conferences_anonymous_bookmarks b WHERE b.user_id = u.id) AS bookmarks,
+           (SELECT count(*) FROM conferences_anonymous_rates r WHERE r.user_id = u.id) AS nr_ratings
+      FROM conferences_users_anonymous u
+     ORDER BY u.created, u.id
+"""
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Bookmarks', 'Number of ratings', 'Registered'])
+USERS_EXPORT_COLUMNS = {'id': 'ID', 'bookmarks': 'Bookmarks', 'nr_ratings': 'Number of ratings',
+                        'register_at': 'Registered'}
 
-    for user in all_users:
-        id = user.id
-        bookmarks = len(user.bookmarks)
-        nr_ratings = len(user.rates)
-        register_at = user.created.strftime('%Y-%m-%d %H:%M:%S')
 
-        writer.writerow([id, bookmarks, nr_ratings, register_at])
+def export_response(export_format: str, chunks, name: str):
+    import shared.export
 
-    output.seek(0)
-
-    filename = f"sfs2024_anonymous_users_on_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    media_type, extension = shared.export.EXPORT_FORMATS[export_format]
+    filename = f"sfs2024_{name}_on_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
 
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
+        chunks,
+        media_type=media_type,
         headers={
             'Content-Disposition': f'attachment; filename="{filename}"'
         }
     )
 
 
-async def get_all_anonymous_users_with_bookmarked_sessions(order_field: Optional[str] = None,
-                                                           order_direction: Optional[models.SortOrder] = None):
-    conference = await get_current_conference()
-    if not conference:
+async def export_users(export_format: str = 'csv'):
+    """
+    Stream all anonymous users with their number of bookmarks and ratings, as CSV or NDJSON.
+
+    Rows come from a server-side cursor and are sent in chunks as they arrive.
+    """
+    import shared.db
+    import shared.export
+
+    if not await models.Conference.exists():
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-    all_users = await models.UserAnonymous.all().prefetch_related('bookmarks', 'bookmarks__session', 'rates')
+    def values(row):
+        return [str(row['id']), row['bookmarks'], row['nr_ratings'], row['created'].strftime('%Y-%m-%d %H:%M:%S')]
 
-    users_data = [
-        {
-            'id': user.id,
-            'bookmarks': len([b.session.title for b in user.bookmarks]),
-            'nr_ratings': len(user.rates),
-            'register_at': str(user.created)
-        }
-        for user in all_users
-    ]
+    chunks = shared.export.export_chunks(export_format, shared.db.stream_rows(
+        USERS_EXPORT_SQL, connection_name=shared.db.read_connection_name()),
+                                         USERS_EXPORT_COLUMNS, values)
+    return export_response(export_format, chunks, 'anonymous_users')
 
-    # Apply sorting if specified
-    if order_field and order_direction:
-        reverse = order_direction == models.SortOrder.DESCENDING
-        if order_field == 'register_at':
-            users_data.sort(key=lambda x: x['register_at'], reverse=reverse)
-        elif order_field in ['bookmarks', 'nr_ratings']:
-            users_data.sort(key=lambda x: x[order_field], reverse=reverse)
 
-    return users_data
+# page size of /api/admin/users when none is requested, and the largest page served
+ADMIN_USERS_PAGE_SIZE = int(os.getenv('ADMIN_USERS_PAGE_SIZE', 100))
+ADMIN_USERS_MAX_PAGE_SIZE = 1000
 
+# sortable fields of /api/admin/users, the user id breaks ties so the order is stable across pages
+ADMIN_USERS_ORDER_FIELDS = {
+    'register_at': ('created', 'timestamptz'),
+    'bookmarks': ('bookmarks', 'bigint'),
+    'nr_ratings': ('nr_ratings', 'bigint'),
+}
 
-async def csv_sessions():
-    conference = await get_current_conference()
-    if not conference:
+# counts are computed only for the rows Postgres needs, with a LIMIT on created only the page is counted
+ADMIN_USERS_SQL = """
+    SELECT *
+      FROM (SELECT u.id, u.created,
+                   (SELECT count(*) FROM conferences_anonymous_bookmarks b WHERE b.user_id = u.id) AS bookmarks,
+                   (SELECT count(*) FROM conferences_anonymous_rates r WHERE r.user_id = u.id) AS nr_ratings
+              FROM conferences_users_anonymous u
+             WHERE ($1::timestamptz IS NULL OR u.created >= $1)
+               AND ($2::timestamptz IS NULL OR u.created < $2)) users
+     WHERE bookmarks >= $3
+       AND nr_ratings >= $4
+       {after}
+     ORDER BY {order_field} {direction}, id {direction}
+     LIMIT $5
+"""
+
+
+def encode_cursor(order_field: str, row: dict) -> str:
+    value = row[ADMIN_USERS_ORDER_FIELDS[order_field][0]]
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+
+    return base64.urlsafe_b64encode(json.dumps([order_field, value, str(row['id'])]).encode()).decode()
+
+
+def decode_cursor(order_field: str, cursor: str):
+    try:
+        cursor_order_field, value, id_user = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_order_field != order_field:
+            raise ValueError(f'cursor is for {cursor_order_field}')
+
+        value = datetime.datetime.fromisoformat(value) if order_field == 'register_at' else int(value)
+        return value, uuid.UUID(id_user)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={"code": "INVALID_CURSOR", "message": "Invalid pagination cursor"})
+
+
+async def get_all_anonymous_users_with_bookmarked_sessions(order_field: Optional[str] = None,
+                                                           order_direction: Optional[models.SortOrder] = None,
+                                                           limit: Optional[int] = None,
+                                                           after: Optional[str] = None,
+                                                           min_bookmarks: int = 0,
+                                                           min_ratings: int = 0,
+                                                           registered_from: Optional[datetime.datetime] = None,
+                                                           registered_to: Optional[datetime.datetime] = None):
+    """
+    One page of anonymous users with their number of bookmarks and ratings, counted and sorted by Postgres.
+
+    :param order_field: register_at, bookmarks or nr_ratings, register_at if not given
+    :param order_direction: Ascending if not given
+    :param limit: Page size
+    :param after: Cursor returned as `next` with the previous page
+    :param min_bookmarks: Only users with at least this many bookmarks
+    :param min_ratings: Only users with at least this many ratings
+    :param registered_from: Only users registered at or after
+    :param registered_to: Only users registered before
+    :return: {'data': users of the page, 'next': cursor of the following page or None}
+    """
+    import shared.db
+
+    if not await models.Conference.exists():
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-    all_sessions = await models.EventSession.filter(conference=conference).prefetch_related('anonymous_rates',
-                                                                                            'lecturers',
-                                                                                            'anonymous_bookmarks').all()
+    if order_field not in ADMIN_USERS_ORDER_FIELDS:
+        order_field = 'register_at'
+    descending = order_direction == models.SortOrder.DESCENDING
+    limit = min(max(limit or ADMIN_USERS_PAGE_SIZE, 1), ADMIN_USERS_MAX_PAGE_SIZE)
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Title', 'Speakers', 'Bookmarks', 'Rates', 'Avg rate'])
+    column, column_type = ADMIN_USERS_ORDER_FIELDS[order_field]
 
-    for session in all_sessions:
-        title = session.title
-        speakers = ', '.join([lecturer.display_name for lecturer in session.lecturers])
-        bookmarks = len(session.anonymous_bookmarks)
-        rates = len(session.anonymous_rates)
-        avg_rate = sum([r.rate for r in session.anonymous_rates]) / len(
-            session.anonymous_rates) if session.anonymous_rates else None
+    params = [registered_from, registered_to, min_bookmarks, min_ratings, limit + 1]
+    condition = ''
+    if after:
+        params += decode_cursor(order_field, after)
+        condition = f"AND ({column}, id) {'<' if descending else '>'} ($6::{column_type}, $7::uuid)"
 
-        writer.writerow([title, speakers, bookmarks, rates, avg_rate])
+    sql = ADMIN_USERS_SQL.format(after=condition, order_field=column, direction='DESC' if descending else 'ASC')
+    rows = await shared.db.read_connection().execute_query_dict(sql, params)
 
-    output.seek(0)
+    # one row more than the page tells whether there is a next page
+    page = rows[:limit]
 
-    filename = f"sfs2024_sessions_on_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return {
+        'data': [
+            {
+                'id': str(row['id']),
+                'bookmarks': row['bookmarks'],
+                'nr_ratings': row['nr_ratings'],
+                'register_at': str(row['created'])
+            }
+            for row in page
+        ],
+        'next': encode_cursor(order_field, page[-1]) if len(rows) > limit else None
+    }
 
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={
-            'Content-Disposition': f'attachment; filename="{filename}"'
-        }
-    )
 
+# bookmarks, rates and average rate of the sessions of the current conference
+SESSION_STATS_SQL = """
+    SELECT s.title,
+           (SELECT string_agg(l.display_name, ', ' ORDER BY l.display_name)
+              FROM conferences_lecturers_conferences_event_sessions ls
+              JOIN conferences_lecturers l ON l.id = ls.conferences_lecturers_id
+             WHERE ls.eventsession_id = s.id) AS speakers,
+           (SELECT count(*) FROM conferences_anonymous_bookmarks b WHERE b.session_id = s.id) AS bookmarks,
+           r.rates,
+           r.avg_rate,
+           count(*) OVER () AS total
+      FROM conferences_event_sessions s
+      LEFT JOIN LATERAL (SELECT count(*) AS rates, avg(rate)::float AS avg_rate
+                           FROM conferences_anonymous_rates
+                          WHERE session_id = s.id) r ON true
+     WHERE s.conference_id = (SELECT id FROM conferences ORDER BY created DESC LIMIT 1)
+     ORDER BY {order_by}
+     {page}
+"""
+
+SESSIONS_EXPORT_SQL = SESSION_STATS_SQL.format(order_by='s.start_date, s.id', page='')
+
+SESSION_COUNT_SQL = """
+    SELECT count(*) AS total
+      FROM conferences_event_sessions
+     WHERE conference_id = (SELECT id FROM conferences ORDER BY created DESC LIMIT 1)
+"""
+
+SESSIONS_EXPORT_COLUMNS = {'title': 'Title', 'speakers': 'Speakers', 'bookmarks': 'Bookmarks', 'rates': 'Rates',
+                           'avg_rate': 'Avg rate'}
+
+
+async def export_sessions(export_format: str = 'csv'):
+    """
+    Stream the sessions of the current conference with their bookmarks and rates, as CSV or NDJSON.
+    """
+    import shared.db
+    import shared.export
+
+    if not await models.Conference.exists():
+        raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-async def get_sessions_by_rate(order_field: Optional[str] = None, order_direction: Optional[models.SortOrder] = None):
-    conference = await get_current_conference()
-    if not conference:
+    def values(row):
+        return [row['title'], row['speakers'] or '', row['bookmarks'], row['rates'], row['avg_rate']]
+
+    chunks = shared.export.export_chunks(export_format, shared.db.stream_rows(
+        SESSIONS_EXPORT_SQL, connection_name=shared.db.read_connection_name()),
+                                         SESSIONS_EXPORT_COLUMNS, values)
+    return export_response(export_format, chunks, 'sessions')
+
+
+# sortable fields of /api/admin/sessions
+SESSION_RANKING_ORDER_FIELDS = ('avg_rate', 'bookmarks', 'rates')
+
+
+async def get_sessions_by_rate(order_field: Optional[str] = None, order_direction: Optional[models.SortOrder] = None,
+                               limit: Optional[int] = None, offset: int = 0):
+    """
+    Sessions of the current conference ranked by Postgres.
+
+    :param order_field: avg_rate, bookmarks or rates, schedule order if not given
+    :param order_direction: ascend lists the highest values first (as the admin UI always did), unrated last
+    :param limit: Page size, all sessions if not given
+    :param offset: Sessions skipped before the page
+    :return: {'data': sessions of the page, 'total': number of all sessions}
+    """
+    import shared.db
+
+    if not await models.Conference.exists():
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-    # Fetch all sessions related to the current conference
-    all_sessions = await models.EventSession.filter(
-        conference=conference
-    ).prefetch_related('anonymous_rates', 'lecturers', 'anonymous_bookmarks').all()
-
-    # Prepare session data
-    sessions_data = [
-        {
-            'title': session.title,
-            'bookmarks': len(session.anonymous_bookmarks),
-            'speakers': ', '.join([lecturer.display_name for lecturer in session.lecturers]),
-            'rates': len(session.anonymous_rates),
-            'avg_rate': sum(r.rate for r in session.anonymous_rates) / len(
-                session.anonymous_rates) if session.anonymous_rates else None
-        }
-        for session in all_sessions
-    ]
+    order_by = 's.start_date, s.id'
+    if order_field in SESSION_RANKING_ORDER_FIELDS and order_direction:
+        direction = 'ASC' if order_direction == models.SortOrder.DESCENDING else 'DESC'
+        order_by = f'{order_field} {direction} NULLS LAST, {order_by}'
+
+    connection = shared.db.read_connection()
+    sql = SESSION_STATS_SQL.format(order_by=order_by, page='LIMIT $1 OFFSET $2')
+    rows = await connection.execute_query_dict(sql, [limit, max(offset, 0)])
+
+    if rows:
+        total = rows[0]['total']
+    else:
+        # past the last page there is no row to carry the count
+        total = (await connection.execute_query_dict(SESSION_COUNT_SQL))[0]['total']
+
+    return {
+        'data': [
+            {
+                'title': row['title'],
+                'bookmarks': row['bookmarks'],
+                'speakers': row['speakers'] or '',
+                'rates': row['rates'],
+                'avg_rate': row['avg_rate']
+            }
+            for row in rows
+        ],
+        'total': total
+    }
 
-    # Apply sorting if specified
-    if order_field and order_direction:
-        reverse = order_direction == models.SortOrder.DESCENDING
 
-        # Sorting for different fields
-        if order_field == 'avg_rate':
-            rated_sessions = [s for s in sessions_data if s['avg_rate'] is not None]
-            unrated_sessions = [s for s in sessions_data if s['avg_rate'] is None]
+# the admin summary is served from memory for this many seconds, and reloaded in the background for as long again
+EVENT_SUMMARY_TTL = float(os.getenv('EVENT_SUMMARY_TTL', 10))
+EVENT_SUMMARY_STALE_TTL = float(os.getenv('EVENT_SUMMARY_STALE_TTL', 60))
 
-            rated_sessions.sort(key=lambda x: -x['avg_rate'], reverse=reverse)
+# counted by Postgres for the latest conference, in one round-trip
+EVENT_SUMMARY_SQL = """
+    WITH conference AS (SELECT id FROM conferences ORDER BY created DESC LIMIT 1)
+    SELECT (SELECT id FROM conference) AS id_conference,
+           (SELECT count(*) FROM conferences_users_anonymous) AS all_users,
+           (SELECT count(*)
+              FROM conferences_event_sessions s
+             WHERE s.conference_id = (SELECT id FROM conference)) AS total_sessions,
+           (SELECT count(*)
+              FROM conferences_anonymous_bookmarks b
+              JOIN conferences_event_sessions s ON s.id = b.session_id
+             WHERE s.conference_id = (SELECT id FROM conference)) AS total_bookmarks,
+           (SELECT count(*)
+              FROM conferences_anonymous_rates r
+              JOIN conferences_event_sessions s ON s.id = r.session_id
+             WHERE s.conference_id = (SELECT id FROM conference)) AS total_rates
+"""
 
-            sessions_data = rated_sessions + unrated_sessions
-        elif order_field == 'bookmarks':
-            sessions_data.sort(
-                key=lambda x: (x['bookmarks'] is None, -x['bookmarks'] if x['bookmarks'] is not None else 0),
-                reverse=reverse)
-        elif order_field == 'rates':
-            sessions_data.sort(key=lambda x: (x['rates'] is None, -x['rates'] if x['rates'] is not None else 0),
-                               reverse=reverse)
 
-    return sessions_data
+@shared.cache.stale_while_revalidate(EVENT_SUMMARY_TTL, EVENT_SUMMARY_STALE_TTL)
+async def event_summary():
+    import shared.db
+
+    rows = await shared.db.read_connection().execute_query_dict(EVENT_SUMMARY_SQL)
+    return rows[0]
 
 
 async def get_event_summary():
-    conference = await get_current_conference()
-    if not conference:
+    summary = await event_summary()
+    if not summary['id_conference']:
         raise HTTPException(status_code=404, detail={"code": "CONFERENCE_NOT_FOUND", "message": "Conference not found"})
 
-    all_users = await models.UserAnonymous.all()
-    all_sessions = await models.EventSession.filter(conference=conference).all()
-    all_bookmarks = await models.AnonymousBookmark.filter(session__conference=conference).all()
-    all_rates = await models.AnonymousRate.filter(session__conference=conference).all()
-
     return {
-        'all_users': len(all_users),
-        'total_sessions': len(all_sessions),
-        'total_bookmarks': len(all_bookmarks),
-        'total_rates': len(all_rates)
+        'all_users': summary['all_users'],
+        'total_sessions': summary['total_sessions'],
+        'total_bookmarks': summary['total_bookmarks'],
+        'total_rates': summary['total_rates']
     }
 
 
@@ -966,7 +1348,10 @@ async def authorize_user(push_notification_token: str = None):
 
 
 async def get_user(id_user: uuid.UUID):
-    return await models.UserAnonymous.filter(id=id_user).get_or_none()
+    from tortoise import connections
+
+    # users authorize and read right away, the replica may not have them yet
+    return await models.UserAnonymous.filter(id=id_user).using_db(connections.get('default')).get_or_none()
 
 
 async def bookmark_session(id_user, id_session):
@@ -985,18 +1370,89 @@ async def bookmark_session(id_user, id_session):
     except Exception as e:
         raise
 
+    token = {str(session.id): user.push_notification_token} if user.push_notification_token else {}
+
     if not current_bookmark:
         await models.AnonymousBookmark.create(user=user, session=session)
+        await update_bookmark_in_redis(session, 1, added=token)
         return {'bookmarked': True}
     else:
         await current_bookmark.delete()
+        if await shares_bookmark(user.push_notification_token, session.id):
+            token = {}
+        await update_bookmark_in_redis(session, -1, removed=token)
     return {'bookmarked': False}
 
 
+async def update_bookmark_in_redis(session, delta: int, added: Optional[dict] = None, removed: Optional[dict] = None):
+    # subscribers and leaderboard go in one round trip, both are marked out of sync if it fails
+    from .leaderboards import Leaderboards, ready_key
+    from .subscribers import SUBSCRIBERS_READY_KEY, SessionSubscribers, write_or_invalidate
+
+    subscribers = SessionSubscribers()
+    leaderboards = Leaderboards(subscribers.redis_client)
+
+    def queue_writes(pipe):
+        subscribers.queue_update(pipe, added or {}, removed or {})
+        leaderboards.queue_bookmark(pipe, session, delta)
+
+    await write_or_invalidate(subscribers.redis_client, queue_writes,
+                              [SUBSCRIBERS_READY_KEY, ready_key(session.conference_id)], 'bookmark')
+
+
+async def shares_bookmark(push_notification_token, id_session):
+    # several anonymous users can share a device token, which stays subscribed while any of them bookmarks the session
+    if not push_notification_token:
+        return False
+
+    return await models.AnonymousBookmark.filter(session_id=id_session,
+                                                 user__push_notification_token=push_notification_token).exists()
+
+
+async def store_notification_token(id_user, push_notification_token: Optional[str]):
+    user = await models.UserAnonymous.filter(id=id_user).get_or_none()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"code": "USER_NOT_FOUND", "message": "user not found"})
+
+    old_token = user.push_notification_token
+    user.push_notification_token = push_notification_token
+    await user.save()
+
+    if old_token == push_notification_token:
+        return
+
+    from .subscribers import SessionSubscribers
+
+    bookmarked_sessions = [str(id_session) for id_session in
+                           await models.AnonymousBookmark.filter(user=user).values_list('session_id', flat=True)]
+
+    removed = {}
+    if old_token:
+        # the user has the new token already, so these are bookmarks of other users on the same device
+        still_subscribed = {str(id_session) for id_session in await models.AnonymousBookmark.filter(
+            session_id__in=bookmarked_sessions, user__push_notification_token=old_token).values_list('session_id',
+                                                                                                  flat=True)}
+        removed = {id_session: old_token for id_session in bookmarked_sessions if id_session not in still_subscribed}
+
+    added = {id_session: push_notification_token for id_session in bookmarked_sessions} \
+        if push_notification_token else {}
+
+    await SessionSubscribers().update(added, removed)
+
+
 def now():
     return datetime.datetime.now()
 
 
+# number and average of the ratings of one session, aggregated by Postgres whatever the number of votes
+SESSION_RATING_SQL = """
+    SELECT count(*) AS total_rates, COALESCE(avg(rate)::float, 0) AS avg_rate
+      FROM conferences_anonymous_rates
+     WHERE session_id = $1
+"""
+
+
 async def rate_session(id_user, id_session, rate):
     if rate < 1 or rate > 5:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -1036,11 +1492,17 @@ async def rate_session(id_user, id_session, rate):
             await current_rate.update_from_dict({'rate': rate})
             await current_rate.save()
 
-    all_rates = await models.AnonymousRate.filter(session=session).all()
-    avg_rate = sum([rate.rate for rate in all_rates]) / len(all_rates) if all_rates else 0
+    from tortoise import connections
+
+    # on the primary, the rate was written a moment ago
+    rows = await connections.get('default').execute_query_dict(SESSION_RATING_SQL, [session.id])
+    avg_rate, total_rates = rows[0]['avg_rate'], rows[0]['total_rates']
+
+    from .leaderboards import Leaderboards
+    await Leaderboards().rate(session, total_rates, avg_rate)
 
     return {'avg_rate': avg_rate,
-            'total_rates': len(all_rates),
+            'total_rates': total_rates,
             }
 
 
@@ -1079,7 +1541,14 @@ async def opencon_serialize_anonymous(user_id, conference, last_updated=None):
             # session.anonymous_rates.nr_votes]
 
     if user_id:
-        user = await models.UserAnonymous.filter(id=user_id).prefetch_related('bookmarks', 'rates').get_or_none()
+        from tortoise import connections
+        from tortoise.query_utils import Prefetch
+
+        # own bookmarks and rates come from the primary, so they are never older than the user's last toggle
+        primary = connections.get('default')
+        user = await models.UserAnonymous.filter(id=user_id).using_db(primary).prefetch_related(
+            Prefetch('bookmarks', queryset=models.AnonymousBookmark.all().using_db(primary)),
+            Prefetch('rates', queryset=models.AnonymousRate.all().using_db(primary))).get_or_none()
         bookmarks = [bookmark.session_id for bookmark in user.bookmarks]
         conference_avg_rating['my_rate_by_session'] = {str(rate.session_id): rate.rate for rate in user.rates}
     else:
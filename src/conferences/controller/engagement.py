@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import datetime
+import logging
+import os
+from typing import Dict, Optional
+
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+import conferences.models as models
+
+log = logging.getLogger('conference_logger')
+
+ENGAGEMENT_ROLLUP_INTERVAL = int(os.getenv('ENGAGEMENT_ROLLUP_INTERVAL', 60))
+
+# metric -> table of timestamped rows it counts
+ENGAGEMENT_METRICS = {
+    'bookmarks': 'conferences_anonymous_bookmarks',
+    'ratings': 'conferences_anonymous_rates',
+    'users': 'conferences_users_anonymous',
+}
+
+# start of the newest minute bucket of every metric, rows from there on are (re)counted by the next rollup
+WATERMARKS_SQL = """
+    SELECT metric, max(bucket) AS bucket
+      FROM conferences_engagement_buckets
+     WHERE resolution = 'minute'
+     GROUP BY metric
+"""
+
+# only reads the created index of the table, from the watermark on; bookmarks and rates from before
+# created was recorded have none, they are not counted instead of showing up as one spike on migration day
+MINUTE_ROLLUP_SQL = """
+    INSERT INTO conferences_engagement_buckets (metric, resolution, bucket, count)
+    SELECT $1, 'minute', date_trunc('minute', created), count(*)
+      FROM {table}
+     WHERE created IS NOT NULL
+       AND ($2::timestamptz IS NULL OR created >= $2)
+     GROUP BY date_trunc('minute', created)
+        ON CONFLICT (metric, resolution, bucket) DO UPDATE SET count = EXCLUDED.count
+"""
+
+# hours are summed up from minutes, never from raw rows
+HOUR_ROLLUP_SQL = """
+    INSERT INTO conferences_engagement_buckets (metric, resolution, bucket, count)
+    SELECT metric, 'hour', date_trunc('hour', bucket), sum(count)
+      FROM conferences_engagement_buckets
+     WHERE resolution = 'minute'
+       AND metric = $1
+       AND ($2::timestamptz IS NULL OR bucket >= date_trunc('hour', $2::timestamptz))
+     GROUP BY metric, date_trunc('hour', bucket)
+        ON CONFLICT (metric, resolution, bucket) DO UPDATE SET count = EXCLUDED.count
+"""
+
+
+async def rollup():
+    """
+    Bring the per-minute and per-hour buckets of all metrics up to date.
+
+    The newest bucket of every metric is counted again, as rows kept arriving after its last rollup.
+    """
+    watermarks = {row['metric']: row['bucket'] for row in
+                  await connections.get('default').execute_query_dict(WATERMARKS_SQL)}
+
+    for metric, table in ENGAGEMENT_METRICS.items():
+        async with in_transaction() as connection:
+            await connection.execute_query(MINUTE_ROLLUP_SQL.format(table=table), [metric, watermarks.get(metric)])
+            await connection.execute_query(HOUR_ROLLUP_SQL, [metric, watermarks.get(metric)])
+
+
+async def run(stop: asyncio.Event, interval: float = ENGAGEMENT_ROLLUP_INTERVAL):
+    while not stop.is_set():
+        try:
+            await rollup()
+        except Exception as e:
+            log.critical(f'Error rolling up engagement :: {str(e)}')
+
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def get_engagement(resolution: models.BucketResolution = models.BucketResolution.HOUR,
+                         since: Optional[datetime.datetime] = None,
+                         until: Optional[datetime.datetime] = None) -> Dict:
+    """
+    Series of new bookmarks, ratings and users, read from the rollups only.
+
+    :param resolution: minute or hour
+    :param since: First bucket
+    :param until: Buckets before
+    :return: {'resolution': ..., 'series': {metric: [{'bucket', 'count'}, ...]}}
+    """
+    buckets = models.EngagementBucket.filter(resolution=models.BucketResolution(resolution).value)
+    if since:
+        buckets = buckets.filter(bucket__gte=since)
+    if until:
+        buckets = buckets.filter(bucket__lt=until)
+
+    series = {metric: [] for metric in ENGAGEMENT_METRICS}
+    for bucket in await buckets.order_by('bucket').values('metric', 'bucket', 'count'):
+        series[bucket['metric']].append({'bucket': bucket['bucket'].isoformat(), 'count': bucket['count']})
+
+    return {'resolution': models.BucketResolution(resolution).value, 'series': series}
@@ -0,0 +1,172 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import logging
+from typing import List, Optional, Tuple
+
+from .subscribers import decode, redis_handler, write_or_invalidate
+
+log = logging.getLogger('conference_logger')
+
+LEADERBOARD_KEY_PREFIX = 'leaderboard:'
+# boards are built under these keys and renamed over the live ones when complete
+REBUILD_KEY_PREFIX = 'leaderboard-rebuild:'
+
+# boards: bookmarks (number of bookmarks), rates (number of ratings) and rating (average rating)
+BOARDS = ('bookmarks', 'rates', 'rating')
+
+# one row per session with everything the boards are built from
+LEADERBOARD_SESSIONS_SQL = """
+    SELECT s.id, s.conference_id, s.track_id, s.start_date,
+           (SELECT count(*) FROM conferences_anonymous_bookmarks b WHERE b.session_id = s.id) AS bookmarks,
+           r.rates,
+           r.rating
+      FROM conferences_event_sessions s
+      LEFT JOIN LATERAL (SELECT count(*) AS rates, avg(rate)::float AS rating
+                           FROM conferences_anonymous_rates
+                          WHERE session_id = s.id) r ON true
+     WHERE ($1::uuid IS NULL OR s.conference_id = $1)
+"""
+
+
+def session_day(start_date) -> str:
+    return start_date.strftime('%Y-%m-%d')
+
+
+def scopes(id_track, start_date) -> List[str]:
+    # every session is ranked in the whole conference, on its day, in its track and in its track on its day
+    day = session_day(start_date)
+    return ['all', f'day:{day}', f'track:{id_track}', f'day:{day}:track:{id_track}']
+
+
+def scope(day: Optional[str] = None, id_track: Optional[str] = None) -> str:
+    if day and id_track:
+        return f'day:{day}:track:{id_track}'
+    if day:
+        return f'day:{day}'
+    if id_track:
+        return f'track:{id_track}'
+    return 'all'
+
+
+def leaderboard_key(id_conference, board: str, board_scope: str) -> str:
+    return f'{LEADERBOARD_KEY_PREFIX}{id_conference}:{board}:{board_scope}'
+
+
+def ready_key(id_conference) -> str:
+    return f'{LEADERBOARD_KEY_PREFIX}{id_conference}:ready'
+
+
+class Leaderboards:
+    """
+    Redis sorted sets ranking the sessions of a conference by bookmarks, number of ratings and average rating.
+
+    Updated on every bookmark toggle and rating, each update and each top-N read is O(log n).
+    As with the session subscribers Postgres stays the source of truth: a failed update drops
+    the ready marker of the conference, and readers ask Postgres until the boards are rebuilt.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_handler(redis_client)
+        self.redis = self.redis_client.redis_client
+
+    async def is_ready(self, id_conference) -> bool:
+        return bool(await self.redis.exists(ready_key(id_conference)))
+
+    async def invalidate(self, id_conference):
+        try:
+            await self.redis.delete(ready_key(id_conference))
+        except Exception as e:
+            log.critical(f'Error invalidating leaderboards of {id_conference} :: {str(e)}')
+
+    def queue_bookmark(self, pipe, session, delta: int):
+        for board_scope in scopes(session.track_id, session.start_date):
+            pipe.zincrby(leaderboard_key(session.conference_id, 'bookmarks', board_scope), delta, str(session.id))
+
+    async def bookmark(self, session, delta: int):
+        """
+        :param session: EventSession which was bookmarked (delta 1) or unbookmarked (delta -1)
+        """
+        await write_or_invalidate(self.redis_client, lambda pipe: self.queue_bookmark(pipe, session, delta),
+                                  [ready_key(session.conference_id)], 'bookmarks leaderboard')
+
+    async def rate(self, session, rates: int, rating: float):
+        """
+        :param session: EventSession which was rated
+        :param rates: Number of ratings of the session
+        :param rating: Average rating of the session
+        """
+        def queue_writes(pipe):
+            for board_scope in scopes(session.track_id, session.start_date):
+                pipe.zadd(leaderboard_key(session.conference_id, 'rates', board_scope), {str(session.id): rates})
+                pipe.zadd(leaderboard_key(session.conference_id, 'rating', board_scope), {str(session.id): rating})
+
+        await write_or_invalidate(self.redis_client, queue_writes, [ready_key(session.conference_id)],
+                                  'rating leaderboards')
+
+    async def top(self, id_conference, board: str, day: Optional[str] = None, id_track: Optional[str] = None,
+                  limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        :return: Up to limit (session id, score) with the highest scores, sessions scored 0 are left out
+        """
+        entries = await self.redis.zrevrangebyscore(leaderboard_key(id_conference, board, scope(day, id_track)),
+                                                    '+inf', '(0', start=0, num=limit, withscores=True)
+        return [(decode(id_session), score) for id_session, score in entries]
+
+    async def rebuild(self, id_conference=None, batch_size: Optional[int] = None) -> int:
+        """
+        Reconstruct the boards of one conference, or of all conferences, from Postgres.
+
+        The boards are built under temporary keys and swapped in with one transaction, so readers
+        keep getting the old boards until then instead of empty or half built ones.
+
+        :return: Number of sessions written
+        """
+        import uuid
+
+        import shared.db
+        from shared.redis_client import PIPELINE_BATCH_SIZE
+
+        batch_size = batch_size or PIPELINE_BATCH_SIZE
+        prefix = f'{LEADERBOARD_KEY_PREFIX}{id_conference}:' if id_conference else LEADERBOARD_KEY_PREFIX
+        build_prefix = f'{REBUILD_KEY_PREFIX}{uuid.uuid4().hex}:'
+
+        nr_sessions = 0
+        built_keys = set()
+        conferences = {str(id_conference)} if id_conference else set()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            async for row in shared.db.stream_rows(LEADERBOARD_SESSIONS_SQL, [id_conference]):
+                conferences.add(str(row['conference_id']))
+                for board_scope in scopes(row['track_id'], row['start_date']):
+                    for board in BOARDS:
+                        if row[board]:
+                            key = leaderboard_key(row['conference_id'], board, board_scope)
+                            pipe.zadd(build_prefix + key, {str(row['id']): row[board]})
+                            built_keys.add(key)
+
+                nr_sessions += 1
+                if nr_sessions % batch_size == 0:
+                    await pipe.execute()
+            await pipe.execute()
+
+            # boards which are not built anymore (sessions moved or removed) go with the swap
+            stale_keys = [key for key in [decode(key) async for key in self.redis.scan_iter(match=f'{prefix}*')]
+                          if key not in built_keys and not key.endswith(':ready')]
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key in built_keys:
+                    pipe.rename(build_prefix + key, key)
+                if stale_keys:
+                    pipe.delete(*stale_keys)
+                for id_built_conference in conferences:
+                    pipe.set(ready_key(id_built_conference), 1)
+                await pipe.execute()
+        except Exception:
+            build_keys = [key async for key in self.redis.scan_iter(match=f'{build_prefix}*')]
+            for i in range(0, len(build_keys), batch_size):
+                await self.redis.delete(*build_keys[i:i + batch_size])
+            raise
+
+        log.info(f"REBUILT LEADERBOARDS OF {nr_sessions} SESSIONS")
+        return nr_sessions
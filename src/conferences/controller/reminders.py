@@ -0,0 +1,182 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import datetime
+import heapq
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import tortoise.timezone
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+from .conference import clean_text
+
+log = logging.getLogger('conference_logger')
+
+REMINDER_LEAD_TIME = datetime.timedelta(minutes=int(os.getenv('REMINDER_LEAD_MINUTES', 5)))
+
+# how far ahead sessions are loaded into the scheduler, and how often it is reloaded to pick up reschedules
+REMINDER_HORIZON = datetime.timedelta(hours=2)
+REMINDER_RELOAD_INTERVAL = datetime.timedelta(minutes=1)
+
+REMINDER_MAX_SLEEP = 30
+
+# claims due sessions and marks them in one statement, so concurrent schedulers never claim the same session.
+# The claim is committed only after the reminders are enqueued, the rows stay locked meanwhile
+CLAIM_DUE_SESSIONS_SQL = """
+    UPDATE conferences_event_sessions s
+       SET notification5min_sent = TRUE
+      FROM conferences_rooms r
+     WHERE r.id = s.room_id
+       AND s.start_date > $1
+       AND s.start_date <= $2
+       AND s.bookmarkable
+       AND s.notification5min_sent IS NOT TRUE
+ RETURNING s.id, s.title, r.name AS room
+"""
+
+UPCOMING_SESSIONS_SQL = """
+    SELECT id, start_date
+      FROM conferences_event_sessions
+     WHERE start_date > $1
+       AND start_date <= $2
+       AND bookmarkable
+       AND notification5min_sent IS NOT TRUE
+"""
+
+BOOKMARKERS_SQL = """
+    SELECT DISTINCT u.push_notification_token AS token, b.session_id
+      FROM conferences_anonymous_bookmarks b
+      JOIN conferences_users_anonymous u ON u.id = b.user_id
+     WHERE b.session_id = ANY($1::uuid[])
+       AND u.push_notification_token IS NOT NULL
+"""
+
+
+def current_time() -> datetime.datetime:
+    # session times are imported as local wall-clock times, see add_sessions
+    return tortoise.timezone.make_aware(datetime.datetime.now())
+
+
+class SessionReminderScheduler:
+    """
+    Sends "session starts in 5 minutes" push notifications to everyone who bookmarked a session.
+
+    Upcoming sessions are kept in a heap ordered by reminder time, reloaded every REMINDER_RELOAD_INTERVAL.
+    The heap tells the scheduler when to wake up and whether anything is due, only then are due sessions
+    claimed in the database, which stays the single source of truth across nodes and reschedules.
+    A session moved closer is picked up with the next reload.
+    """
+
+    def __init__(self, lead_time: datetime.timedelta = REMINDER_LEAD_TIME, redis_client=None):
+        self.lead_time = lead_time
+        self.heap: List[Tuple[datetime.datetime, str]] = []
+        self.loaded_at: Optional[datetime.datetime] = None
+        self.redis_client = redis_client
+
+    def schedule(self, sessions):
+        self.heap = [(start_date - self.lead_time, str(id_session)) for id_session, start_date in sessions]
+        heapq.heapify(self.heap)
+
+    async def load(self, now: datetime.datetime):
+        conn = connections.get('default')
+        rows = await conn.execute_query_dict(UPCOMING_SESSIONS_SQL, [now, now + REMINDER_HORIZON])
+
+        self.schedule((row['id'], row['start_date']) for row in rows)
+        self.loaded_at = now
+
+    def next_reminder_at(self) -> Optional[datetime.datetime]:
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: datetime.datetime) -> List[str]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        return due
+
+    async def claim_due_sessions(self, conn, now: datetime.datetime):
+        return await conn.execute_query_dict(CLAIM_DUE_SESSIONS_SQL, [now, now + self.lead_time])
+
+    async def send_reminders(self, conn, sessions) -> int:
+        """
+        Enqueue the reminders of claimed sessions, falling back to the spool while Redis is down.
+
+        :param conn: Connection of the transaction the sessions were claimed in
+        :return: Number of enqueued push notifications
+        """
+        if not sessions:
+            return 0
+
+        sessions_by_id = {str(session['id']): session for session in sessions}
+        messages = {id_session: f"Session '{clean_text(session['title'])}' starts in "
+                                f"{int(self.lead_time.total_seconds() // 60)} minutes in room {session['room']}"
+                    for id_session, session in sessions_by_id.items()}
+
+        bookmarkers = await conn.execute_query_dict(BOOKMARKERS_SQL, [list(sessions_by_id.keys())])
+
+        pn_payloads = [{'id': row['token'],
+                        'expo_push_notification_token': row['token'],
+                        'subject': "Session starts soon",
+                        'message': messages[str(row['session_id'])],
+                        'data': {
+                            'command': 'SESSION_STARTS_SOON',
+                            'session_id': str(row['session_id']),
+                        }} for row in bookmarkers]
+
+        if pn_payloads:
+            from shared.redis_client import AsyncRedisClientHandler
+            redis_client = self.redis_client or AsyncRedisClientHandler.get_redis_client()
+
+            log.info(f"SENDING {len(pn_payloads)} REMINDERS FOR {len(sessions)} SESSIONS")
+            enqueued = await redis_client.add_stream_messages('opencon_push_notification', pn_payloads)
+            if enqueued < len(pn_payloads):
+                # rolls the claim back, the sessions are claimed again on the next tick
+                raise Exception(f"only {enqueued} of {len(pn_payloads)} reminders could be enqueued or spooled")
+
+        return len(pn_payloads)
+
+    async def tick(self, now: datetime.datetime) -> int:
+        """
+        Send reminders for all sessions starting within the lead time which were not reminded yet.
+
+        :return: Number of enqueued push notifications
+        """
+        if not self.loaded_at or now - self.loaded_at >= REMINDER_RELOAD_INTERVAL:
+            await self.load(now)
+
+        if not self.pop_due(now):
+            return 0
+
+        try:
+            return await self.send_due_reminders(now)
+        except Exception:
+            # the sessions stay unclaimed, they are loaded again to be retried with the next tick
+            self.loaded_at = None
+            raise
+
+    async def send_due_reminders(self, now: datetime.datetime) -> int:
+        # a failure or a crash before the commit leaves the sessions unclaimed, they may be reminded twice but not lost
+        async with in_transaction() as conn:
+            return await self.send_reminders(conn, await self.claim_due_sessions(conn, now))
+
+    def seconds_to_next_tick(self, now: datetime.datetime) -> float:
+        next_reminder_at = self.next_reminder_at()
+        if not next_reminder_at:
+            return REMINDER_MAX_SLEEP
+
+        return min(REMINDER_MAX_SLEEP, max(0.0, (next_reminder_at - now).total_seconds()))
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await self.tick(current_time())
+            except Exception as e:
+                log.critical(f'Error sending session reminders :: {str(e)}')
+
+            try:
+                await asyncio.wait_for(stop.wait(), self.seconds_to_next_tick(current_time()))
+            except asyncio.TimeoutError:
+                pass
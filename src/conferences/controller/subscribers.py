@@ -0,0 +1,208 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import redis
+
+log = logging.getLogger('conference_logger')
+
+SUBSCRIBERS_KEY_PREFIX = 'session_subscribers:'
+
+# set only while the subscriber sets are complete, fan-out falls back to Postgres without it
+SUBSCRIBERS_READY_KEY = 'session_subscribers_ready'
+
+# sets are rebuilt under these keys and renamed over the live ones when complete
+REBUILD_KEY_PREFIX = 'session_subscribers_rebuild:'
+
+SUBSCRIBERS_SQL = """
+    SELECT DISTINCT u.push_notification_token AS token, b.session_id
+      FROM conferences_anonymous_bookmarks b
+      JOIN conferences_users_anonymous u ON u.id = b.user_id
+     WHERE u.push_notification_token IS NOT NULL
+"""
+
+
+def subscribers_key(id_session) -> str:
+    return f'{SUBSCRIBERS_KEY_PREFIX}{id_session}'
+
+
+def redis_handler(redis_client=None):
+    from shared.redis_client import AsyncRedisClientHandler
+    return redis_client or AsyncRedisClientHandler.get_redis_client()
+
+
+async def write_or_invalidate(redis_client, queue_writes: Callable, ready_keys: List[str], name: str) -> bool:
+    """
+    Send writes to Redis in one transaction, or drop the ready markers of the data they keep in sync.
+
+    While the spool of the client bypasses Redis the writes are not tried at all, and after a connection
+    error they are not retried. The markers are deleted through the spool once Redis is back, so
+    a request waits for at most one failed round trip during an outage.
+
+    :param redis_client: AsyncRedisClientHandler
+    :param queue_writes: Called with the pipeline to queue the writes on
+    :param ready_keys: Markers of the data which is out of sync when the writes are lost
+    :param name: What is written, for the log
+    :return: False if the writes were not made
+    """
+    spool = redis_client.spool
+    if spool and spool.bypass_redis():
+        spool.append('del', ready_keys[0], ready_keys)
+        return False
+
+    try:
+        async with redis_client.redis_client.pipeline(transaction=True) as pipe:
+            queue_writes(pipe)
+            await pipe.execute()
+        return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+        log.critical(f'Error updating {name} :: {str(e)}')
+        if spool:
+            spool.mark_failed()
+            spool.append('del', ready_keys[0], ready_keys)
+            return False
+    except Exception as e:
+        log.critical(f'Error updating {name} :: {str(e)}')
+
+    try:
+        await redis_client.redis_client.delete(*ready_keys)
+    except Exception as e:
+        log.critical(f'Error invalidating {name} :: {str(e)}')
+    return False
+
+
+def decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class SessionSubscribers:
+    """
+    Redis sets of push notification tokens per session, kept in sync with bookmarks and tokens.
+
+    Postgres stays the source of truth. Every failed update drops the ready marker,
+    so fan-out reads from Postgres again until the sets are rebuilt.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_handler(redis_client)
+        self.redis = self.redis_client.redis_client
+
+    async def is_ready(self) -> bool:
+        return bool(await self.redis.exists(SUBSCRIBERS_READY_KEY))
+
+    async def invalidate(self):
+        try:
+            await self.redis.delete(SUBSCRIBERS_READY_KEY)
+        except Exception as e:
+            log.critical(f'Error invalidating session subscribers :: {str(e)}')
+
+    def queue_update(self, pipe, added: Dict[str, str], removed: Dict[str, str]):
+        for id_session, token in removed.items():
+            pipe.srem(subscribers_key(id_session), token)
+        for id_session, token in added.items():
+            pipe.sadd(subscribers_key(id_session), token)
+
+    async def update(self, added: Dict[str, str], removed: Dict[str, str]):
+        """
+        :param added: session id -> token to add
+        :param removed: session id -> token to remove
+        """
+        if not added and not removed:
+            return
+
+        await write_or_invalidate(self.redis_client, lambda pipe: self.queue_update(pipe, added, removed),
+                                  [SUBSCRIBERS_READY_KEY], 'session subscribers')
+
+    async def remove_tokens(self, tokens_by_session: Dict[str, Iterable[str]]):
+        """
+        :param tokens_by_session: session id -> tokens to remove, e.g. tokens Expo reported as not registered
+        """
+        tokens_by_session = {id_session: list(tokens) for id_session, tokens in tokens_by_session.items() if tokens}
+        if not tokens_by_session:
+            return
+
+        def queue_writes(pipe):
+            for id_session, tokens in tokens_by_session.items():
+                pipe.srem(subscribers_key(id_session), *tokens)
+
+        await write_or_invalidate(self.redis_client, queue_writes, [SUBSCRIBERS_READY_KEY], 'session subscribers')
+
+    async def subscribe(self, id_session, token: Optional[str]):
+        if token:
+            await self.update({str(id_session): token}, {})
+
+    async def unsubscribe(self, id_session, token: Optional[str]):
+        if token:
+            await self.update({}, {str(id_session): token})
+
+    async def remove_sessions(self, session_ids: Iterable):
+        keys = [subscribers_key(id_session) for id_session in session_ids]
+        if not keys:
+            return
+
+        await write_or_invalidate(self.redis_client, lambda pipe: pipe.delete(*keys), [SUBSCRIBERS_READY_KEY],
+                                  'session subscribers')
+
+    async def tokens_by_session(self, session_ids: Iterable) -> Dict[str, Set[str]]:
+        session_ids = [str(id_session) for id_session in session_ids]
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for id_session in session_ids:
+                pipe.smembers(subscribers_key(id_session))
+            members = await pipe.execute()
+
+        return {id_session: {decode(token) for token in tokens} for id_session, tokens in zip(session_ids, members)}
+
+    async def rebuild(self, batch_size: Optional[int] = None) -> int:
+        """
+        Reconstruct all subscriber sets from Postgres.
+
+        The sets are built under temporary keys and swapped in with one transaction, so fan-out keeps
+        reading the old sets until then, and updates made meanwhile are not undone by a half built set.
+
+        :return: Number of (token, session) pairs written
+        """
+        import uuid
+
+        import shared.db
+        from shared.redis_client import PIPELINE_BATCH_SIZE
+
+        batch_size = batch_size or PIPELINE_BATCH_SIZE
+        build_prefix = f'{REBUILD_KEY_PREFIX}{uuid.uuid4().hex}:'
+
+        nr_pairs = 0
+        built_keys = set()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            async for row in shared.db.stream_rows(SUBSCRIBERS_SQL):
+                key = subscribers_key(row['session_id'])
+                pipe.sadd(build_prefix + key, row['token'])
+                built_keys.add(key)
+
+                nr_pairs += 1
+                if nr_pairs % batch_size == 0:
+                    await pipe.execute()
+            await pipe.execute()
+
+            # sets of sessions nobody bookmarks anymore go with the swap
+            stale_keys = [key for key in
+                          [decode(key) async for key in self.redis.scan_iter(match=f'{SUBSCRIBERS_KEY_PREFIX}*')]
+                          if key not in built_keys]
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key in built_keys:
+                    pipe.rename(build_prefix + key, key)
+                if stale_keys:
+                    pipe.delete(*stale_keys)
+                pipe.set(SUBSCRIBERS_READY_KEY, 1)
+                await pipe.execute()
+        except Exception:
+            build_keys = [key async for key in self.redis.scan_iter(match=f'{build_prefix}*')]
+            for i in range(0, len(build_keys), batch_size):
+                await self.redis.delete(*build_keys[i:i + batch_size])
+            raise
+
+        log.info(f"REBUILT {nr_pairs} SESSION SUBSCRIBERS")
+        return nr_pairs
@@ -4,7 +4,6 @@
 from enum import Enum
 from typing import Dict
 
-import bs4
 from tortoise import fields
 from tortoise.models import Model
 
@@ -14,7 +13,7 @@ class UserAnonymous(Model):
         table = "conferences_users_anonymous"
 
     id = fields.UUIDField(pk=True)
-    created = fields.DatetimeField(auto_now_add=True)
+    created = fields.DatetimeField(auto_now_add=True, index=True)
     push_notification_token = fields.CharField(max_length=64, null=True)
 
 
@@ -22,8 +21,12 @@ class AnonymousBookmark(Model):
     class Meta:
         table = "conferences_anonymous_bookmarks"
         unique_together = (('user', 'session'),)
+        # bookmarks of a session, the unique constraint serves those of a user
+        indexes = (('session', 'user'),)
 
     id = fields.UUIDField(pk=True)
+    # unknown (NULL) for rows from before it was recorded, they are left out of the engagement rollups
+    created = fields.DatetimeField(auto_now_add=True, null=True, index=True)
     user = fields.ForeignKeyField('models.UserAnonymous', related_name='bookmarks')
     session = fields.ForeignKeyField('models.EventSession', related_name='anonymous_bookmarks')
 
@@ -32,8 +35,12 @@ class AnonymousRate(Model):
     class Meta:
         table = "conferences_anonymous_rates"
         unique_together = (('user', 'session'),)
+        # count and average of a session without reading the table
+        indexes = (('session', 'rate'),)
 
     id = fields.UUIDField(pk=True)
+    # unknown (NULL) for rows from before it was recorded, they are left out of the engagement rollups
+    created = fields.DatetimeField(auto_now_add=True, null=True, index=True)
     user = fields.ForeignKeyField('models.UserAnonymous', related_name='rates')
     session = fields.ForeignKeyField('models.EventSession', related_name='anonymous_rates')
 
@@ -43,6 +50,8 @@ class AnonymousRate(Model):
 class Conference(Model):
     class Meta:
         table = "conferences"
+        # the current conference is the latest one, imports look it up by source
+        indexes = (('created',), ('source_uri',), ('acronym', 'created'))
 
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
@@ -71,6 +80,7 @@ class Conference(Model):
 class Track(Model):
     class Meta:
         table = "conferences_tracks"
+        indexes = (('conference', 'name'),)
 
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
@@ -88,6 +98,7 @@ class Track(Model):
 class Location(Model):
     class Meta:
         table = "conferences_locations"
+        indexes = (('conference', 'slug'),)
 
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
@@ -102,6 +113,7 @@ class Location(Model):
 class Room(Model):
     class Meta:
         table = "conferences_rooms"
+        indexes = (('conference', 'location', 'slug'),)
 
     id = fields.UUIDField(pk=True)
     name = fields.TextField()
@@ -120,6 +132,8 @@ class EventSession(Model):
     class Meta:
         table = "conferences_event_sessions"
         unique_together = (('unique_id', 'conference'),)
+        # sessions of a conference in schedule order
+        indexes = (('conference', 'start_date'),)
         ordering = ['start_date']
 
     id = fields.UUIDField(pk=True)
@@ -183,6 +197,7 @@ class EventSession(Model):
 class ConferenceLecturer(Model):
     class Meta:
         table = "conferences_lecturers"
+        indexes = (('conference', 'external_id'),)
 
     id = fields.UUIDField(pk=True)
     slug = fields.CharField(max_length=255, null=False, index=True)
@@ -206,6 +221,9 @@ class ConferenceLecturer(Model):
         bio = bio.replace("\\r\\n", "\n")
         bio = bio.encode().decode('unicode_escape')  # PRESERVE unicode
 
+        # only the import pipeline cleans bios, api processes never load bs4
+        import bs4
+
         soup = bs4.BeautifulSoup(bio, features="html.parser")
         bio = soup.get_text()
         bio = bio.strip('"')
@@ -232,6 +250,30 @@ class SortOrder(str, Enum):
     ASCENDING = "ascend"
     DESCENDING = "descend"
 
+
+class Leaderboard(str, Enum):
+    BOOKMARKS = "bookmarks"
+    RATES = "rates"
+    RATING = "rating"
+
+
+class BucketResolution(str, Enum):
+    MINUTE = "minute"
+    HOUR = "hour"
+
+
+# number of new bookmarks, ratings or users within one minute or hour, maintained by the engagement rollup
+class EngagementBucket(Model):
+    class Meta:
+        table = "conferences_engagement_buckets"
+        unique_together = (('metric', 'resolution', 'bucket'),)
+
+    id = fields.IntField(pk=True)
+    metric = fields.CharField(max_length=16)
+    resolution = fields.CharField(max_length=8)
+    bucket = fields.DatetimeField()
+    count = fields.IntField(default=0)
+
 class Entrance(Model):
     class Meta:
         table = "conferences_entrances"
@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 
 import os
+from typing import Dict, List, Optional
 
 import dotenv
 
@@ -9,23 +10,68 @@ current_file_dir = os.path.dirname(os.path.abspath(__file__))
 
 try:
     dotenv.load_dotenv(current_file_dir + "/../.env")
-except Exceptio as e:
+except Exception as e:
     pass
-    
-DB_CONFIG = {
-    "connections": {
-        "default": f"postgres://"
-                   f"{os.getenv('DB_USERNAME')}:{os.getenv('DB_PASSWORD')}@"
-                   f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-    },
-    "apps": {
-        "models": {
-            "models": ["conferences.models" , "aerich.models"],
-            "default_connection": "default",
+
+# asyncpg pool of every process, the api has one per replica connection as well
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 5))
+# prepared statements cached per connection, 0 disables the cache (needed behind pgbouncer in transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+# seconds to connect, and to wait for a statement before it is cancelled (0 waits as long as it takes)
+DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', 60))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', 0)) or None
+# seconds after which idle pooled connections are closed
+DB_MAX_INACTIVE_CONNECTION_LIFETIME = float(os.getenv('DB_MAX_INACTIVE_CONNECTION_LIFETIME', 300))
+
+
+def db_credentials(prefix: str = 'DB', db_name: Optional[str] = None) -> Dict:
+    """
+    asyncpg credentials and pool settings, read from the environment.
+
+    :param prefix: DB for the primary, DB_REPLICA for the read replica, which defaults to the primary's settings
+    :param db_name: Database, defaults to DB_NAME
+    """
+    return {
+        'host': os.getenv(f'{prefix}_HOST', os.getenv('DB_HOST')),
+        'port': int(os.getenv(f'{prefix}_PORT', os.getenv('DB_PORT', 5432))),
+        'user': os.getenv(f'{prefix}_USERNAME', os.getenv('DB_USERNAME')),
+        'password': os.getenv(f'{prefix}_PASSWORD', os.getenv('DB_PASSWORD')),
+        'database': db_name or os.getenv('DB_NAME'),
+        'minsize': DB_POOL_MIN_SIZE,
+        'maxsize': DB_POOL_MAX_SIZE,
+        'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+        'timeout': DB_CONNECT_TIMEOUT,
+        'command_timeout': DB_COMMAND_TIMEOUT,
+        'max_inactive_connection_lifetime': DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+    }
+
+
+def db_config(db_name: Optional[str] = None, models: List[str] = ("conferences.models",),
+              replica: bool = False) -> Dict:
+    """
+    Tortoise configuration of the primary and, with replica and DB_REPLICA_HOST set, of the read replica.
+
+    Reads of read-only requests are routed to the replica by shared.db.ReplicaRouter.
+    """
+    config = {
+        "connections": {
+            "default": {"engine": "tortoise.backends.asyncpg", "credentials": db_credentials('DB', db_name)},
+        },
+        "apps": {
+            "models": {
+                "models": list(models),
+                "default_connection": "default",
+            }
         }
     }
-}
 
-import pprint
+    if replica and os.getenv('DB_REPLICA_HOST'):
+        config["connections"]["replica"] = {"engine": "tortoise.backends.asyncpg",
+                                            "credentials": db_credentials('DB_REPLICA', db_name)}
+        config["routers"] = ["shared.db.ReplicaRouter"]
+
+    return config
+
 
-pprint.pprint(DB_CONFIG)
+DB_CONFIG = db_config(models=["conferences.models", "aerich.models"])
@@ -18,7 +18,7 @@ def import_modules(svcs):
     for svc in svcs:
         svc_name = svc.split('.')[0]
 #        setup_file_logger(svc_name)
-        importlib.reload(importlib.import_module(svc))
+        importlib.import_module(svc)
 
 
 
@@ -0,0 +1,28 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "conferences_anonymous_bookmarks" ADD COLUMN IF NOT EXISTS "created" TIMESTAMPTZ;
+        ALTER TABLE "conferences_anonymous_rates" ADD COLUMN IF NOT EXISTS "created" TIMESTAMPTZ;
+        CREATE INDEX IF NOT EXISTS "idx_conferences_created_83e115" ON "conferences_users_anonymous" ("created");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_created_2b79ac" ON "conferences_anonymous_bookmarks" ("created");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_created_40518f" ON "conferences_anonymous_rates" ("created");
+        CREATE TABLE IF NOT EXISTS "conferences_engagement_buckets" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "metric" VARCHAR(16) NOT NULL,
+            "resolution" VARCHAR(8) NOT NULL,
+            "bucket" TIMESTAMPTZ NOT NULL,
+            "count" INT NOT NULL  DEFAULT 0,
+            CONSTRAINT "uid_conferences_metric_b43826" UNIQUE ("metric", "resolution", "bucket")
+        );"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "conferences_engagement_buckets";
+        DROP INDEX IF EXISTS "idx_conferences_created_40518f";
+        DROP INDEX IF EXISTS "idx_conferences_created_2b79ac";
+        DROP INDEX IF EXISTS "idx_conferences_created_83e115";
+        ALTER TABLE "conferences_anonymous_rates" DROP COLUMN IF EXISTS "created";
+        ALTER TABLE "conferences_anonymous_bookmarks" DROP COLUMN IF EXISTS "created";"""
@@ -0,0 +1,35 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_conferences_created_e4a789" ON "conferences" ("created");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_source__882c0b" ON "conferences" ("source_uri");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_acronym_8e2745" ON "conferences" ("acronym", "created");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_confere_722359" ON "conferences_tracks" ("conference_id", "name");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_confere_6bf9fd" ON "conferences_locations" ("conference_id", "slug");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_confere_8f2b78" ON "conferences_rooms" ("conference_id", "location_id", "slug");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_confere_a29df5" ON "conferences_event_sessions" ("conference_id", "start_date");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_confere_4efad6" ON "conferences_lecturers" ("conference_id", "external_id");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_session_3fd811" ON "conferences_anonymous_bookmarks" ("session_id", "user_id");
+        CREATE INDEX IF NOT EXISTS "idx_conferences_session_98cf64" ON "conferences_anonymous_rates" ("session_id", "rate");
+        CREATE INDEX IF NOT EXISTS "idx_lecturers_sessions_session" ON "conferences_lecturers_conferences_event_sessions" ("eventsession_id");
+        CREATE INDEX IF NOT EXISTS "idx_users_anonymous_push_token" ON "conferences_users_anonymous" ("push_notification_token") WHERE "push_notification_token" IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS "idx_event_sessions_unreminded" ON "conferences_event_sessions" ("start_date") WHERE "bookmarkable" AND "notification5min_sent" IS NOT TRUE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_event_sessions_unreminded";
+        DROP INDEX IF EXISTS "idx_users_anonymous_push_token";
+        DROP INDEX IF EXISTS "idx_lecturers_sessions_session";
+        DROP INDEX IF EXISTS "idx_conferences_session_98cf64";
+        DROP INDEX IF EXISTS "idx_conferences_session_3fd811";
+        DROP INDEX IF EXISTS "idx_conferences_confere_4efad6";
+        DROP INDEX IF EXISTS "idx_conferences_confere_a29df5";
+        DROP INDEX IF EXISTS "idx_conferences_confere_8f2b78";
+        DROP INDEX IF EXISTS "idx_conferences_confere_6bf9fd";
+        DROP INDEX IF EXISTS "idx_conferences_confere_722359";
+        DROP INDEX IF EXISTS "idx_conferences_acronym_8e2745";
+        DROP INDEX IF EXISTS "idx_conferences_source__882c0b";
+        DROP INDEX IF EXISTS "idx_conferences_created_e4a789";"""
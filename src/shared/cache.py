@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+log = logging.getLogger('conference_logger')
+
+
+class StaleWhileRevalidate:
+    """
+    In-process cache for the result of an async function without arguments.
+
+    Within ttl seconds the cached value is returned as is. For stale_ttl seconds after that the
+    cached value is still returned, while a single background task loads a fresh one. Older values
+    are not used, the caller waits for the load, which is shared by all concurrent callers.
+    """
+
+    def __init__(self, loader: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        self.value: Any = None
+        self.loaded_at: Optional[float] = None
+        self.loading: Optional[asyncio.Task] = None
+
+    def age(self) -> Optional[float]:
+        return None if self.loaded_at is None else time.monotonic() - self.loaded_at
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    async def load(self):
+        value = await self.loader()
+        self.value, self.loaded_at = value, time.monotonic()
+        return value
+
+    def start_loading(self) -> asyncio.Task:
+        # a load started on another event loop (e.g. by a previous test) can not be awaited here
+        if self.loading is None or self.loading.done() or self.loading.get_loop() is not asyncio.get_running_loop():
+            self.loading = asyncio.create_task(self.load())
+            self.loading.add_done_callback(self.loaded)
+        return self.loading
+
+    def loaded(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            log.critical(f'Error refreshing cached {self.loader.__name__} :: {str(task.exception())}')
+
+    async def get(self):
+        age = self.age()
+
+        if age is not None and age < self.ttl:
+            return self.value
+
+        if age is not None and age < self.ttl + self.stale_ttl:
+            self.start_loading()
+            return self.value
+
+        return await asyncio.shield(self.start_loading())
+
+
+def stale_while_revalidate(ttl: float, stale_ttl: float):
+    """
+    Decorator caching an async function without arguments, see StaleWhileRevalidate.
+
+    The decorated function gets `invalidate()` to drop the cached value, e.g. after a write.
+    """
+
+    def decorator(func):
+        cache = StaleWhileRevalidate(func, ttl, stale_ttl)
+
+        @functools.wraps(func)
+        async def wrapper():
+            return await cache.get()
+
+        wrapper.cache = cache
+        wrapper.invalidate = cache.invalidate
+        return wrapper
+
+    return decorator
@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import contextvars
+import logging
+import os
+from typing import Any, AsyncIterator, Iterable
+
+from tortoise import connections
+
+log = logging.getLogger('conference_logger')
+
+STREAM_PREFETCH = int(os.getenv('DB_STREAM_PREFETCH', 500))
+
+REPLICA_CONNECTION = 'replica'
+
+# seconds the replica may be behind the primary before reads go back to the primary
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 5))
+
+# a replica which replayed everything it received is not behind, however long ago the last write was
+REPLICA_LAG_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp())::float, 'Infinity')
+           END AS lag
+"""
+
+# set for the duration of read-only requests, see read_only_request
+read_only = contextvars.ContextVar('read_only', default=False)
+
+
+class ReplicaState:
+    """
+    Lag of the read replica, measured every DB_REPLICA_LAG_CHECK_INTERVAL seconds by monitor_replica.
+
+    Until the first measurement, and whenever one fails, the replica counts as lagging.
+    """
+
+    def __init__(self, max_lag: float = DB_REPLICA_MAX_LAG):
+        self.max_lag = max_lag
+        self.lag = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.lag is not None and self.lag <= self.max_lag
+
+    async def check(self):
+        try:
+            rows = await connections.get(REPLICA_CONNECTION).execute_query_dict(REPLICA_LAG_SQL)
+            lag = float(rows[0]['lag'])
+        except Exception as e:
+            log.critical(f'Error checking replica lag :: {str(e)}')
+            lag = None
+
+        if self.healthy and not (lag is not None and lag <= self.max_lag):
+            log.warning(f'Replica lags {lag} seconds behind, reading from the primary')
+        self.lag = lag
+
+
+replica = ReplicaState()
+
+
+def replica_configured() -> bool:
+    try:
+        connections.get(REPLICA_CONNECTION)
+        return True
+    except Exception:
+        return False
+
+
+async def monitor_replica(stop: asyncio.Event, interval: float = DB_REPLICA_LAG_CHECK_INTERVAL):
+    if not replica_configured():
+        return
+
+    while not stop.is_set():
+        await replica.check()
+
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def read_connection_name() -> str:
+    """
+    :return: The replica inside read-only requests while it keeps up, otherwise the primary
+    """
+    return REPLICA_CONNECTION if read_only.get() and replica.healthy else 'default'
+
+
+def read_connection():
+    return connections.get(read_connection_name())
+
+
+async def read_only_request():
+    """
+    FastAPI dependency of endpoints which do not write, their reads may be served by the replica.
+    """
+    token = read_only.set(True)
+    try:
+        yield
+    finally:
+        read_only.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Tortoise router sending the ORM reads of read-only requests to the replica, everything else to the primary.
+    """
+
+    def db_for_read(self, model):
+        return read_connection_name()
+
+    def db_for_write(self, model):
+        return 'default'
+
+
+async def stream_rows(sql: str, params: Iterable[Any] = (), prefetch: int = STREAM_PREFETCH,
+                      connection_name: str = 'default') -> AsyncIterator[Any]:
+    """
+    Stream the result of a query through a server-side cursor.
+
+    Rows are fetched from Postgres `prefetch` at a time, so memory does not grow with the result size.
+
+    :param sql: Query with asyncpg style ($1, $2, ...) placeholders
+    :param params: Query parameters
+    :param prefetch: Number of rows fetched from the server in one round-trip
+    :param connection_name: Tortoise connection to run the query on
+    :return: Async iterator of asyncpg records
+    """
+    conn = connections.get(connection_name)
+
+    async with conn.acquire_connection() as connection:
+        # cursors only live inside a transaction
+        async with connection.transaction():
+            async for record in connection.cursor(sql, *params, prefetch=prefetch):
+                yield record
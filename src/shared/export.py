@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import csv
+import io
+import json
+import os
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 500))
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+async def csv_chunks(rows: AsyncIterator[Any], columns: Dict[str, str], values: Callable[[Any], List[Any]],
+                     chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[str]:
+    """
+    Render rows as CSV, chunk_rows lines at a time. The header line is sent before the first row is fetched.
+
+    :param rows: Rows, e.g. from shared.db.stream_rows
+    :param columns: Key and CSV header of every column
+    :param values: Values of the columns of a row
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    writer.writerow(columns.values())
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate()
+
+    written = 0
+    async for row in rows:
+        writer.writerow(values(row))
+        written += 1
+
+        if written % chunk_rows == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if output.tell():
+        yield output.getvalue()
+
+
+async def ndjson_chunks(rows: AsyncIterator[Any], columns: Dict[str, str], values: Callable[[Any], List[Any]],
+                        chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[str]:
+    """
+    Render rows as newline-delimited JSON objects keyed by columns, chunk_rows lines at a time.
+    """
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(dict(zip(columns, values(row))), default=str) + '\n')
+
+        if len(lines) == chunk_rows:
+            yield ''.join(lines)
+            lines = []
+
+    if lines:
+        yield ''.join(lines)
+
+
+def export_chunks(export_format: str, rows: AsyncIterator[Any], columns: Dict[str, str],
+                  values: Callable[[Any], List[Any]]) -> AsyncIterator[str]:
+    if export_format == 'ndjson':
+        return ndjson_chunks(rows, columns, values)
+    return csv_chunks(rows, columns, values)
@@ -1,27 +1,181 @@
+import asyncio
 import json
 import os
-from typing import Any, List, Optional
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import redis
+import redis.asyncio
+
+from shared.spool import RedisSpool, get_spool
+
+PIPELINE_BATCH_SIZE = int(os.getenv('REDIS_PIPELINE_BATCH_SIZE', 500))
+
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 32))
+# how long a caller waits for a free connection before ConnectionError is raised
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+# connections idle for longer are checked with PING before they are used again
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+# kept short, so callers fall back to the spool quickly while Redis is down
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 2))
+
+
+class PoolStats:
+    """
+    Connection usage and time spent waiting for a free connection of one pool.
+    """
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.in_use = 0
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, wait: float):
+        with self.lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def release(self):
+        with self.lock:
+            self.in_use -= 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'max_connections': self.max_connections,
+                'in_use': self.in_use,
+                'acquired': self.acquired,
+                'wait_avg_ms': round(1000 * self.wait_total / self.acquired, 3) if self.acquired else 0,
+                'wait_max_ms': round(1000 * self.wait_max, 3)}
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(self.max_connections)
+
+    def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        connection = super().get_connection(command_name, *keys, **options)
+        self.stats.acquire(time.perf_counter() - started)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        self.stats.release()
+
+
+class InstrumentedAsyncConnectionPool(redis.asyncio.BlockingConnectionPool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(self.max_connections)
+
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        self.stats.acquire(time.perf_counter() - started)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.stats.release()
+
+
+# one pool per process for sync clients, and one per event loop for async clients,
+# since async connections can not be used from another loop. Pools of a loop are
+# dropped with the loop, a new loop reusing its id never gets them
+_pools: Dict[Tuple, redis.BlockingConnectionPool] = {}
+_async_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, redis.asyncio.BlockingConnectionPool]]' = \
+    weakref.WeakKeyDictionary()
+_pools_lock = threading.Lock()
+
+
+def pool_options(port: int, db: int, decode_responses: bool, max_connections: Optional[int]) -> Dict[str, Any]:
+    return dict(host=os.getenv('REDIS_SERVER'), port=port, db=db, decode_responses=decode_responses,
+                max_connections=max_connections or REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL, socket_keepalive=True,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT, retry_on_timeout=True)
+
+
+def get_connection_pool(port: int = 6379, db: int = 0, decode_responses: bool = False,
+                        max_connections: Optional[int] = None) -> redis.BlockingConnectionPool:
+    """
+    Process-wide connection pool for sync clients, created on first use.
+
+    :param max_connections: Pool size, only used when the pool is created
+    """
+    key = (port, db, decode_responses)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = InstrumentedConnectionPool(**pool_options(port, db, decode_responses, max_connections))
+        return _pools[key]
+
+
+def get_async_connection_pool(port: int = 6379, db: int = 0, decode_responses: bool = False,
+                              max_connections: Optional[int] = None) -> redis.asyncio.BlockingConnectionPool:
+    """
+    Connection pool for async clients of the running event loop, created on first use.
+
+    :param max_connections: Pool size, only used when the pool is created
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_pools:
+        _async_pools[loop] = {}
+    pools = _async_pools[loop]
+
+    key = (port, db, decode_responses)
+    if key not in pools:
+        pools[key] = InstrumentedAsyncConnectionPool(**pool_options(port, db, decode_responses, max_connections))
+    return pools[key]
+
+
+def get_redis(port: int = 6379, db: int = 0, decode_responses: bool = False) -> redis.Redis:
+    return redis.Redis(connection_pool=get_connection_pool(port, db, decode_responses))
+
+
+def get_async_redis(port: int = 6379, db: int = 0, decode_responses: bool = False,
+                    max_connections: Optional[int] = None) -> redis.asyncio.Redis:
+    return redis.asyncio.Redis(connection_pool=get_async_connection_pool(port, db, decode_responses, max_connections))
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Usage of all connection pools of this process.
+
+    :return: Pool name -> max connections, connections in use, number of acquired connections,
+             average and maximum time waited for a free connection
+    """
+    stats = {f'sync:{port}/{db}{":decoded" if decoded else ""}': pool.stats.as_dict()
+             for (port, db, decoded), pool in list(_pools.items())}
+    stats.update({f'async:{port}/{db}{":decoded" if decoded else ""}:{id(loop)}': pool.stats.as_dict()
+                  for loop, pools in list(_async_pools.items()) if not loop.is_closed()
+                  for (port, db, decoded), pool in list(pools.items())})
+    return stats
 
 
 class RedisClientHandler:
-    def __init__(self, redis_instance: Optional[redis.Redis] = None, port: int = 6379, db: int = 0):
+    def __init__(self, redis_instance: Optional[redis.Redis] = None, port: int = 6379, db: int = 0,
+                 spool: Optional[RedisSpool] = None):
         """
         Initialize the Redis client.
 
         :param port: Redis server port
         :param db: Redis database number
+        :param spool: Keeps pushed messages while Redis is unreachable, the shared spool of the process by default
         """
         if redis_instance:
             self.redis_client = redis_instance
+            self.spool = spool
         else:
-
-            #TODO: ...
-
-            # host = "localhost" if os.getenv('V4INSTALLATION', "localhost") not in ('docker', 'docker-monolith') else 'redis'
-            host = os.getenv('REDIS_SERVER')
-            self.redis_client = redis.Redis(host=host, port=port, db=db)
+            self.redis_client = get_redis(port, db)
+            self.spool = spool or get_spool('messages')
 
     @staticmethod
     def get_redis_client(redis_instance: Optional[redis.Redis] = None, port: int = 6379, db: int = 0) -> 'RedisClientHandler':
@@ -35,13 +189,22 @@ class RedisClientHandler:
         :param message: Message to be pushed (will be JSON serialized)
         :return: True if successful, False otherwise
         """
+        serialized_message = json.dumps(message, default=str)
+        if self.spool and self.spool.bypass_redis():
+            accepted = self.spool.append('rpush', queue_name, [serialized_message])
+            self.spool.replay(self.redis_client)
+            return accepted
+
         try:
-            serialized_message = json.dumps(message, default=str)
             self.redis_client.rpush(queue_name, serialized_message)
             return True
         except Exception as e:
             print(f"Error pushing message to queue {queue_name}: {e}")
-            raise Exception("FAILED TO SEND REDIS MESSAGE")
+            if not self.spool:
+                raise Exception("FAILED TO SEND REDIS MESSAGE")
+
+            self.spool.mark_failed()
+            return self.spool.append('rpush', queue_name, [serialized_message])
 
     def read_message(self, queue_name: str, timeout: int = 0) -> Optional[Any]:
         """
@@ -99,6 +262,180 @@ class RedisClientHandler:
             print(f"Error getting all messages from queue {queue_name}: {e}")
             return []
 
+    def get_all_stream_messages(self, stream_name: str) -> List[Any]:
+        """
+        Get all messages from a stream without consuming them.
+
+        :param stream_name: Name of the stream
+        :return: List of all messages in the stream
+        """
+        try:
+            entries = self.redis_client.xrange(stream_name)
+            return [json.loads(fields[b'payload']) for entry_id, fields in entries]
+        except Exception as e:
+            print(f"Error getting all messages from stream {stream_name}: {e}")
+            return []
+
+    def ping(self) -> float:
+        """
+        Check the connection to Redis.
+
+        :return: Round-trip time in ms
+        """
+        started = time.perf_counter()
+        self.redis_client.ping()
+        return round(1000 * (time.perf_counter() - started), 3)
+
+    def get_stream_length(self, stream_name: str) -> int:
+        """
+        Get the current number of entries in a stream.
+
+        :param stream_name: Name of the stream
+        :return: Length of the stream
+        """
+        return self.redis_client.xlen(stream_name)
+
+
+class AsyncRedisClientHandler:
+
+    def __init__(self, redis_instance: Optional[redis.asyncio.Redis] = None, port: int = 6379, db: int = 0,
+                 spool: Optional[RedisSpool] = None):
+        """
+        Initialize the async Redis client on top of a shared connection pool.
+
+        :param port: Redis server port
+        :param db: Redis database number
+        :param spool: Keeps pushed messages while Redis is unreachable, the shared spool of the process by default
+        """
+        if redis_instance:
+            self.redis_client = redis_instance
+            self.spool = spool
+        else:
+            self.redis_client = get_async_redis(port, db)
+            self.spool = spool or get_spool('messages')
+
+    @staticmethod
+    def get_redis_client(redis_instance: Optional[redis.asyncio.Redis] = None, port: int = 6379,
+                         db: int = 0) -> 'AsyncRedisClientHandler':
+        return AsyncRedisClientHandler(redis_instance, port, db)
+
+    async def push_message(self, queue_name: str, message: Any) -> bool:
+        """
+        Push a single message to a specified Redis queue.
+
+        :param queue_name: Name of the queue
+        :param message: Message to be pushed (will be JSON serialized)
+        :return: True if successful
+        """
+        return await self.push_messages(queue_name, [message]) == 1
+
+    async def push_messages(self, queue_name: str, messages: Iterable[Any], batch_size: int = PIPELINE_BATCH_SIZE) -> int:
+        """
+        Push many messages to a specified Redis queue, one round-trip per batch.
+
+        :param queue_name: Name of the queue
+        :param messages: Messages to be pushed (each will be JSON serialized)
+        :param batch_size: Number of messages sent to Redis in one RPUSH
+        :return: Number of pushed messages
+        """
+        serialized_messages = [json.dumps(message, default=str) for message in messages]
+        if self.spool and self.spool.bypass_redis():
+            return await self.spool_messages('rpush', queue_name, serialized_messages)
+
+        sent = 0
+        try:
+            for sent in range(0, len(serialized_messages), batch_size):
+                await self.redis_client.rpush(queue_name, *serialized_messages[sent:sent + batch_size])
+            return len(serialized_messages)
+        except Exception as e:
+            print(f"Error pushing messages to queue {queue_name}: {e}")
+            if not self.spool:
+                raise Exception("FAILED TO SEND REDIS MESSAGE")
+
+            self.spool.mark_failed()
+            return sent + await self.spool_messages('rpush', queue_name, serialized_messages[sent:])
+
+    async def get_queue_length(self, queue_name: str) -> int:
+        """
+        Get the current length of a queue.
+
+        :param queue_name: Name of the queue
+        :return: Length of the queue
+        """
+        return await self.redis_client.llen(queue_name)
+
+    async def ping(self) -> float:
+        """
+        Check the connection to Redis.
+
+        :return: Round-trip time in ms
+        """
+        started = time.perf_counter()
+        await self.redis_client.ping()
+        return round(1000 * (time.perf_counter() - started), 3)
+
+    async def get_stream_backlog(self, stream_name: str, group_name: str) -> Dict[str, Any]:
+        """
+        Get the depth of a stream consumed by a consumer group.
+
+        :param stream_name: Name of the stream
+        :param group_name: Name of the consumer group
+        :return: Stream length, lag (entries not yet delivered to any consumer, None if unknown)
+                 and pending entries (delivered but not yet acknowledged)
+        """
+        length = await self.redis_client.xlen(stream_name)
+        try:
+            groups = await self.redis_client.xinfo_groups(stream_name)
+        except redis.exceptions.ResponseError:
+            # the stream does not exist yet
+            groups = []
+
+        group = next((g for g in groups if g['name'] in (group_name, group_name.encode())), {})
+        return {'length': length, 'lag': group.get('lag'), 'pending': group.get('pending', 0)}
+
+    async def add_stream_messages(self, stream_name: str, messages: Iterable[Any],
+                                  batch_size: int = PIPELINE_BATCH_SIZE) -> int:
+        """
+        Append many messages to a Redis stream, one pipelined round-trip per batch.
+
+        :param stream_name: Name of the stream
+        :param messages: Messages to be added (each will be JSON serialized into the payload field)
+        :param batch_size: Number of XADD commands sent to Redis in one pipeline
+        :return: Number of added messages
+        """
+        serialized_messages = [json.dumps(message, default=str) for message in messages]
+        if self.spool and self.spool.bypass_redis():
+            return await self.spool_messages('xadd', stream_name, serialized_messages)
+
+        sent = 0
+        try:
+            for sent in range(0, len(serialized_messages), batch_size):
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for serialized_message in serialized_messages[sent:sent + batch_size]:
+                        pipe.xadd(stream_name, {'payload': serialized_message})
+                    await pipe.execute()
+            return len(serialized_messages)
+        except Exception as e:
+            print(f"Error adding messages to stream {stream_name}: {e}")
+            if not self.spool:
+                raise Exception("FAILED TO SEND REDIS MESSAGE")
+
+            # the failed batch may have been sent in part, it is spooled whole, consumers see duplicates at worst
+            self.spool.mark_failed()
+            return sent + await self.spool_messages('xadd', stream_name, serialized_messages[sent:])
+
+    async def spool_messages(self, command: str, key: str, serialized_messages: List[str]) -> int:
+        """
+        Keep messages in the spool and send everything spooled so far if Redis is due to be tried again.
+
+        :return: Number of messages accepted by the spool
+        """
+        if not self.spool.append(command, key, serialized_messages):
+            return 0
+
+        await self.spool.areplay(self.redis_client)
+        return len(serialized_messages)
+
 
 # Usage example
 if __name__ == "__main__":
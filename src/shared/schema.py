@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import os
+from typing import List
+
+from tortoise import connections
+
+# aerich migrations of the models app, see [tool.aerich] in pyproject.toml
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations', 'models')
+MIGRATIONS_APP = 'models'
+
+# a database created before migrations were introduced has no aerich table
+AERICH_TABLE_SQL = "SELECT to_regclass('aerich') IS NOT NULL AS exists"
+
+APPLIED_MIGRATIONS_SQL = "SELECT version FROM aerich WHERE app = $1"
+
+
+class SchemaOutdated(Exception):
+    pass
+
+
+def migration_files(migrations_dir: str = MIGRATIONS_DIR) -> List[str]:
+    # ordered the way aerich applies them
+    return sorted((name for name in os.listdir(migrations_dir) if name.endswith('.py')),
+                  key=lambda name: int(name.split('_')[0]))
+
+
+async def pending_migrations(connection_name: str = 'default', migrations_dir: str = MIGRATIONS_DIR) -> List[str]:
+    """
+    :return: Migration files which `aerich upgrade` has not applied yet
+    """
+    connection = connections.get(connection_name)
+
+    applied = set()
+    if (await connection.execute_query_dict(AERICH_TABLE_SQL))[0]['exists']:
+        applied = {row['version'] for row in
+                   await connection.execute_query_dict(APPLIED_MIGRATIONS_SQL, [MIGRATIONS_APP])}
+
+    return [name for name in migration_files(migrations_dir) if name not in applied]
+
+
+async def verify_schema(connection_name: str = 'default'):
+    """
+    Check that the database is at the latest migration, without issuing any DDL.
+
+    :raises SchemaOutdated: When migrations are pending
+    """
+    pending = await pending_migrations(connection_name)
+    if pending:
+        raise SchemaOutdated(f"Database schema is outdated, run `aerich upgrade` in src to apply "
+                             f"{', '.join(pending)}")
@@ -3,32 +3,139 @@
 
 import logging
 import os
+import queue
+import threading
 
-import redis
+REDIS_LOG_MAX_LENGTH = int(os.getenv('REDIS_LOG_MAX_LENGTH', 100000))
+REDIS_LOG_BUFFER_SIZE = int(os.getenv('REDIS_LOG_BUFFER_SIZE', 10000))
+REDIS_LOG_BATCH_SIZE = 500
+REDIS_LOG_FLUSH_INTERVAL = 1
 
 
 class RedisHandler(logging.Handler):
-    def __init__(self, redis_client, redis_list_key):
+    """
+    Logging handler appending formatted records to a capped Redis list.
+
+    emit only puts a record into a bounded in-memory buffer, a background thread writes
+    buffered records to Redis in pipelined batches and trims the list to max_length.
+    When the buffer is full, records are dropped and counted instead of blocking the caller.
+    While Redis can not be reached batches go to the spool, if there is one, and are
+    dropped and counted otherwise.
+    """
+
+    def __init__(self, redis_client, redis_list_key, max_length: int = REDIS_LOG_MAX_LENGTH,
+                 buffer_size: int = REDIS_LOG_BUFFER_SIZE, batch_size: int = REDIS_LOG_BATCH_SIZE,
+                 flush_interval: float = REDIS_LOG_FLUSH_INTERVAL, spool=None):
         super().__init__()
+        self.spool = spool
         self.redis_client = redis_client
         self.redis_list_key = redis_list_key
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.dropped_lock = threading.Lock()
+
+        self.stopping = threading.Event()
+        self.writer = threading.Thread(target=self.write_buffered, name='redis-log-handler', daemon=True)
+        self.writer.start()
+
+    def count_dropped(self, nr_records):
+        with self.dropped_lock:
+            self.dropped += nr_records
 
     def emit(self, record):
-        log_entry = self.format(record)
-        self.redis_client.rpush(self.redis_list_key, log_entry)
+        try:
+            self.buffer.put_nowait(self.format(record))
+        except queue.Full:
+            self.count_dropped(1)
+        except Exception:
+            self.handleError(record)
+
+    def next_batch(self):
+        batch = []
+        try:
+            batch.append(self.buffer.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self.buffer.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def write(self, batch):
+        # dropped records are reported in the log itself, once Redis accepts writes again
+        if self.dropped > self.reported_dropped:
+            nr_dropped = self.dropped
+            batch = batch + [f'{self.__class__.__name__} dropped {nr_dropped - self.reported_dropped} log records']
+        else:
+            nr_dropped = None
+
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.rpush(self.redis_list_key, *batch)
+            pipe.ltrim(self.redis_list_key, -self.max_length, -1)
+            pipe.execute()
+
+        if nr_dropped is not None:
+            self.reported_dropped = nr_dropped
 
+    def spool_batch(self, batch):
+        if not self.spool.append('rpush', self.redis_list_key, batch, trim=self.max_length):
+            self.count_dropped(len(batch))
 
-def setup_redis_logger():
+    def write_buffered(self):
+        while not self.stopping.is_set() or not self.buffer.empty():
+            batch = self.next_batch()
+            if not batch:
+                continue
+
+            # spooled records go first, so records reach the list in the order they were logged
+            if self.spool and self.spool.bypass_redis():
+                self.spool_batch(batch)
+                self.spool.replay(self.redis_client)
+                continue
+
+            try:
+                self.write(batch)
+            except Exception:
+                if not self.spool:
+                    self.count_dropped(len(batch))
+                    continue
+
+                self.spool.mark_failed()
+                self.spool_batch(batch)
+
+    def close(self):
+        # whatever is still buffered gets one flush interval to be written
+        self.stopping.set()
+        self.writer.join(timeout=2 * self.flush_interval + 1)
+        super().close()
+
+
+def setup_redis_logger(logger_name: str = 'redis_logger', level: int = logging.INFO):
+    """
+    Send records of a logger from level up to the capped 'log_list' in Redis (spooled while Redis is down).
+
+    :param logger_name: e.g. a worker's logger, whose own level is kept when it is lower already
+    """
     # Configure the logger
-    logger = logging.getLogger('redis_logger')
-    logger.setLevel(logging.INFO)
+    logger = logging.getLogger(logger_name)
+    if logger.level == logging.NOTSET or logger.level > level:
+        logger.setLevel(level)
 
-    redis_server = os.getenv('REDIS_SERVER', 'localhost')
+    # handlers are kept when modules are reloaded
+    if any(isinstance(handler, RedisHandler) for handler in logger.handlers):
+        return
 
-    redis_client = redis.Redis(host=redis_server, port=6379, db=0)
+    from shared.redis_client import get_redis
+    from shared.spool import get_spool
+    redis_client = get_redis()
 
     # Create the Redis handler and set a formatter
-    redis_handler = RedisHandler(redis_client, 'log_list')
+    redis_handler = RedisHandler(redis_client, 'log_list', spool=get_spool('logs'))
+    redis_handler.setLevel(level)
     # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s ||| %(message)s')
     redis_handler.setFormatter(formatter)
@@ -0,0 +1,255 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+REDIS_SPOOL_DIR = os.getenv('REDIS_SPOOL_DIR', '/var/spool/opencon')
+REDIS_SPOOL_MAX_BYTES = int(os.getenv('REDIS_SPOOL_MAX_BYTES', 64 * 1024 * 1024))
+# after a failed replay Redis is left alone for this many seconds, writes go straight to the spool meanwhile
+REDIS_SPOOL_RETRY_INTERVAL = float(os.getenv('REDIS_SPOOL_RETRY_INTERVAL', 5))
+REDIS_SPOOL_BATCH_SIZE = 500
+
+log = logging.getLogger('conference_logger')
+
+
+def apply_entry(pipe, entry: Dict[str, Any]):
+    if entry['command'] == 'xadd':
+        for value in entry['values']:
+            pipe.xadd(entry['key'], {'payload': value})
+    elif entry['command'] == 'rpush':
+        pipe.rpush(entry['key'], *entry['values'])
+        if entry.get('trim'):
+            pipe.ltrim(entry['key'], -entry['trim'], -1)
+    elif entry['command'] == 'del':
+        pipe.delete(*entry['values'])
+
+
+class RedisSpool:
+    """
+    Local append-only file keeping Redis writes while Redis can not be reached.
+
+    Every line holds one write (XADD of serialized messages to a stream, RPUSH to a list,
+    or DEL of keys, e.g. ready markers of data which went out of sync meanwhile).
+    Replay moves the spool aside, so writes arriving meanwhile start a new file, and sends
+    the moved file to Redis in pipelined batches in the order it was written. Lines which
+    could not be replayed stay in the moved file and go first on the next replay.
+    The spool holds at most max_bytes, further writes are dropped and counted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = REDIS_SPOOL_MAX_BYTES,
+                 retry_interval: float = REDIS_SPOOL_RETRY_INTERVAL, batch_size: int = REDIS_SPOOL_BATCH_SIZE):
+        self.path = path
+        self.replay_path = f'{path}.replay'
+        self.max_bytes = max_bytes
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size
+
+        self.lock = threading.Lock()
+        # only one replay at a time, by any thread or task of the process
+        self.replay_lock = threading.Lock()
+        self.failed_at: Optional[float] = None
+
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in (self.path, self.replay_path) if os.path.exists(path))
+
+    def pending(self) -> bool:
+        return os.path.exists(self.path) or os.path.exists(self.replay_path)
+
+    def replay_due(self) -> bool:
+        return self.failed_at is None or time.monotonic() - self.failed_at >= self.retry_interval
+
+    def bypass_redis(self) -> bool:
+        # while anything is spooled new writes are spooled too, so the order of messages is kept
+        return self.pending() or not self.replay_due()
+
+    def mark_failed(self):
+        self.failed_at = time.monotonic()
+
+    def open_locked(self):
+        # another process may have moved the file aside for replay while we waited for the lock
+        while True:
+            f = open(self.path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.path.exists(self.path) and os.path.samestat(os.fstat(f.fileno()), os.stat(self.path)):
+                return f
+            f.close()
+
+    def append(self, command: str, key: str, values: List[str], trim: Optional[int] = None) -> bool:
+        """
+        :param command: xadd, rpush or del
+        :param key: Stream or list
+        :param values: Serialized messages, or the keys to delete
+        :param trim: Length the list is trimmed to after RPUSH
+        :return: False if the messages were dropped
+        """
+        line = json.dumps({'command': command, 'key': key, 'values': values, 'trim': trim}) + '\n'
+
+        try:
+            with self.lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with self.open_locked() as f:
+                    if self.size() + len(line) > self.max_bytes:
+                        self.dropped += len(values)
+                        return False
+
+                    f.write(line)
+        except OSError as e:
+            self.dropped += len(values)
+            log.critical(f'Error spooling redis messages to {self.path} :: {str(e)}')
+            return False
+
+        self.spooled += len(values)
+        return True
+
+    def take_lines(self) -> List[str]:
+        with self.lock:
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path):
+                    return []
+                with self.open_locked():
+                    os.rename(self.path, self.replay_path)
+
+            with open(self.replay_path) as f:
+                return [line for line in f if line.strip()]
+
+    def keep_lines(self, lines: List[str]):
+        with self.lock:
+            if not lines:
+                os.remove(self.replay_path)
+                return
+
+            tmp_path = f'{self.replay_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.replay_path)
+
+    def count(self, lines: List[str]) -> int:
+        return sum(len(json.loads(line)['values']) for line in lines)
+
+    def replay(self, redis_client) -> int:
+        """
+        Send spooled writes with a sync Redis client.
+
+        :return: Number of replayed messages
+        """
+        if not self.pending() or not self.replay_due() or not self.replay_lock.acquire(blocking=False):
+            return 0
+
+        replayed = 0
+        try:
+            while lines := self.take_lines():
+                for i in range(0, len(lines), self.batch_size):
+                    batch = lines[i:i + self.batch_size]
+                    try:
+                        with redis_client.pipeline(transaction=False) as pipe:
+                            for line in batch:
+                                apply_entry(pipe, json.loads(line))
+                            pipe.execute()
+                    except Exception:
+                        self.keep_lines(lines[i:])
+                        self.mark_failed()
+                        return replayed
+
+                    replayed += self.count(batch)
+                    self.replayed += self.count(batch)
+
+                self.keep_lines([])
+        finally:
+            self.replay_lock.release()
+
+        self.failed_at = None
+        return replayed
+
+    async def areplay(self, redis_client) -> int:
+        """
+        Send spooled writes with an async Redis client.
+
+        :return: Number of replayed messages
+        """
+        if not self.pending() or not self.replay_due() or not self.replay_lock.acquire(blocking=False):
+            return 0
+
+        replayed = 0
+        try:
+            while lines := self.take_lines():
+                for i in range(0, len(lines), self.batch_size):
+                    batch = lines[i:i + self.batch_size]
+                    try:
+                        async with redis_client.pipeline(transaction=False) as pipe:
+                            for line in batch:
+                                apply_entry(pipe, json.loads(line))
+                            await pipe.execute()
+                    except Exception:
+                        self.keep_lines(lines[i:])
+                        self.mark_failed()
+                        return replayed
+
+                    replayed += self.count(batch)
+                    self.replayed += self.count(batch)
+
+                self.keep_lines([])
+        finally:
+            self.replay_lock.release()
+
+        self.failed_at = None
+        return replayed
+
+    def metrics(self) -> Dict[str, Any]:
+        return {'pending': self.pending(),
+                'bytes': self.size(),
+                'max_bytes': self.max_bytes,
+                'spooled': self.spooled,
+                'replayed': self.replayed,
+                'dropped': self.dropped}
+
+
+_spools: Dict[str, RedisSpool] = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(name: str) -> RedisSpool:
+    with _spools_lock:
+        if name not in _spools:
+            _spools[name] = RedisSpool(os.path.join(REDIS_SPOOL_DIR, f'{name}.spool'))
+        return _spools[name]
+
+
+def spool_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: spool.metrics() for name, spool in list(_spools.items())}
+
+
+async def replay_spools(stop: asyncio.Event, interval: float = REDIS_SPOOL_RETRY_INTERVAL):
+    """
+    Replay spooled messages of this process once Redis is back, even when nothing new is sent.
+    """
+    from shared.redis_client import AsyncRedisClientHandler
+
+    while not stop.is_set():
+        for name, spool in list(_spools.items()):
+            if not spool.pending() or not spool.replay_due():
+                continue
+
+            try:
+                replayed = await spool.areplay(AsyncRedisClientHandler.get_redis_client().redis_client)
+            except Exception as e:
+                log.critical(f'Error replaying spooled redis messages from {name} :: {str(e)}')
+                continue
+
+            if replayed:
+                log.info(f"REPLAYED {replayed} SPOOLED REDIS MESSAGES FROM {name}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
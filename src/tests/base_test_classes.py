@@ -1,23 +1,62 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 
+import contextlib
 import importlib
 import logging
 import os
 from abc import ABC, abstractmethod
+from unittest.mock import patch
 
 import dotenv
+import fakeredis
+import fakeredis.aioredis
 import psycopg2
 import pytest
 from tortoise import Tortoise
 
 from app import get_app, shutdown_event, startup_event
+from shared.redis_client import AsyncRedisClientHandler, RedisClientHandler
 
 logging.disable(logging.CRITICAL)
 dotenv.load_dotenv()
 os.environ["TEST_MODE"] = "true"
 
 
+def with_fake_redis(test):
+    # sync and async handlers share one fake server, so messages pushed
+    # asynchronously by the importer can be read back synchronously in tests
+
+    server = fakeredis.FakeServer()
+    test = patch.object(RedisClientHandler, "get_redis_client",
+                        return_value=RedisClientHandler(redis_instance=fakeredis.FakeStrictRedis(server=server)))(test)
+    return patch.object(AsyncRedisClientHandler, "get_redis_client",
+                        return_value=AsyncRedisClientHandler(
+                            redis_instance=fakeredis.aioredis.FakeRedis(server=server)))(test)
+
+
+@contextlib.contextmanager
+def count_queries():
+    # collects every query Tortoise sends to Postgres inside the block
+
+    from tortoise.backends.asyncpg.client import AsyncpgDBClient
+
+    queries = []
+    execute_query, execute_query_dict = AsyncpgDBClient.execute_query, AsyncpgDBClient.execute_query_dict
+
+    async def counted_execute_query(self, query, values=None):
+        queries.append(query)
+        return await execute_query(self, query, values)
+
+    async def counted_execute_query_dict(self, query, values=None):
+        queries.append(query)
+        return await execute_query_dict(self, query, values)
+
+    with patch.object(AsyncpgDBClient, 'execute_query', counted_execute_query), \
+            patch.object(AsyncpgDBClient, 'execute_query_dict', counted_execute_query_dict):
+        yield queries
+
+
 class BaseAPITest(ABC):
     app = None
 
@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from httpx import AsyncClient
+
+EXPO_STAND_IN_URL = 'http://expo.test/--/api/v2/push/send'
+EXPO_STAND_IN_RECEIPTS_URL = 'http://expo.test/--/api/v2/push/getReceipts'
+
+
+class ExpoStandIn:
+    """
+    Local stand-in for the Expo push API, recording every request it receives.
+
+    fail_requests / reject_requests answer that many next push requests with 503 / 400,
+    ticket_errors and receipt_errors map push tokens to the error Expo reports for them.
+    """
+
+    def __init__(self, delay: float = 0):
+        self.requests = []
+        self.receipt_requests = []
+        self.delay = delay
+        self.fail_requests = 0
+        self.reject_requests = 0
+        self.ticket_errors = {}
+        self.receipt_errors = {}
+        self.tickets = {}
+        self.app = FastAPI()
+
+        def error(token, errors):
+            return {'status': 'error', 'message': f'{token} failed', 'details': {'error': errors[token]}}
+
+        @self.app.post('/--/api/v2/push/send')
+        async def push_send(request: Request):
+            messages = await request.json()
+            if isinstance(messages, dict):
+                messages = [messages]
+
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+            if self.fail_requests:
+                self.fail_requests -= 1
+                return JSONResponse({'errors': [{'code': 'INTERNAL_SERVER_ERROR'}]}, status_code=503)
+
+            if self.reject_requests:
+                self.reject_requests -= 1
+                return JSONResponse({'errors': [{'code': 'VALIDATION_ERROR'}]}, status_code=400)
+
+            self.requests.append(messages)
+
+            tickets = []
+            for message in messages:
+                if message['to'] in self.ticket_errors:
+                    tickets.append(error(message['to'], self.ticket_errors))
+                else:
+                    ticket_id = str(uuid.uuid4())
+                    self.tickets[ticket_id] = message['to']
+                    tickets.append({'status': 'ok', 'id': ticket_id})
+
+            return {'data': tickets}
+
+        @self.app.post('/--/api/v2/push/getReceipts')
+        async def get_receipts(request: Request):
+            ids = (await request.json())['ids']
+            self.receipt_requests.append(ids)
+
+            return {'data': {ticket_id: error(self.tickets[ticket_id], self.receipt_errors)
+                             if self.tickets[ticket_id] in self.receipt_errors else {'status': 'ok'}
+                             for ticket_id in ids if ticket_id in self.tickets}}
+
+    @property
+    def messages(self):
+        return [message for request in self.requests for message in request]
+
+    def client(self) -> AsyncClient:
+        return AsyncClient(app=self.app, base_url='http://expo.test')
@@ -9,7 +9,7 @@ import unittest
 import unittest.mock
 
 import dotenv
-from base_test_classes import BaseAPITest
+from base_test_classes import BaseAPITest, count_queries, with_fake_redis
 from httpx import AsyncClient
 
 os.environ["TEST_MODE"] = "true"
@@ -20,8 +20,6 @@ logging.disable(logging.CRITICAL)
 
 from unittest.mock import patch
 
-import fakeredis
-
 from shared.redis_client import RedisClientHandler
 
 
@@ -342,7 +340,13 @@ class Test2024(BaseAPITest):
             assert session['title']
 
 
-    async def do_test_push_notification(self, group_notifications_by_user: bool, expected_notifications: int):
+    async def do_test_push_notification(self, group_notifications_by_user: bool, expected_notifications: int,
+                                        subscriber_sets: bool = False):
+        if subscriber_sets:
+            # built while nobody has bookmarked yet, from here on kept in sync by the api
+            from conferences.controller.subscribers import SessionSubscribers
+            assert await SessionSubscribers().rebuild() == 0
+
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
             response = await ac.post("/api/authorize")
             assert response.status_code == 200
@@ -408,20 +412,65 @@ class Test2024(BaseAPITest):
             assert response.status_code == 200
 
         redis_client = RedisClientHandler.get_redis_client()
-        all_messages = redis_client.get_all_messages('opencon_push_notification')
+        all_messages = redis_client.get_all_stream_messages('opencon_push_notification')
         assert len(all_messages) == expected_notifications
         ...
 
-    @patch.object(RedisClientHandler, "get_redis_client",
-                  return_value=RedisClientHandler(redis_instance=fakeredis.FakeStrictRedis()))
+    @with_fake_redis
     async def test_push_notification_ungrouped(self, *args, **kwargs):
         await self.do_test_push_notification(group_notifications_by_user=False, expected_notifications=3)
 
-    @patch.object(RedisClientHandler, "get_redis_client",
-                  return_value=RedisClientHandler(redis_instance=fakeredis.FakeStrictRedis()))
+    @with_fake_redis
     async def test_push_notification_grouped(self, *args, **kwargs):
         await self.do_test_push_notification(group_notifications_by_user=True, expected_notifications=2)
 
+    @with_fake_redis
+    @patch('conferences.controller.conference.PUSH_BACKLOG_THRESHOLD', -1)
+    async def test_push_notification_grouped_when_queue_is_backlogged(self, *args, **kwargs):
+        await self.do_test_push_notification(group_notifications_by_user=False, expected_notifications=2)
+
+    @with_fake_redis
+    async def test_push_notification_ungrouped_from_subscriber_sets(self, *args, **kwargs):
+        await self.do_test_push_notification(group_notifications_by_user=False, expected_notifications=3,
+                                             subscriber_sets=True)
+
+    @with_fake_redis
+    async def test_push_notification_grouped_from_subscriber_sets(self, *args, **kwargs):
+        await self.do_test_push_notification(group_notifications_by_user=True, expected_notifications=2,
+                                             subscriber_sets=True)
+
+    @with_fake_redis
+    async def test_push_notification_shared_token_is_notified_once(self, *args, **kwargs):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            id_cra_session = None
+            for s in self.sessions:
+                if self.sessions[s]['title'] == 'Let’s all get over the CRA!':
+                    id_cra_session = s
+                    break
+
+            assert id_cra_session
+
+            # two anonymous users on the same device
+            for _ in range(2):
+                token = (await ac.post("/api/authorize")).json()['token']
+                response = await ac.post('/api/notification-token',
+                                         json={'push_notification_token': 'ExponentPushToken[xxxxxxxxxxxxxxxxxxxxx1]'},
+                                         headers={"Authorization": f"Bearer {token}"})
+                assert response.status_code == 200
+
+                response = await ac.post(f"/api/sessions/{id_cra_session}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {token}"})
+                assert response.json() == {'bookmarked': True}
+
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml',
+                                                              'group_notifications_by_user': False})
+            assert response.status_code == 200
+
+        redis_client = RedisClientHandler.get_redis_client()
+        all_messages = redis_client.get_all_stream_messages('opencon_push_notification')
+        assert len(all_messages) == 1
+
 
 class TestUpdateXML(BaseAPITest):
     async def setup(self):
@@ -447,8 +496,7 @@ class TestUpdateXML(BaseAPITest):
             self.sessions = response.json()['conference']['db']['sessions']
 
 
-    @patch.object(RedisClientHandler, "get_redis_client",
-                  return_value=RedisClientHandler(redis_instance=fakeredis.FakeStrictRedis()))
+    @with_fake_redis
     async def test_removing_session(self, *args, **kwargs):
 
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
@@ -477,7 +525,7 @@ class TestUpdateXML(BaseAPITest):
             assert len(after_update_sessions) == len(self.sessions) - 1
 
             redis_client = RedisClientHandler.get_redis_client()
-            all_messages = redis_client.get_all_messages('opencon_push_notification')
+            all_messages = redis_client.get_all_stream_messages('opencon_push_notification')
 
             ...
             assert len(all_messages) == 1
@@ -612,9 +660,58 @@ class TestAdmin(BaseAPITest):
             #     assert res['data'][i]['bookmarks'] == []
 
             response = await ac.get("/api/admin/users?csv=true", headers={"Authorization": f"Bearer {admin_token}"})
-            ...
+            assert response.status_code == 200
+            assert response.headers['content-type'].startswith('text/csv')
+            lines = response.text.splitlines()
+            assert lines[0] == 'ID,Bookmarks,Number of ratings,Registered'
+            assert sorted(int(line.split(',')[1]) for line in lines[1:]) == [0, 0, 1]
+
+            response = await ac.get("/api/admin/users?ndjson=true", headers={"Authorization": f"Bearer {admin_token}"})
+            assert response.status_code == 200
+            users = [json.loads(line) for line in response.text.splitlines()]
+            assert sorted(user['bookmarks'] for user in users) == [0, 0, 1]
+
+
+
+    async def test_users_are_paged_sorted_and_filtered(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            admin_token = response.json()['token']
+            headers = {"Authorization": f"Bearer {admin_token}"}
+
+            sessions = list(self.sessions)
+            for id_session in sessions[:2]:
+                response = await ac.post(f"/api/sessions/{id_session}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {self.token1}"})
+                assert response.status_code == 200
+            response = await ac.post(f"/api/sessions/{sessions[0]}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token2}"})
+            assert response.status_code == 200
+
+            response = await ac.get("/api/admin/users?order_field=bookmarks&order_direction=descend&limit=2",
+                                    headers=headers)
+            assert response.status_code == 200
+            res = response.json()
+            assert [user['bookmarks'] for user in res['data']] == [2, 1]
+            assert res['next']
+
+            response = await ac.get(f"/api/admin/users?order_field=bookmarks&order_direction=descend&limit=2"
+                                    f"&after={res['next']}", headers=headers)
+            assert response.status_code == 200
+            res = response.json()
+            assert [user['bookmarks'] for user in res['data']] == [0]
+            assert res['next'] is None
 
+            response = await ac.get("/api/admin/users?min_bookmarks=1", headers=headers)
+            assert response.status_code == 200
+            res = response.json()
+            assert len(res['data']) == 2
+            assert res['data'][0]['register_at'] <= res['data'][1]['register_at']
 
+            response = await ac.get("/api/admin/users?order_field=bookmarks&after=broken", headers=headers)
+            assert response.status_code == 400
 
     async def test_get_sessions_by_rate(self):
         async with AsyncClient(app=self.app, base_url="http://test") as ac:
@@ -650,3 +747,178 @@ class TestAdmin(BaseAPITest):
             assert 'data' in response.json()
             assert len(response.json()['data']) > 10
 
+            response = await ac.post(f"/api/sessions/{id_1st_session}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.status_code == 200
+
+            with unittest.mock.patch('conferences.controller.conference.now') as mocked_datetime:
+                mocked_datetime.return_value = datetime.datetime(2024, 11, 9, 18, 0)
+
+                response = await ac.post(f"/api/sessions/{id_1st_session}/rate", json={'rating': 4},
+                                         headers={"Authorization": f"Bearer {self.token1}"})
+                assert response.status_code == 200
+
+            response = await ac.get('/api/admin/sessions?order_field=bookmarks&order_direction=ascend&limit=5',
+                                    headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+            res = response.json()
+            assert len(res['data']) == 5
+            assert res['total'] == len(self.sessions)
+            assert res['data'][0]['title'] == 'Let’s all get over the CRA!'
+            assert res['data'][0]['bookmarks'] == 1
+
+            # unrated sessions come last in both directions
+            for direction in ('ascend', 'descend'):
+                response = await ac.get(f'/api/admin/sessions?order_field=avg_rate&order_direction={direction}',
+                                        headers={'Authorization': f'Bearer {admin_token}'})
+                assert response.status_code == 200
+                rates = [session['avg_rate'] for session in response.json()['data']]
+                assert rates[0] == 4
+                assert rates[1:] == [None] * (len(rates) - 1)
+
+            response = await ac.get(f'/api/admin/sessions?offset={len(self.sessions)}',
+                                    headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.json() == {'data': [], 'total': len(self.sessions)}
+
+            response = await ac.get('/api/admin/sessions?ndjson=true', headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+            sessions = [json.loads(line) for line in response.text.splitlines()]
+            assert len(sessions) == len(self.sessions)
+            assert {'title', 'speakers', 'bookmarks', 'rates', 'avg_rate'} == set(sessions[0])
+
+            response = await ac.get('/api/admin/sessions?csv=true', headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+            assert response.text.splitlines()[0] == 'Title,Speakers,Bookmarks,Rates,Avg rate'
+
+
+    async def test_event_summary_and_dashboard(self):
+        from conferences.controller.conference import event_summary
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            admin_token = response.json()['token']
+
+            id_session = next(iter(self.sessions))
+            response = await ac.post(f"/api/sessions/{id_session}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.status_code == 200
+
+            event_summary.invalidate()
+
+            response = await ac.get('/api/admin/summary', headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+            assert response.json() == {'all_users': 3,
+                                       'total_sessions': len(self.sessions),
+                                       'total_bookmarks': 1,
+                                       'total_rates': 0}
+
+            response = await ac.get('/api/admin/dashboard')
+            assert response.status_code == 401
+
+            response = await ac.get('/api/admin/dashboard', headers={'Authorization': f'Bearer {self.token1}'})
+            assert response.status_code == 401
+
+            response = await ac.get('/api/admin/dashboard', headers={'Authorization': f'Bearer {admin_token}'})
+            assert response.status_code == 200
+            assert response.json() == {'total_users': 3, 'total_bookmarks': 1, 'total_ratings': 0}
+
+    async def test_conference_sessions_report(self):
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            admin_token = response.json()['token']
+            headers = {'Authorization': f'Bearer {admin_token}'}
+
+            id_session = next(iter(self.sessions))
+            for token in (self.token1, self.token2):
+                response = await ac.post(f"/api/sessions/{id_session}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {token}"})
+                assert response.status_code == 200
+
+            response = await ac.get('/api/admin/conferences/unknown/sessions', headers=headers)
+            assert response.status_code == 404
+
+            response = await ac.get('/api/conference', headers={'Authorization': f'Bearer {self.token1}'})
+            acronym = response.json()['conference']['acronym']
+
+            with count_queries() as queries:
+                response = await ac.get(f'/api/admin/conferences/{acronym}/sessions', headers=headers)
+
+            assert response.status_code == 200
+            # the conference and the report, whatever the number of sessions
+            assert len(queries) == 2
+
+            res = response.json()
+            assert [column['key'] for column in res['header']] == ['event', 'speakers', 'date', 'bookmarks', 'rating']
+            assert len(res['data']) == len(self.sessions)
+
+            bookmarked = [session for session in res['data'] if session['event'] == self.sessions[id_session]['title']]
+            assert bookmarked[0]['bookmarks'] == 2
+            assert all(session['rating'] == ' ' for session in res['data'])
+
+    @with_fake_redis
+    async def test_leaderboards(self, *args, **kwargs):
+        from conferences.controller.leaderboards import Leaderboards
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            sessions = list(self.sessions)
+            for token in (self.token1, self.token2):
+                response = await ac.post(f"/api/sessions/{sessions[0]}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {token}"})
+                assert response.status_code == 200
+            response = await ac.post(f"/api/sessions/{sessions[1]}/bookmarks/toggle",
+                                     headers={"Authorization": f"Bearer {self.token3}"})
+            assert response.status_code == 200
+
+            expected = [{'id': sessions[0], 'title': self.sessions[sessions[0]]['title'], 'score': 2},
+                        {'id': sessions[1], 'title': self.sessions[sessions[1]]['title'], 'score': 1}]
+
+            # from postgres until the boards are built, from redis afterwards
+            response = await ac.get('/api/leaderboards/bookmarks', headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.status_code == 200
+            assert response.json()['data'] == expected
+
+            await Leaderboards().rebuild()
+
+            response = await ac.get('/api/leaderboards/bookmarks', headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.json()['data'] == expected
+
+            response = await ac.get(f"/api/leaderboards/bookmarks?id_track={self.sessions[sessions[0]]['id_track']}"
+                                    f"&limit=1", headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.json()['data'] == expected[:1]
+
+            response = await ac.get('/api/leaderboards/unknown', headers={"Authorization": f"Bearer {self.token1}"})
+            assert response.status_code == 422
+
+    async def test_engagement_is_served_from_rollups(self):
+        from conferences.controller import engagement
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+
+            response = await ac.post("/api/admin/login", json={"username": "admin", "password": "admin"})
+            assert response.status_code == 200
+            headers = {'Authorization': f"Bearer {response.json()['token']}"}
+
+            for id_session in list(self.sessions)[:2]:
+                response = await ac.post(f"/api/sessions/{id_session}/bookmarks/toggle",
+                                         headers={"Authorization": f"Bearer {self.token1}"})
+                assert response.status_code == 200
+
+            # nothing is counted from raw rows until the rollup ran
+            response = await ac.get('/api/admin/engagement', headers=headers)
+            assert response.status_code == 200
+            assert response.json() == {'resolution': 'hour', 'series': {'bookmarks': [], 'ratings': [], 'users': []}}
+
+            await engagement.rollup()
+            await engagement.rollup()
+
+            for resolution in ('minute', 'hour'):
+                response = await ac.get(f'/api/admin/engagement?resolution={resolution}', headers=headers)
+                assert response.status_code == 200
+                series = response.json()['series']
+                assert sum(bucket['count'] for bucket in series['bookmarks']) == 2
+                assert sum(bucket['count'] for bucket in series['users']) == 3
+                assert series['ratings'] == []
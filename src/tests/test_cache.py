@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import logging
+
+import pytest
+
+from shared.cache import stale_while_revalidate
+
+logging.disable(logging.CRITICAL)
+
+
+class Loader:
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("database is down")
+        return self.calls
+
+
+class TestStaleWhileRevalidate:
+
+    async def test_fresh_value_is_not_reloaded(self):
+        loader = Loader()
+        cached = stale_while_revalidate(ttl=60, stale_ttl=60)(loader)
+
+        assert [await cached() for _ in range(5)] == [1] * 5
+        assert loader.calls == 1
+
+    async def test_concurrent_callers_share_one_load(self):
+        loader = Loader(delay=0.05)
+        cached = stale_while_revalidate(ttl=60, stale_ttl=60)(loader)
+
+        assert await asyncio.gather(*[cached() for _ in range(10)]) == [1] * 10
+        assert loader.calls == 1
+
+    async def test_stale_value_is_returned_while_reloading(self):
+        loader = Loader(delay=0.05)
+        cached = stale_while_revalidate(ttl=0, stale_ttl=60)(loader)
+
+        assert await cached() == 1
+        assert await cached() == 1
+        assert await cached() == 1
+
+        await cached.cache.loading
+        assert loader.calls == 2
+        assert await cached() == 2
+
+    async def test_expired_value_is_not_used(self):
+        loader = Loader()
+        cached = stale_while_revalidate(ttl=0, stale_ttl=0)(loader)
+
+        assert await cached() == 1
+        assert await cached() == 2
+
+    async def test_failed_reload_keeps_stale_value(self):
+        loader = Loader()
+        cached = stale_while_revalidate(ttl=0, stale_ttl=60)(loader)
+        assert await cached() == 1
+
+        loader.fail = True
+        assert await cached() == 1
+        await asyncio.sleep(0)
+        assert await cached() == 1
+
+        cached.invalidate()
+        with pytest.raises(ConnectionError):
+            await cached()
@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import logging
+
+import pytest
+
+import shared.db
+from db_config import db_config
+from shared.db import ReplicaRouter, ReplicaState, read_connection_name, read_only, read_only_request
+
+logging.disable(logging.CRITICAL)
+
+
+class Replica:
+
+    def __init__(self, lag=0.0):
+        self.lag = lag
+
+    async def execute_query_dict(self, sql, values=None):
+        if isinstance(self.lag, Exception):
+            raise self.lag
+        return [{'lag': self.lag}]
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    connection = Replica()
+    state = ReplicaState(max_lag=5)
+    monkeypatch.setattr(shared.db.connections, 'get', lambda name: connection)
+    monkeypatch.setattr(shared.db, 'replica', state)
+    return connection, state
+
+
+class TestReplicaRouter:
+
+    async def test_reads_go_to_the_primary_outside_read_only_requests(self, replica):
+        _, state = replica
+        await state.check()
+
+        assert state.healthy
+        assert read_connection_name() == 'default'
+        assert ReplicaRouter().db_for_read(None) == 'default'
+
+    async def test_read_only_requests_read_from_the_replica_and_write_to_the_primary(self, replica):
+        _, state = replica
+        await state.check()
+
+        dependency = read_only_request()
+        await dependency.__anext__()
+        try:
+            assert ReplicaRouter().db_for_read(None) == 'replica'
+            assert ReplicaRouter().db_for_write(None) == 'default'
+        finally:
+            with pytest.raises(StopAsyncIteration):
+                await dependency.__anext__()
+
+        assert not read_only.get()
+
+    @pytest.mark.parametrize('lag', [30.0, float('inf'), ConnectionError('replica is down')])
+    async def test_lagging_or_unreachable_replica_falls_back_to_the_primary(self, replica, lag):
+        connection, state = replica
+        await state.check()
+        assert state.healthy
+
+        connection.lag = lag
+        await state.check()
+
+        token = read_only.set(True)
+        try:
+            assert not state.healthy
+            assert read_connection_name() == 'default'
+        finally:
+            read_only.reset(token)
+
+    async def test_replica_is_not_used_before_the_first_check(self, replica):
+        token = read_only.set(True)
+        try:
+            assert read_connection_name() == 'default'
+        finally:
+            read_only.reset(token)
+
+
+class TestReadOnlyEndpoints:
+
+    def test_endpoints_returning_own_bookmarks_and_rates_read_from_the_primary(self):
+        # registers the endpoints
+        import conferences.api
+        from app import get_app
+
+        read_only_paths = {route.path for route in get_app().routes
+                           if any(dependency.dependency is read_only_request for dependency in getattr(route, 'dependencies', []))}
+
+        assert '/api/conference/static' in read_only_paths
+        assert '/api/conference' not in read_only_paths
+
+
+class TestDBConfig:
+
+    def test_pool_settings_are_passed_to_asyncpg(self, monkeypatch):
+        monkeypatch.delenv('DB_REPLICA_HOST', raising=False)
+
+        config = db_config('opencon_db', replica=True)
+        credentials = config['connections']['default']['credentials']
+
+        assert set(config['connections']) == {'default'}
+        assert 'routers' not in config
+        assert credentials['database'] == 'opencon_db'
+        assert {'minsize', 'maxsize', 'statement_cache_size', 'timeout', 'command_timeout'} <= set(credentials)
+
+    def test_replica_is_configured_with_its_own_host(self, monkeypatch):
+        monkeypatch.setenv('DB_HOST', 'primary')
+        monkeypatch.setenv('DB_REPLICA_HOST', 'replica')
+
+        config = db_config('opencon_db', replica=True)
+
+        assert config['connections']['default']['credentials']['host'] == 'primary'
+        assert config['connections']['replica']['credentials']['host'] == 'replica'
+        assert config['connections']['replica']['credentials']['database'] == 'opencon_db'
+        assert config['routers'] == ['shared.db.ReplicaRouter']
+
+        assert 'replica' not in db_config('opencon_db')['connections']
@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import json
+
+from shared.export import csv_chunks, ndjson_chunks
+
+COLUMNS = {'title': 'Title', 'bookmarks': 'Bookmarks'}
+
+
+async def rows(n, fetched=None):
+    for i in range(n):
+        if fetched is not None:
+            fetched.append(i)
+        yield {'title': f'Session, {i}', 'bookmarks': i}
+
+
+def values(row):
+    return [row['title'], row['bookmarks']]
+
+
+class TestExport:
+
+    async def test_csv_is_streamed_in_chunks(self):
+        chunks = [chunk async for chunk in csv_chunks(rows(5), COLUMNS, values, chunk_rows=2)]
+
+        assert chunks[0] == 'Title,Bookmarks\r\n'
+        assert [chunk.count('\n') for chunk in chunks[1:]] == [2, 2, 1]
+        assert ''.join(chunks).splitlines()[-1] == '"Session, 4",4'
+
+    async def test_header_is_sent_before_rows_are_fetched(self):
+        fetched = []
+        chunks = csv_chunks(rows(5, fetched), COLUMNS, values, chunk_rows=2)
+
+        assert await chunks.__anext__() == 'Title,Bookmarks\r\n'
+        assert fetched == []
+
+        assert (await chunks.__anext__()).count('\n') == 2
+        assert fetched == [0, 1]
+
+    async def test_ndjson(self):
+        chunks = [chunk async for chunk in ndjson_chunks(rows(3), COLUMNS, values, chunk_rows=2)]
+
+        assert len(chunks) == 2
+        assert [json.loads(line) for line in ''.join(chunks).splitlines()] == \
+               [{'title': f'Session, {i}', 'bookmarks': i} for i in range(3)]
+
+    async def test_empty_csv_has_header_only(self):
+        assert [chunk async for chunk in csv_chunks(rows(0), COLUMNS, values)] == ['Title,Bookmarks\r\n']
@@ -0,0 +1,101 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import datetime
+import logging
+import types
+
+import fakeredis.aioredis
+
+logging.disable(logging.CRITICAL)
+
+import shared.db
+from conferences.controller.leaderboards import REBUILD_KEY_PREFIX, Leaderboards, leaderboard_key, ready_key
+from shared.redis_client import AsyncRedisClientHandler
+
+CONFERENCE = 'c1'
+
+
+def session(id_session, id_track='t1', day=8):
+    return types.SimpleNamespace(id=id_session, conference_id=CONFERENCE, track_id=id_track,
+                                 start_date=datetime.datetime(2024, 11, day, 10, 0))
+
+
+def fake_leaderboards():
+    return Leaderboards(AsyncRedisClientHandler(redis_instance=fakeredis.aioredis.FakeRedis()))
+
+
+class TestLeaderboards:
+
+    async def test_most_bookmarked(self):
+        leaderboards = fake_leaderboards()
+
+        for _ in range(3):
+            await leaderboards.bookmark(session('s1'), 1)
+        await leaderboards.bookmark(session('s2'), 1)
+        await leaderboards.bookmark(session('s3'), 1)
+        await leaderboards.bookmark(session('s3'), -1)
+
+        assert await leaderboards.top(CONFERENCE, 'bookmarks') == [('s1', 3), ('s2', 1)]
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', limit=1) == [('s1', 3)]
+
+    async def test_per_day_and_track(self):
+        leaderboards = fake_leaderboards()
+
+        await leaderboards.bookmark(session('s1', 't1', 8), 1)
+        await leaderboards.bookmark(session('s2', 't2', 8), 1)
+        await leaderboards.bookmark(session('s2', 't2', 8), 1)
+        await leaderboards.bookmark(session('s3', 't1', 9), 1)
+
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', day='2024-11-08') == [('s2', 2), ('s1', 1)]
+        assert sorted(await leaderboards.top(CONFERENCE, 'bookmarks', id_track='t1')) == [('s1', 1), ('s3', 1)]
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', day='2024-11-09', id_track='t1') == [('s3', 1)]
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', day='2024-11-10') == []
+
+    async def test_top_rated(self):
+        leaderboards = fake_leaderboards()
+
+        await leaderboards.rate(session('s1'), 1, 5)
+        await leaderboards.rate(session('s2'), 3, 4.5)
+        await leaderboards.rate(session('s1'), 2, 3)
+
+        assert await leaderboards.top(CONFERENCE, 'rating') == [('s2', 4.5), ('s1', 3)]
+        assert await leaderboards.top(CONFERENCE, 'rates') == [('s2', 3), ('s1', 2)]
+
+    async def test_failed_update_invalidates_boards(self):
+        leaderboards = fake_leaderboards()
+        await leaderboards.redis.set(ready_key(CONFERENCE), 1)
+        assert await leaderboards.is_ready(CONFERENCE)
+
+        # a plain string under a sorted set key makes ZINCRBY fail
+        await leaderboards.redis.set(leaderboard_key(CONFERENCE, 'bookmarks', 'all'), 'broken')
+        await leaderboards.bookmark(session('s1'), 1)
+
+        assert not await leaderboards.is_ready(CONFERENCE)
+
+    async def test_rebuild_swaps_boards_in_at_once(self, monkeypatch):
+        leaderboards = fake_leaderboards()
+        for _ in range(2):
+            await leaderboards.bookmark(session('s1', 't1', 8), 1)
+        await leaderboards.bookmark(session('s2', 't2', 9), 1)
+        await leaderboards.redis.set(ready_key(CONFERENCE), 1)
+
+        seen_while_building = []
+
+        async def stream_rows(sql, params):
+            # s2 has been removed, s1 moved to the next day
+            yield dict(id='s1', conference_id=CONFERENCE, track_id='t1', start_date=datetime.datetime(2024, 11, 9, 10),
+                       bookmarks=2, rates=0, rating=None)
+            seen_while_building.append((await leaderboards.is_ready(CONFERENCE),
+                                        await leaderboards.top(CONFERENCE, 'bookmarks')))
+
+        monkeypatch.setattr(shared.db, 'stream_rows', stream_rows)
+
+        assert await leaderboards.rebuild(CONFERENCE) == 1
+
+        assert seen_while_building == [(True, [('s1', 2), ('s2', 1)])]
+        assert await leaderboards.is_ready(CONFERENCE)
+        assert await leaderboards.top(CONFERENCE, 'bookmarks') == [('s1', 2)]
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', day='2024-11-08') == []
+        assert await leaderboards.top(CONFERENCE, 'bookmarks', id_track='t2') == []
+        assert not await leaderboards.redis.keys(f'{REBUILD_KEY_PREFIX}*')
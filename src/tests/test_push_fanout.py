@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import datetime
+import logging
+import math
+import os
+import time
+import uuid
+from unittest.mock import patch
+
+import dotenv
+import fakeredis.aioredis
+import pytest
+from base_test_classes import BaseAPITest, with_fake_redis
+from httpx import AsyncClient
+
+os.environ["TEST_MODE"] = "true"
+
+dotenv.load_dotenv()
+
+logging.disable(logging.CRITICAL)
+
+from shared.redis_client import PIPELINE_BATCH_SIZE, AsyncRedisClientHandler, RedisClientHandler
+
+
+class TestPipelinedEnqueue:
+
+    @pytest.mark.parametrize('nr_messages', [1, PIPELINE_BATCH_SIZE, 10 * PIPELINE_BATCH_SIZE + 1])
+    async def test_add_stream_messages_one_round_trip_per_batch(self, nr_messages):
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        redis_client = AsyncRedisClientHandler(redis_instance=fake_redis)
+
+        with patch.object(fake_redis, 'pipeline', wraps=fake_redis.pipeline) as pipeline:
+            pushed = await redis_client.add_stream_messages('opencon_push_notification',
+                                                            [{'id': f'ExponentPushToken[{i}]'}
+                                                             for i in range(nr_messages)])
+
+        assert pushed == nr_messages
+        assert pipeline.call_count == math.ceil(nr_messages / PIPELINE_BATCH_SIZE)
+        assert await fake_redis.xlen('opencon_push_notification') == nr_messages
+
+
+class TestStreamedFanout:
+
+    async def test_fanout_targets_are_flushed_in_batches(self):
+        import conferences.controller as controller
+
+        id_session = str(uuid.uuid4())
+        old_start = datetime.datetime(2024, 11, 8, 10, 0)
+        changes = {id_session: {'old_start_timestamp': old_start,
+                                'new_start_timestamp': old_start + datetime.timedelta(minutes=30)}}
+
+        nr_targets = 2 * PIPELINE_BATCH_SIZE + 1
+
+        async def stream_rows(sql, params=()):
+            for i in range(nr_targets):
+                yield {'token': f'ExponentPushToken[{i}]', 'session_id': uuid.UUID(id_session),
+                       'title': 'Keynote', 'room': 'Seminar 1'}
+
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        redis_client = AsyncRedisClientHandler(redis_instance=fake_redis)
+
+        with patch('shared.db.stream_rows', stream_rows), \
+                patch.object(AsyncRedisClientHandler, 'get_redis_client', return_value=redis_client), \
+                patch.object(redis_client, 'add_stream_messages', wraps=redis_client.add_stream_messages) as add:
+            await controller.send_changes_to_bookmakers(changes, group_4_user=False)
+
+        assert add.call_count == 3
+        assert await fake_redis.xlen('opencon_push_notification') == nr_targets
+
+        payloads = [payload for call in add.call_args_list for payload in call.args[1]]
+        assert payloads[0]['message'] == "Session 'Keynote' has been rescheduled from 10:00 to 10:30 in room Seminar 1"
+        assert payloads[-1]['expo_push_notification_token'] == f'ExponentPushToken[{nr_targets - 1}]'
+        assert payloads[-1]['data'] == {'command': 'SESSION_START_CHANGED', 'session_id': id_session,
+                                        'value': '2024-11-08 10:30:00'}
+
+
+class TestFanoutBenchmark(BaseAPITest):
+
+    async def setup(self):
+        self.import_modules(['src.conferences.api'])
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True})
+            assert response.status_code == 200
+
+    @with_fake_redis
+    async def test_fanout_time_vs_bookmarked_users(self, *args, **kwargs):
+        import conferences.controller as controller
+        import conferences.models as models
+
+        redis_client = RedisClientHandler.get_redis_client()
+
+        sessions = await models.EventSession.filter().order_by('start_date').limit(4)
+
+        # each size bookmarks a different session, so previous users are not notified again
+        for nr_users, session in zip((10, 100, 1000, 5000), sessions):
+            users = [models.UserAnonymous(id=uuid.uuid4(), push_notification_token=f'ExponentPushToken[{i}]')
+                     for i in range(nr_users)]
+            await models.UserAnonymous.bulk_create(users)
+            await models.AnonymousBookmark.bulk_create([models.AnonymousBookmark(user=user, session=session)
+                                                        for user in users])
+
+            changes = {str(session.id): {'old_start_timestamp': session.start_date,
+                                         'new_start_timestamp': session.start_date + datetime.timedelta(minutes=5)}}
+
+            started = time.perf_counter()
+            await controller.send_changes_to_bookmakers(changes, group_4_user=False)
+            elapsed = time.perf_counter() - started
+
+            print(f"\nfan-out to {nr_users} bookmarked users took {elapsed * 1000:.1f}ms")
+
+            assert redis_client.get_stream_length('opencon_push_notification') == nr_users
+            redis_client.clear_queue('opencon_push_notification')
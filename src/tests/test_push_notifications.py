@@ -0,0 +1,398 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import json
+import logging
+import time
+
+import fakeredis.aioredis
+import pytest
+import redis
+from expo_stand_in import EXPO_STAND_IN_RECEIPTS_URL, EXPO_STAND_IN_URL, ExpoStandIn
+
+logging.disable(logging.CRITICAL)
+
+from workers.push_notifications import (EXPO_BATCH_SIZE, ExpoPushSender, PushDeliveryError, PushQueue,
+                                        RedisTokenBucket, check_receipts, deliver, flush_dead_tokens, read_redis_queue)
+
+QUEUE_NAME = 'opencon_push_notification'
+CONSUMER = 'test:0'
+
+
+def notification(i):
+    return {'id': f'ExponentPushToken[{i}]',
+            'expo_push_notification_token': f'ExponentPushToken[{i}]',
+            'subject': "Event rescheduled",
+            'message': "Some of your bookmarked events have been rescheduled",
+            'data': {'command': 'OPEN_BOOKMARKS'}}
+
+
+async def fake_queue(nr_notifications, **kwargs):
+    queue = PushQueue(fakeredis.aioredis.FakeRedis(decode_responses=True), QUEUE_NAME, **kwargs)
+    await queue.ensure_group()
+    await queue.add([json.dumps(notification(i)) for i in range(nr_notifications)])
+    return queue
+
+
+async def nr_pending(queue):
+    return (await queue.redis_client.xpending(QUEUE_NAME, queue.group))['pending']
+
+
+def sender(client):
+    return ExpoPushSender(client, url=EXPO_STAND_IN_URL, receipts_url=EXPO_STAND_IN_RECEIPTS_URL)
+
+
+async def drain(queue, expo):
+    async with expo.client() as client:
+        while entries := await queue.claim(CONSUMER, timeout=0.1):
+            await deliver(queue, sender(client), entries)
+
+
+class TestExpoPushSender:
+
+    async def test_send_batch_returns_ticket_per_message(self):
+        expo = ExpoStandIn()
+
+        async with expo.client() as client:
+            tickets = await sender(client).send_batch([{'to': f'ExponentPushToken[{i}]'} for i in range(3)])
+
+        assert [t['status'] for t in tickets] == ['ok'] * 3
+
+    @pytest.mark.parametrize('failure, retriable', [('fail_requests', True), ('reject_requests', False)])
+    async def test_http_errors(self, failure, retriable):
+        expo = ExpoStandIn()
+        setattr(expo, failure, 1)
+
+        async with expo.client() as client:
+            with pytest.raises(PushDeliveryError) as e:
+                await sender(client).send_batch([{'to': 'ExponentPushToken[1]'}])
+
+        assert e.value.retriable == retriable
+
+
+class TestRateLimit:
+
+    async def test_bucket_is_shared_between_workers(self):
+        server = fakeredis.FakeServer()
+        buckets = [RedisTokenBucket(fakeredis.aioredis.FakeRedis(server=server), 'rate_limit', rate=1000, capacity=100)
+                   for _ in range(2)]
+
+        assert await buckets[0].reserve(100) == 0
+        # the second worker finds the bucket empty and waits for its reservation to be refilled
+        assert 0.09 < await buckets[1].reserve(100) <= 0.1
+        assert 0.19 < await buckets[0].reserve(100) <= 0.2
+
+    async def test_send_rate_is_limited(self):
+        expo = ExpoStandIn()
+        bucket = RedisTokenBucket(fakeredis.aioredis.FakeRedis(), 'rate_limit', rate=1000, capacity=EXPO_BATCH_SIZE)
+
+        started = time.perf_counter()
+        async with expo.client() as client:
+            sender = ExpoPushSender(client, url=EXPO_STAND_IN_URL, receipts_url=EXPO_STAND_IN_RECEIPTS_URL,
+                                    rate_limiter=bucket)
+            await asyncio.gather(*[sender.send_batch([{'to': f'ExponentPushToken[{i}]'}])
+                                   for i in range(EXPO_BATCH_SIZE + 200)])
+        elapsed = time.perf_counter() - started
+
+        assert len(expo.requests) == EXPO_BATCH_SIZE + 200
+        assert elapsed >= 0.19
+
+
+class TestReliableDelivery:
+
+    async def test_drain_10k_reschedule_in_seconds(self):
+        queue = await fake_queue(10000)
+        expo = ExpoStandIn()
+
+        started = time.perf_counter()
+        await drain(queue, expo)
+        elapsed = time.perf_counter() - started
+
+        assert len(expo.messages) == 10000
+        assert len(expo.requests) == 10000 // EXPO_BATCH_SIZE
+        assert expo.messages[0] == {'to': 'ExponentPushToken[0]',
+                                    'title': "Event rescheduled",
+                                    'body': "Some of your bookmarked events have been rescheduled"}
+        assert await queue.redis_client.xlen(QUEUE_NAME) == 0
+        assert await nr_pending(queue) == 0
+        assert await queue.redis_client.zcard(queue.receipts_key) == 10000
+        assert elapsed < 10
+
+    async def test_transient_failure_is_retried(self):
+        queue = await fake_queue(150, retry_base_delay=0)
+        expo = ExpoStandIn()
+        expo.fail_requests = 1
+
+        await drain(queue, expo)
+
+        assert len(expo.messages) == 50
+        assert await queue.redis_client.zcard(queue.retry_key) == 100
+
+        assert await queue.requeue_due_retries() == 100
+        await drain(queue, expo)
+
+        assert sorted(m['to'] for m in expo.messages) == sorted(f'ExponentPushToken[{i}]' for i in range(150))
+        assert await queue.redis_client.zcard(queue.retry_key) == 0
+        assert await queue.redis_client.llen(queue.dead_letter_key) == 0
+
+    async def test_exhausted_retries_are_dead_lettered_and_replayed(self):
+        queue = await fake_queue(10, max_attempts=2, retry_base_delay=0)
+        expo = ExpoStandIn()
+        expo.fail_requests = 2
+
+        await drain(queue, expo)
+        await queue.requeue_due_retries()
+        await drain(queue, expo)
+
+        dead_letters = await queue.dead_letters()
+        assert len(dead_letters) == 10
+        assert dead_letters[0]['_attempts'] == 2 and dead_letters[0]['_error'] == 'HTTP 503'
+        assert await queue.redis_client.zcard(queue.retry_key) == 0
+
+        assert await queue.replay_dead_letters(limit=4) == 4
+        assert await queue.redis_client.llen(queue.dead_letter_key) == 6
+
+        await drain(queue, expo)
+        assert len(expo.messages) == 4
+        assert '_attempts' not in expo.messages[0]
+
+    async def test_rejected_batch_is_dead_lettered(self):
+        queue = await fake_queue(10)
+        expo = ExpoStandIn()
+        expo.reject_requests = 1
+
+        await drain(queue, expo)
+
+        assert len(await queue.dead_letters()) == 10
+        assert await queue.redis_client.zcard(queue.retry_key) == 0
+
+    async def test_ticket_errors(self):
+        queue = await fake_queue(4, retry_base_delay=0)
+        expo = ExpoStandIn()
+        expo.ticket_errors = {'ExponentPushToken[0]': 'DeviceNotRegistered',
+                              'ExponentPushToken[1]': 'MessageRateExceeded',
+                              'ExponentPushToken[2]': 'MessageTooBig'}
+
+        await drain(queue, expo)
+
+        assert [json.loads(raw)['id'] for raw in await queue.redis_client.zrange(queue.retry_key, 0, -1)] == \
+               ['ExponentPushToken[1]']
+        assert [item['id'] for item in await queue.dead_letters()] == ['ExponentPushToken[2]']
+        assert await queue.redis_client.zcard(queue.receipts_key) == 1
+        assert await queue.redis_client.smembers(queue.dead_tokens_key) == {'ExponentPushToken[0]'}
+        assert await nr_pending(queue) == 0
+
+    async def test_receipts(self):
+        queue = await fake_queue(3)
+        expo = ExpoStandIn()
+        expo.receipt_errors = {'ExponentPushToken[1]': 'MessageTooBig',
+                               'ExponentPushToken[2]': 'DeviceNotRegistered'}
+
+        await drain(queue, expo)
+
+        async with expo.client() as client:
+            assert await check_receipts(queue, sender(client), delay=60) == 0
+            assert await check_receipts(queue, sender(client), delay=0) == 3
+
+        assert len(expo.receipt_requests) == 1 and len(expo.receipt_requests[0]) == 3
+        assert await queue.redis_client.zcard(queue.receipts_key) == 0
+        assert [item['id'] for item in await queue.dead_letters()] == ['ExponentPushToken[1]']
+        assert await queue.redis_client.smembers(queue.dead_tokens_key) == {'ExponentPushToken[2]'}
+
+    async def test_pending_entries_are_resumed_and_claimed(self):
+        queue = await fake_queue(5, claim_idle_ms=50)
+
+        assert len(await queue.claim('crashed:0')) == 5
+        assert await queue.claim(CONSUMER, timeout=0.01) == []
+
+        # the same consumer sees its own pending entries again after a restart
+        assert len(await queue.pending('crashed:0')) == 5
+
+        # any other consumer takes them over once they have been idle long enough
+        await asyncio.sleep(0.1)
+        claimed = await queue.claim(CONSUMER, timeout=0.01)
+        assert [json.loads(raw) for entry_id, raw in claimed] == [notification(i) for i in range(5)]
+
+        await queue.ack([entry_id for entry_id, raw in claimed])
+        assert await nr_pending(queue) == 0
+        assert await queue.redis_client.xlen(QUEUE_NAME) == 0
+
+    async def test_metrics(self):
+        queue = await fake_queue(10)
+
+        await queue.claim('a', max_items=3)
+        await queue.claim('b', max_items=2)
+
+        metrics = await queue.metrics()
+        assert metrics['length'] == 10
+        assert metrics['lag'] == 5
+        assert metrics['pending'] == 5
+        assert {name: c['pending'] for name, c in metrics['consumers'].items()} == {'a': 3, 'b': 2}
+
+    async def test_backlog_is_reported(self):
+        from shared.redis_client import AsyncRedisClientHandler
+
+        queue = await fake_queue(10)
+        await queue.claim(CONSUMER, max_items=4)
+
+        redis_client = AsyncRedisClientHandler(redis_instance=queue.redis_client)
+        assert await redis_client.get_stream_backlog(QUEUE_NAME, queue.group) == {'length': 10, 'lag': 6,
+                                                                                   'pending': 4}
+        assert await redis_client.get_stream_backlog('missing', queue.group) == {'length': 0, 'lag': None,
+                                                                                  'pending': 0}
+
+
+class TestCoalescing:
+
+    async def test_consecutive_imports_are_merged_per_device(self):
+        import conferences.controller as controller
+        from shared.redis_client import AsyncRedisClientHandler
+
+        server = fakeredis.FakeServer()
+        queue = PushQueue(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True), QUEUE_NAME)
+        await queue.ensure_group()
+        importer = AsyncRedisClientHandler(redis_instance=fakeredis.aioredis.FakeRedis(server=server))
+
+        # three feed fixes in a row, the second moves the same session again
+        await controller.coalesce_grouped_notifications(importer, [('ExponentPushToken[1]', ['s1']),
+                                                                   ('ExponentPushToken[2]', ['s1'])], window=60)
+        await controller.coalesce_grouped_notifications(importer, [('ExponentPushToken[1]', ['s1'])], window=60)
+        await controller.coalesce_grouped_notifications(importer, [('ExponentPushToken[1]', ['s2'])], window=60)
+
+        assert await queue.release_coalesced() == 0
+        assert (await queue.metrics())['coalesced'] == 2
+
+        assert await queue.release_coalesced(now=time.time() + 60) == 2
+        assert await queue.release_coalesced(now=time.time() + 60) == 0
+
+        expo = ExpoStandIn()
+        await drain(queue, expo)
+
+        assert sorted((m['to'], m['title']) for m in expo.messages) == [('ExponentPushToken[1]', "Events rescheduled"),
+                                                                        ('ExponentPushToken[2]', "Event rescheduled")]
+        assert await queue.redis_client.keys(f'{QUEUE_NAME}:coalesced*') == []
+
+
+class TestDeadTokenPruning:
+
+    async def test_dead_tokens_are_pruned_in_batches(self):
+        queue = await fake_queue(0)
+        await queue.mark_dead_tokens([f'ExponentPushToken[{i}]' for i in range(25)])
+
+        pruned = []
+
+        async def prune_tokens(tokens):
+            pruned.append(tokens)
+
+        assert await flush_dead_tokens(queue, prune_tokens, batch_size=10) == 25
+        assert [len(tokens) for tokens in pruned] == [10, 10, 5]
+        assert await queue.redis_client.scard(queue.dead_tokens_key) == 0
+
+    async def test_failed_prune_keeps_tokens(self):
+        queue = await fake_queue(0)
+        await queue.mark_dead_tokens(['ExponentPushToken[1]', 'ExponentPushToken[2]'])
+
+        async def prune_tokens(tokens):
+            raise Exception("database is down")
+
+        with pytest.raises(Exception):
+            await flush_dead_tokens(queue, prune_tokens)
+
+        assert await queue.redis_client.scard(queue.dead_tokens_key) == 2
+
+
+class TestWorker:
+
+    async def run_worker(self, queue, expo, stop, consumers=4, worker_name='test', rate_limit=0):
+        return asyncio.create_task(read_redis_queue(queue, stop=stop, http_client=expo.client(),
+                                                    url=EXPO_STAND_IN_URL, receipts_url=EXPO_STAND_IN_RECEIPTS_URL,
+                                                    consumers=consumers, worker_name=worker_name,
+                                                    rate_limit=rate_limit))
+
+    async def test_workers_share_rate_limit(self):
+        queue = await fake_queue(1200)
+        expo = ExpoStandIn()
+        stop = asyncio.Event()
+
+        started = time.perf_counter()
+        workers = [await self.run_worker(queue, expo, stop, worker_name=f'replica{r}', rate_limit=1000)
+                   for r in range(2)]
+        while len(expo.messages) < 1200:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await asyncio.wait_for(asyncio.gather(*workers), 5)
+
+        # one second worth of burst, the rest at 1000 per second regardless of the number of workers
+        assert elapsed >= 0.2
+
+    async def test_replicas_drain_stream_without_duplicates(self):
+        queue = await fake_queue(3000)
+        expo = ExpoStandIn()
+        stop = asyncio.Event()
+
+        # two worker processes sharing one consumer group
+        workers = [await self.run_worker(queue, expo, stop, worker_name=f'replica{r}') for r in range(2)]
+        while await queue.redis_client.xlen(QUEUE_NAME):
+            await asyncio.sleep(0.05)
+
+        stop.set()
+        await asyncio.wait_for(asyncio.gather(*workers), 5)
+
+        assert sorted(m['to'] for m in expo.messages) == sorted(f'ExponentPushToken[{i}]' for i in range(3000))
+
+    async def test_stop_finishes_in_flight_batches(self):
+        queue = await fake_queue(5000)
+        expo = ExpoStandIn(delay=0.2)
+        stop = asyncio.Event()
+
+        worker = await self.run_worker(queue, expo, stop, consumers=2)
+        while (await queue.metrics())['lag'] == 5000:
+            await asyncio.sleep(0.01)
+
+        stop.set()
+        await asyncio.wait_for(worker, 5)
+
+        # every claimed notification has been delivered, the rest is still queued
+        assert len(expo.messages) + await queue.redis_client.xlen(QUEUE_NAME) == 5000
+        assert await queue.redis_client.xlen(QUEUE_NAME) > 0
+        assert await nr_pending(queue) == 0
+
+    async def test_redis_errors_do_not_stop_the_worker(self, monkeypatch):
+        import workers.push_notifications
+
+        monkeypatch.setattr(workers.push_notifications, 'PUSH_ERROR_BACKOFF', 0.01)
+
+        queue = await fake_queue(300)
+        claim, requeue_due_retries = queue.claim, queue.requeue_due_retries
+        failures = {'claim': 3, 'requeue': 3}
+
+        async def flaky_claim(consumer, *args, **kwargs):
+            if failures['claim']:
+                failures['claim'] -= 1
+                raise redis.exceptions.ConnectionError("Connection refused")
+            return await claim(consumer, *args, **kwargs)
+
+        async def flaky_requeue_due_retries(*args, **kwargs):
+            if failures['requeue']:
+                failures['requeue'] -= 1
+                raise redis.exceptions.TimeoutError("Timeout reading from socket")
+            return await requeue_due_retries(*args, **kwargs)
+
+        monkeypatch.setattr(queue, 'claim', flaky_claim)
+        monkeypatch.setattr(queue, 'requeue_due_retries', flaky_requeue_due_retries)
+
+        expo = ExpoStandIn()
+        stop = asyncio.Event()
+        worker = await self.run_worker(queue, expo, stop, consumers=2)
+
+        while len(expo.messages) < 300 or failures['requeue']:
+            assert not worker.done(), worker.exception()
+            await asyncio.sleep(0.01)
+
+        stop.set()
+        await asyncio.wait_for(worker, 5)
+
+        assert failures == {'claim': 0, 'requeue': 0}
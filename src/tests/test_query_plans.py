@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import datetime
+import json
+import os
+import pathlib
+
+import dotenv
+from base_test_classes import BaseAPITest
+from httpx import AsyncClient
+
+os.environ["TEST_MODE"] = "true"
+
+dotenv.load_dotenv()
+
+from aerich.utils import import_py_file
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+from conferences.controller.conference import FANOUT_TARGETS_SQL, GROUPED_FANOUT_TARGETS_SQL, SESSION_RATING_SQL
+from conferences.controller.reminders import BOOKMARKERS_SQL, UPCOMING_SESSIONS_SQL
+
+MIGRATIONS = pathlib.Path(__file__).parent.parent / 'migrations' / 'models'
+
+SEED_SQL = """
+    INSERT INTO conferences_users_anonymous (id, created, push_notification_token)
+    SELECT md5('user' || i)::uuid, now() - i * interval '1 minute',
+           CASE WHEN i % 3 = 0 THEN NULL ELSE 'ExponentPushToken[' || i || ']' END
+      FROM generate_series(1, 5000) i;
+
+    INSERT INTO conferences_anonymous_bookmarks (id, created, user_id, session_id)
+    SELECT md5('bookmark' || u.id || s.id)::uuid, now(), u.id, s.id
+      FROM conferences_users_anonymous u
+      JOIN conferences_event_sessions s ON abs(hashtext(u.id::text || s.id::text)) % 20 = 0;
+
+    INSERT INTO conferences_anonymous_rates (id, created, user_id, session_id, rate)
+    SELECT md5('rate' || u.id || s.id)::uuid, now(), u.id, s.id, 1 + abs(hashtext(s.id::text || u.id::text)) % 5
+      FROM conferences_users_anonymous u
+      JOIN conferences_event_sessions s ON abs(hashtext(u.id::text || s.id::text)) % 50 = 0;
+
+    ANALYZE;
+"""
+
+
+def seq_scans(plan):
+    # relations read with a sequential scan anywhere in the plan
+    found = [plan['Relation Name']] if plan.get('Node Type') == 'Seq Scan' else []
+    for child in plan.get('Plans', []):
+        found += seq_scans(child)
+    return found
+
+
+class TestHotQueryPlans(BaseAPITest):
+
+    async def setup(self):
+        self.import_modules(['src.conferences.api'])
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True})
+            assert response.status_code == 200
+
+        # the test database comes from generate_schemas, indexes only the migrations create are added on top
+        connection = connections.get('default')
+        for migration in sorted(MIGRATIONS.glob('*.py'), key=lambda path: int(path.name.split('_')[0])):
+            await connection.execute_script(await import_py_file(migration).upgrade(connection))
+
+        await connection.execute_script(SEED_SQL)
+
+        self.session = (await connection.execute_query_dict(
+            "SELECT id, conference_id, unique_id FROM conferences_event_sessions LIMIT 1"))[0]
+        self.room = (await connection.execute_query_dict(
+            "SELECT conference_id, location_id, slug FROM conferences_rooms LIMIT 1"))[0]
+        self.lecturer = (await connection.execute_query_dict(
+            "SELECT conference_id, external_id FROM conferences_lecturers LIMIT 1"))[0]
+        self.conference = (await connection.execute_query_dict("SELECT id, source_uri, acronym FROM conferences"))[0]
+
+    def hot_queries(self):
+        now = datetime.datetime(2024, 11, 8, 10, 0, tzinfo=datetime.timezone.utc)
+
+        return {
+            'current conference': (
+                "SELECT id FROM conferences ORDER BY created DESC LIMIT 1", []),
+            'conference by source': (
+                "SELECT id FROM conferences WHERE source_uri = $1", [self.conference['source_uri']]),
+            'conference by acronym': (
+                "SELECT id FROM conferences WHERE acronym = $1 ORDER BY created DESC LIMIT 1",
+                [self.conference['acronym']]),
+            'session by unique id': (
+                "SELECT id FROM conferences_event_sessions WHERE conference_id = $1 AND unique_id = $2",
+                [self.session['conference_id'], self.session['unique_id']]),
+            'sessions of conference': (
+                "SELECT id FROM conferences_event_sessions WHERE conference_id = $1 ORDER BY start_date",
+                [self.session['conference_id']]),
+            'room by slug': (
+                "SELECT id FROM conferences_rooms WHERE conference_id = $1 AND location_id = $2 AND slug = $3",
+                [self.room['conference_id'], self.room['location_id'], self.room['slug']]),
+            'lecturer by external id': (
+                "SELECT id FROM conferences_lecturers WHERE conference_id = $1 AND external_id = $2",
+                [self.lecturer['conference_id'], self.lecturer['external_id']]),
+            'lecturers of session': (
+                "SELECT conferences_lecturers_id FROM conferences_lecturers_conferences_event_sessions "
+                "WHERE eventsession_id = $1", [self.session['id']]),
+            'rates of session': (SESSION_RATING_SQL, [self.session['id']]),
+            'reminder bookmarkers': (BOOKMARKERS_SQL, [[self.session['id']]]),
+            'fan-out targets': (FANOUT_TARGETS_SQL, [[self.session['id']]]),
+            'grouped fan-out targets': (GROUPED_FANOUT_TARGETS_SQL, [[self.session['id']]]),
+            'upcoming reminders': (UPCOMING_SESSIONS_SQL, [now, now + datetime.timedelta(hours=2)]),
+        }
+
+    async def test_hot_queries_do_not_scan_tables(self):
+        failures = {}
+
+        async with in_transaction() as connection:
+            # with sequential scans priced out the planner still picks one only where no index fits
+            await connection.execute_script("SET LOCAL enable_seqscan = off")
+
+            for name, (sql, params) in self.hot_queries().items():
+                rows = await connection.execute_query_dict(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = rows[0]['QUERY PLAN']
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+
+                if scanned := seq_scans(plan[0]['Plan']):
+                    failures[name] = scanned
+
+        assert not failures, f"sequential scans in hot queries: {failures}"
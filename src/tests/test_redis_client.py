@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import gc
+import threading
+import time
+import weakref
+
+import fakeredis
+import fakeredis.aioredis
+import redis
+import redis.asyncio
+
+import shared.redis_client
+from shared.redis_client import (AsyncRedisClientHandler, InstrumentedAsyncConnectionPool, InstrumentedConnectionPool,
+                                 RedisClientHandler, pool_stats)
+
+
+class TestSharedPools:
+
+    def test_sync_handlers_share_one_pool(self):
+        pools = {RedisClientHandler.get_redis_client().redis_client.connection_pool for _ in range(10)}
+
+        assert len(pools) == 1
+        assert isinstance(pools.pop(), InstrumentedConnectionPool)
+
+    async def test_async_handlers_share_one_pool_per_loop(self):
+        pools = {AsyncRedisClientHandler.get_redis_client().redis_client.connection_pool for _ in range(10)}
+
+        assert len(pools) == 1
+        assert isinstance(pools.pop(), InstrumentedAsyncConnectionPool)
+        assert any(name.startswith('async:6379/0:') for name in pool_stats())
+
+    def test_async_pools_are_dropped_with_their_loop(self):
+        async def pool():
+            return AsyncRedisClientHandler.get_redis_client().redis_client.connection_pool
+
+        pools, loops = [], []
+        for _ in range(3):
+            loop = asyncio.new_event_loop()
+            pools.append(loop.run_until_complete(pool()))
+            loops.append(weakref.ref(loop))
+            loop.close()
+            del loop
+            gc.collect()
+
+        # a closed loop's pool is never handed to the next loop, even when it gets the same id
+        assert len(set(pools)) == 3
+        assert not [ref for ref in loops if ref() is not None]
+        assert not [p for pools_of_loop in shared.redis_client._async_pools.values()
+                    for p in pools_of_loop.values() if p in pools]
+
+    def test_wait_for_free_connection_is_measured(self):
+        pool = InstrumentedConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=fakeredis.FakeServer(),
+                                          max_connections=1, timeout=5)
+        client = redis.Redis(connection_pool=pool)
+
+        connection = pool.get_connection('PING')
+        threading.Timer(0.1, pool.release, [connection]).start()
+
+        assert client.ping()
+
+        stats = pool.stats.as_dict()
+        assert stats['acquired'] == 2
+        assert stats['in_use'] == 0
+        assert stats['wait_max_ms'] >= 90
+
+    async def test_async_wait_for_free_connection_is_measured(self):
+        pool = InstrumentedAsyncConnectionPool(connection_class=fakeredis.aioredis.FakeAsyncRedisConnection,
+                                               server=fakeredis.FakeServer(), max_connections=2, timeout=5)
+        client = redis.asyncio.Redis(connection_pool=pool)
+
+        async def hold_connection():
+            connection = await pool.get_connection('PING')
+            await asyncio.sleep(0.1)
+            await pool.release(connection)
+
+        holders = [asyncio.create_task(hold_connection()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        assert await client.ping()
+        assert time.perf_counter() - started >= 0.08
+
+        await asyncio.gather(*holders)
+        assert pool.stats.as_dict()['in_use'] == 0
+        assert pool.stats.as_dict()['wait_max_ms'] >= 80
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import pytest
+
+import shared.schema
+from shared.schema import SchemaOutdated, migration_files, pending_migrations, verify_schema
+
+
+class Database:
+
+    def __init__(self, applied=None):
+        self.applied = applied
+        self.queries = []
+
+    async def execute_query_dict(self, sql, values=None):
+        self.queries.append(sql)
+        if sql == shared.schema.AERICH_TABLE_SQL:
+            return [{'exists': self.applied is not None}]
+        return [{'version': version} for version in self.applied]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = Database()
+    monkeypatch.setattr(shared.schema.connections, 'get', lambda name: db)
+    return db
+
+
+class TestSchemaVersion:
+
+    def test_migrations_are_ordered_by_number(self, tmp_path):
+        for name in ('10_b.py', '2_a.py', '0_init.py', '__init__.py.txt'):
+            (tmp_path / name).touch()
+
+        assert migration_files(str(tmp_path)) == ['0_init.py', '2_a.py', '10_b.py']
+
+    async def test_database_without_aerich_table_misses_every_migration(self, database):
+        assert await pending_migrations() == migration_files()
+
+    async def test_migrated_database_passes_without_ddl(self, database):
+        database.applied = migration_files()
+
+        await verify_schema()
+
+        assert all(sql.lstrip().upper().startswith('SELECT') for sql in database.queries)
+
+    async def test_pending_migrations_stop_startup(self, database):
+        database.applied = migration_files()[:-1]
+
+        with pytest.raises(SchemaOutdated, match=migration_files()[-1]):
+            await verify_schema()
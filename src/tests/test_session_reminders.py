@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import datetime
+import logging
+import os
+import uuid
+
+import dotenv
+import fakeredis.aioredis
+import pytest
+from base_test_classes import BaseAPITest, with_fake_redis
+from httpx import AsyncClient
+
+os.environ["TEST_MODE"] = "true"
+
+dotenv.load_dotenv()
+
+logging.disable(logging.CRITICAL)
+
+from shared.redis_client import AsyncRedisClientHandler
+
+
+class TestReminderHeap:
+
+    def test_due_sessions_pop_in_start_order(self):
+        from conferences.controller.reminders import SessionReminderScheduler
+
+        scheduler = SessionReminderScheduler(lead_time=datetime.timedelta(minutes=5))
+
+        t0 = datetime.datetime(2024, 11, 8, 10, 0)
+        scheduler.schedule([('c', t0 + datetime.timedelta(minutes=30)),
+                            ('a', t0 + datetime.timedelta(minutes=5)),
+                            ('b', t0 + datetime.timedelta(minutes=6))])
+
+        assert scheduler.next_reminder_at() == t0
+        assert scheduler.seconds_to_next_tick(t0 - datetime.timedelta(seconds=10)) == 10
+        assert scheduler.pop_due(t0 + datetime.timedelta(minutes=1)) == ['a', 'b']
+        assert scheduler.pop_due(t0 + datetime.timedelta(minutes=1)) == []
+        assert scheduler.next_reminder_at() == t0 + datetime.timedelta(minutes=25)
+
+    async def test_sessions_are_claimed_only_when_a_reminder_is_due(self):
+        from conferences.controller.reminders import SessionReminderScheduler
+
+        scheduler = SessionReminderScheduler(lead_time=datetime.timedelta(minutes=5))
+
+        t0 = datetime.datetime(2024, 11, 8, 10, 0)
+        scheduler.schedule([('a', t0 + datetime.timedelta(minutes=5))])
+        scheduler.loaded_at = t0 - datetime.timedelta(seconds=30)
+
+        claims = []
+
+        async def send_due_reminders(now):
+            claims.append(now)
+            return 1
+
+        scheduler.send_due_reminders = send_due_reminders
+
+        assert await scheduler.tick(t0 - datetime.timedelta(seconds=10)) == 0
+        assert await scheduler.tick(t0) == 1
+        assert await scheduler.tick(t0 + datetime.timedelta(seconds=10)) == 0
+        assert claims == [t0]
+
+
+class TestSessionReminders(BaseAPITest):
+
+    async def setup(self):
+        self.import_modules(['src.conferences.api'])
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True})
+            assert response.status_code == 200
+
+    async def bookmark(self, session, nr_users):
+        import conferences.models as models
+
+        users = [models.UserAnonymous(id=uuid.uuid4(), push_notification_token=f'ExponentPushToken[{session.id}-{i}]')
+                 for i in range(nr_users)]
+        await models.UserAnonymous.bulk_create(users)
+        await models.AnonymousBookmark.bulk_create([models.AnonymousBookmark(user=user, session=session)
+                                                    for user in users])
+
+    def scheduler(self, fake_redis):
+        from conferences.controller.reminders import SessionReminderScheduler
+
+        return SessionReminderScheduler(redis_client=AsyncRedisClientHandler(redis_instance=fake_redis))
+
+    async def test_reminders_are_sent_once_to_bookmarkers_of_sessions_starting_together(self):
+        import conferences.models as models
+
+        start_date = (await models.EventSession.filter(bookmarkable=True).order_by('start_date').first()).start_date
+        sessions = await models.EventSession.filter(start_date__gte=start_date,
+                                                    start_date__lt=start_date + datetime.timedelta(seconds=1),
+                                                    bookmarkable=True)
+        for session in sessions:
+            await self.bookmark(session, 10)
+
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        scheduler = self.scheduler(fake_redis)
+
+        assert await scheduler.tick(start_date - datetime.timedelta(minutes=10)) == 0
+        assert await scheduler.tick(start_date - datetime.timedelta(minutes=4)) == 10 * len(sessions)
+        assert await scheduler.tick(start_date - datetime.timedelta(minutes=3)) == 0
+
+        assert await fake_redis.xlen('opencon_push_notification') == 10 * len(sessions)
+        assert await models.EventSession.filter(id__in=[s.id for s in sessions],
+                                                notification5min_sent=True).count() == len(sessions)
+
+    async def test_concurrent_schedulers_do_not_double_send(self):
+        import conferences.models as models
+
+        session = await models.EventSession.filter(bookmarkable=True).order_by('start_date').first()
+        await self.bookmark(session, 100)
+
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        now = session.start_date - datetime.timedelta(minutes=4, seconds=59)
+
+        sent = await asyncio.gather(*[self.scheduler(fake_redis).tick(now) for _ in range(4)])
+
+        assert sum(sent) == await fake_redis.xlen('opencon_push_notification')
+        assert sum(sent) == 100
+
+    async def test_reminders_which_can_not_be_enqueued_are_not_claimed(self):
+        import conferences.models as models
+
+        class BrokenRedis:
+            def pipeline(self, *args, **kwargs):
+                raise ConnectionError("redis is down")
+
+        session = await models.EventSession.filter(bookmarkable=True).order_by('start_date').first()
+        await self.bookmark(session, 10)
+        now = session.start_date - datetime.timedelta(minutes=4)
+
+        # without a spool to fall back to the claim is rolled back
+        with pytest.raises(Exception):
+            await self.scheduler(BrokenRedis()).tick(now)
+        assert not await models.EventSession.filter(id=session.id, notification5min_sent=True).exists()
+
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        assert await self.scheduler(fake_redis).tick(now) == 10
+        assert await fake_redis.xlen('opencon_push_notification') == 10
+
+    @with_fake_redis
+    async def test_moved_sessions_are_reminded_again(self, *args, **kwargs):
+        import conferences.models as models
+
+        await models.EventSession.all().update(notification5min_sent=True)
+        start_dates = dict(await models.EventSession.all().values_list('id', 'start_date'))
+
+        async with AsyncClient(app=self.app, base_url="http://test") as ac:
+            response = await ac.post("/api/import-xml", json={'use_local_xml': True,
+                                                              'local_xml_fname': 'sfscon2024.1st_session_moved_for_5_minutes.xml'})
+            assert response.status_code == 200
+
+        sessions = await models.EventSession.filter(id__in=list(start_dates))
+        moved = {session.id for session in sessions if session.start_date != start_dates[session.id]}
+
+        assert moved
+        assert {session.id for session in sessions if not session.notification5min_sent} == moved
@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import logging
+
+import fakeredis.aioredis
+import redis
+
+logging.disable(logging.CRITICAL)
+
+import shared.db
+from conferences.controller.subscribers import REBUILD_KEY_PREFIX, SUBSCRIBERS_READY_KEY, SessionSubscribers
+from shared.redis_client import AsyncRedisClientHandler
+from shared.spool import RedisSpool
+
+
+def fake_subscribers():
+    return SessionSubscribers(AsyncRedisClientHandler(redis_instance=fakeredis.aioredis.FakeRedis()))
+
+
+class UnreachableRedis:
+
+    def __init__(self):
+        self.round_trips = 0
+
+    def pipeline(self, *args, **kwargs):
+        self.round_trips += 1
+        raise redis.exceptions.ConnectionError("redis is down")
+
+
+class TestSessionSubscribers:
+
+    async def test_subscribe_and_unsubscribe(self):
+        subscribers = fake_subscribers()
+
+        await subscribers.subscribe('s1', 'ExponentPushToken[1]')
+        await subscribers.subscribe('s1', 'ExponentPushToken[2]')
+        await subscribers.subscribe('s2', 'ExponentPushToken[1]')
+        await subscribers.subscribe('s2', None)
+        await subscribers.unsubscribe('s1', 'ExponentPushToken[2]')
+
+        assert await subscribers.tokens_by_session(['s1', 's2', 's3']) == {'s1': {'ExponentPushToken[1]'},
+                                                                             's2': {'ExponentPushToken[1]'},
+                                                                             's3': set()}
+
+    async def test_token_change_moves_subscriptions(self):
+        subscribers = fake_subscribers()
+
+        await subscribers.update({'s1': 'ExponentPushToken[1]', 's2': 'ExponentPushToken[1]'}, {})
+        await subscribers.update({'s1': 'ExponentPushToken[2]', 's2': 'ExponentPushToken[2]'},
+                                 {'s1': 'ExponentPushToken[1]', 's2': 'ExponentPushToken[1]'})
+
+        assert await subscribers.tokens_by_session(['s1', 's2']) == {'s1': {'ExponentPushToken[2]'},
+                                                                     's2': {'ExponentPushToken[2]'}}
+
+    async def test_removed_sessions(self):
+        subscribers = fake_subscribers()
+
+        await subscribers.subscribe('s1', 'ExponentPushToken[1]')
+        await subscribers.remove_sessions(['s1'])
+
+        assert await subscribers.tokens_by_session(['s1']) == {'s1': set()}
+
+    async def test_failed_update_invalidates_sets(self):
+        subscribers = fake_subscribers()
+        await subscribers.redis.set(SUBSCRIBERS_READY_KEY, 1)
+        assert await subscribers.is_ready()
+
+        # a plain string under a set key makes SADD fail
+        await subscribers.redis.set('session_subscribers:s1', 'broken')
+        await subscribers.subscribe('s1', 'ExponentPushToken[1]')
+
+        assert not await subscribers.is_ready()
+
+    async def test_outage_costs_one_round_trip(self, tmp_path):
+        unreachable = UnreachableRedis()
+        spool = RedisSpool(str(tmp_path / 'messages.spool'), retry_interval=60)
+        subscribers = SessionSubscribers(AsyncRedisClientHandler(redis_instance=unreachable, spool=spool))
+
+        for i in range(3):
+            await subscribers.subscribe('s1', f'ExponentPushToken[{i}]')
+        await subscribers.remove_sessions(['s1'])
+
+        assert unreachable.round_trips == 1
+
+        # once redis is back the sets are marked out of sync, fan-out reads Postgres until they are rebuilt
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        await fake_redis.set(SUBSCRIBERS_READY_KEY, 1)
+        spool.failed_at = None
+        await spool.areplay(fake_redis)
+
+        assert not await fake_redis.exists(SUBSCRIBERS_READY_KEY)
+        assert not spool.pending()
+
+
+    async def test_rebuild_swaps_sets_in_at_once(self, monkeypatch):
+        subscribers = fake_subscribers()
+        await subscribers.subscribe('s1', 'ExponentPushToken[1]')
+        await subscribers.subscribe('s2', 'ExponentPushToken[1]')
+        await subscribers.redis.set(SUBSCRIBERS_READY_KEY, 1)
+
+        seen_while_building = []
+
+        async def stream_rows(sql):
+            # s2 is not bookmarked anymore, s1 got a second bookmarker
+            for token in ('ExponentPushToken[1]', 'ExponentPushToken[2]'):
+                yield {'session_id': 's1', 'token': token}
+            seen_while_building.append((await subscribers.is_ready(),
+                                        await subscribers.tokens_by_session(['s1', 's2'])))
+
+        monkeypatch.setattr(shared.db, 'stream_rows', stream_rows)
+
+        assert await subscribers.rebuild() == 2
+
+        assert seen_while_building == [(True, {'s1': {'ExponentPushToken[1]'}, 's2': {'ExponentPushToken[1]'}})]
+        assert await subscribers.is_ready()
+        assert await subscribers.tokens_by_session(['s1', 's2']) == {'s1': {'ExponentPushToken[1]',
+                                                                            'ExponentPushToken[2]'},
+                                                                     's2': set()}
+        assert not await subscribers.redis.keys(f'{REBUILD_KEY_PREFIX}*')
+
+
+class Database:
+    # users of the dead tokens and the sessions they bookmarked, as returned by CLEAR_PUSH_TOKENS_SQL
+    def __init__(self, bookmarks):
+        self.bookmarks = bookmarks
+        self.cleared = []
+
+    async def fetch(self, sql, tokens):
+        self.cleared += tokens
+        return [{'token': token, 'session_id': id_session} for token, id_session in self.bookmarks
+                if token in tokens]
+
+
+class TestDeadTokenPruning:
+
+    async def test_pruned_tokens_are_no_fanout_targets(self):
+        from conferences.controller.conference import subscribers_of
+        from workers.push_notifications import PushQueue, flush_dead_tokens, prune_push_tokens
+
+        subscribers = fake_subscribers()
+        await subscribers.subscribe('s1', 'ExponentPushToken[1]')
+        await subscribers.subscribe('s1', 'ExponentPushToken[2]')
+        await subscribers.subscribe('s2', 'ExponentPushToken[1]')
+        await subscribers.redis.set(SUBSCRIBERS_READY_KEY, 1)
+
+        db = Database([('ExponentPushToken[1]', 's1'), ('ExponentPushToken[1]', 's2'),
+                       ('ExponentPushToken[2]', 's1')])
+        queue = PushQueue(fakeredis.aioredis.FakeRedis(decode_responses=True), 'opencon_push_notification')
+        await queue.mark_dead_tokens(['ExponentPushToken[1]'])
+
+        async def prune_tokens(tokens):
+            await prune_push_tokens(db, subscribers, tokens)
+
+        assert await flush_dead_tokens(queue, prune_tokens) == 1
+        assert db.cleared == ['ExponentPushToken[1]']
+
+        # the sets stay in use, without the pruned token
+        assert await subscribers_of(subscribers, ['s1', 's2']) == {'s1': {'ExponentPushToken[2]'}, 's2': set()}
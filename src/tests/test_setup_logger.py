@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import logging
+import threading
+import time
+
+import fakeredis
+
+from shared.setup_logger import RedisHandler
+
+
+def log(handler, message):
+    # straight to the handler, other test modules disable logging globally
+    handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO}))
+
+
+class BlockedRedis:
+    # a redis client whose writes hang until released
+
+    def __init__(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.released = threading.Event()
+
+    def pipeline(self, *args, **kwargs):
+        self.released.wait()
+        return self.redis.pipeline(*args, **kwargs)
+
+
+class TestRedisHandler:
+
+    def test_records_are_written_in_batches_and_capped(self):
+        fake_redis = fakeredis.FakeStrictRedis()
+        handler = RedisHandler(fake_redis, 'log_list', max_length=100, batch_size=50, flush_interval=0.05)
+
+        for i in range(250):
+            log(handler, f'record {i}')
+        handler.close()
+
+        assert fake_redis.llen('log_list') == 100
+        assert fake_redis.lrange('log_list', -1, -1) == [b'record 249']
+
+    def test_emit_does_not_block_when_redis_hangs(self):
+        blocked = BlockedRedis()
+        handler = RedisHandler(blocked, 'log_list', buffer_size=10, flush_interval=0.05)
+
+        started = time.perf_counter()
+        for i in range(100):
+            log(handler, f'record {i}')
+        assert time.perf_counter() - started < 0.5
+
+        # besides the batch held by the writer thread only the buffer is kept, the rest is dropped
+        assert 0 < handler.dropped <= 90
+
+        blocked.released.set()
+        handler.close()
+
+        written = [entry.decode() for entry in blocked.redis.lrange('log_list', 0, -1)]
+        assert len(written) == 100 - handler.dropped + 1
+        assert written[-1] == f'RedisHandler dropped {handler.dropped} log records'
+
+    def test_failed_writes_are_counted(self):
+        class BrokenRedis:
+            def pipeline(self, *args, **kwargs):
+                raise ConnectionError("redis is down")
+
+        handler = RedisHandler(BrokenRedis(), 'log_list', flush_interval=0.05)
+
+        for i in range(5):
+            log(handler, f'record {i}')
+        handler.close()
+
+        assert handler.dropped == 5
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import json
+import logging
+import time
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from shared.redis_client import AsyncRedisClientHandler
+from shared.setup_logger import RedisHandler
+from shared.spool import RedisSpool
+
+STREAM = 'opencon_push_notification'
+
+
+def notification(i):
+    return {'id': f'ExponentPushToken[{i}]'}
+
+
+async def stream_messages(redis_client):
+    return [json.loads(fields[b'payload']) for _, fields in await redis_client.xrange(STREAM)]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return RedisSpool(str(tmp_path / 'messages.spool'), retry_interval=0)
+
+
+class TestRedisSpool:
+
+    async def test_messages_are_spooled_during_outage_and_replayed_in_order(self, spool):
+        server = fakeredis.FakeServer()
+        fake_redis = fakeredis.aioredis.FakeRedis(server=server)
+        redis_client = AsyncRedisClientHandler(redis_instance=fake_redis, spool=spool)
+
+        await redis_client.add_stream_messages(STREAM, [notification(0)])
+
+        server.connected = False
+        assert await redis_client.add_stream_messages(STREAM, [notification(1), notification(2)]) == 2
+        assert await redis_client.add_stream_messages(STREAM, [notification(3)]) == 1
+        assert spool.metrics()['spooled'] == 3 and spool.pending()
+
+        server.connected = True
+        await redis_client.add_stream_messages(STREAM, [notification(4)])
+
+        assert await stream_messages(fake_redis) == [notification(i) for i in range(5)]
+        assert not spool.pending()
+        assert spool.metrics()['replayed'] == 4
+
+    async def test_redis_is_left_alone_until_retry_interval(self, tmp_path):
+        spool = RedisSpool(str(tmp_path / 'messages.spool'), retry_interval=60)
+        server = fakeredis.FakeServer()
+        fake_redis = fakeredis.aioredis.FakeRedis(server=server)
+        redis_client = AsyncRedisClientHandler(redis_instance=fake_redis, spool=spool)
+
+        server.connected = False
+        await redis_client.add_stream_messages(STREAM, [notification(0)])
+        server.connected = True
+
+        await redis_client.add_stream_messages(STREAM, [notification(1)])
+        assert await fake_redis.xlen(STREAM) == 0
+
+        spool.failed_at = None
+        assert await spool.areplay(fake_redis) == 2
+        assert await stream_messages(fake_redis) == [notification(0), notification(1)]
+
+    async def test_spool_size_is_bounded(self, tmp_path):
+        spool = RedisSpool(str(tmp_path / 'messages.spool'), max_bytes=1000)
+
+        accepted = sum(spool.append('xadd', STREAM, [json.dumps(notification(i))]) for i in range(100))
+
+        assert 0 < accepted < 100
+        assert spool.metrics()['dropped'] == 100 - accepted
+        assert spool.size() <= 1000
+
+    async def test_failed_replay_keeps_remaining_messages(self, tmp_path):
+        spool = RedisSpool(str(tmp_path / 'messages.spool'), retry_interval=0, batch_size=2)
+        for i in range(5):
+            spool.append('xadd', STREAM, [json.dumps(notification(i))])
+
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        pipeline = fake_redis.pipeline
+        calls = []
+
+        def failing_pipeline(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ConnectionError("redis went away")
+            return pipeline(*args, **kwargs)
+
+        fake_redis.pipeline = failing_pipeline
+
+        assert await spool.areplay(fake_redis) == 2
+        assert spool.pending()
+
+        assert await spool.areplay(fake_redis) == 3
+        assert await stream_messages(fake_redis) == [notification(i) for i in range(5)]
+        assert not spool.pending()
+
+
+class TestRedisHandlerSpool:
+
+    def test_log_records_are_spooled_during_outage(self, tmp_path):
+        spool = RedisSpool(str(tmp_path / 'logs.spool'), retry_interval=0)
+        server = fakeredis.FakeServer()
+        fake_redis = fakeredis.FakeStrictRedis(server=server)
+
+        server.connected = False
+        handler = RedisHandler(fake_redis, 'log_list', max_length=3, flush_interval=0.05, spool=spool)
+        handler.handle(logging.makeLogRecord({'msg': 'record 0'}))
+        handler.handle(logging.makeLogRecord({'msg': 'record 1'}))
+
+        while not spool.pending():
+            time.sleep(0.01)
+
+        server.connected = True
+        handler.handle(logging.makeLogRecord({'msg': 'record 2'}))
+        handler.handle(logging.makeLogRecord({'msg': 'record 3'}))
+        handler.close()
+
+        assert fake_redis.lrange('log_list', 0, -1) == [b'record 1', b'record 2', b'record 3']
+        assert handler.dropped == 0
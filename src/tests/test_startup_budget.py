@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# milliseconds a new api process may spend importing main:app
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv('STARTUP_IMPORT_BUDGET_MS', 1500))
+
+# used by the conference import pipeline (and by tests) only, loaded when they run.
+# yaml stays imported with the api, /api/conference serializes with it on every request
+IMPORT_ONLY_DEPENDENCIES = ('xmltodict', 'slugify', 'httpx', 'bs4', 'psycopg2')
+
+
+def import_times(module: str):
+    """
+    :return: {module: cumulative import time in microseconds} of a cold `import module` in a new interpreter
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SRC_DIR, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartupBudget:
+
+    def test_api_does_not_import_import_only_dependencies(self):
+        times = import_times('main')
+
+        assert 'main' in times
+        assert not [name for name in times if name.split('.')[0] in IMPORT_ONLY_DEPENDENCIES]
+
+    def test_api_imports_within_budget(self):
+        times = import_times('main')
+
+        assert times['main'] / 1000 < STARTUP_IMPORT_BUDGET_MS, \
+            f"importing main:app took {times['main'] / 1000:.0f}ms, budget is {STARTUP_IMPORT_BUDGET_MS:.0f}ms"
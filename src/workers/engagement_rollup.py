@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import argparse
+import asyncio
+import logging
+import signal
+
+import dotenv
+from tortoise import Tortoise
+
+dotenv.load_dotenv()
+
+from conferences.controller import engagement
+from db_config import db_config
+from shared.spool import replay_spools
+
+
+async def main(once: bool = False):
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger('conference_logger')
+
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await Tortoise.init(config=db_config())
+
+    # redis writes spooled while redis was down are sent once it is back
+    replaying = asyncio.create_task(replay_spools(stop))
+
+    log.info("Engagement rollup started")
+    try:
+        if once:
+            await engagement.rollup()
+        else:
+            await engagement.run(stop)
+    finally:
+        stop.set()
+        await replaying
+        await Tortoise.close_connections()
+        log.info("Engagement rollup stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-minute and per-hour buckets of bookmarks, ratings and new users')
+    parser.add_argument('--once', action='store_true', help='roll up once and exit')
+
+    args = parser.parse_args()
+    asyncio.run(main(args.once))
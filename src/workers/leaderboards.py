@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import argparse
+import asyncio
+import logging
+
+import dotenv
+from tortoise import Tortoise
+
+dotenv.load_dotenv()
+
+from conferences.controller.leaderboards import Leaderboards
+from db_config import db_config
+
+
+async def rebuild(id_conference=None):
+    logging.basicConfig(level=logging.INFO)
+
+    await Tortoise.init(config=db_config())
+
+    try:
+        print(f"Rebuilt leaderboards of {await Leaderboards().rebuild(id_conference)} sessions")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Redis leaderboards of sessions by bookmarks and ratings')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = commands.add_parser('rebuild', help='reconstruct the leaderboards from Postgres')
+    rebuild_parser.add_argument('--conference', help='id of the conference, all conferences if not given')
+
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        asyncio.run(rebuild(args.conference))
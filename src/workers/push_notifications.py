@@ -1,17 +1,26 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
 
+import argparse
 import asyncio
 import json
 import logging
 import os
+import random
+import signal
+import socket
+import time
 
+import asyncpg
 import dotenv
 import httpx
 import redis
 
 dotenv.load_dotenv()
 
+from shared.redis_client import get_async_redis, pool_stats
+from shared.setup_logger import setup_redis_logger
+
 
 def setup_logger(logger_name):
     current_file_dir = os.path.dirname(os.path.abspath(__file__))
@@ -43,64 +52,726 @@ def setup_logger(logger_name):
     return logging.getLogger(logger_name)
 
 
-async def send_notification(item):
-    log = logging.getLogger('push_notifications')
+EXPO_PUSH_URL = os.getenv('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+EXPO_RECEIPTS_URL = os.getenv('EXPO_RECEIPTS_URL', 'https://exp.host/--/api/v2/push/getReceipts')
+
+# Expo accepts at most 100 messages in one push request and 1000 ids in one receipts request
+EXPO_BATCH_SIZE = 100
+EXPO_RECEIPTS_BATCH_SIZE = 1000
+
+# Expo accepts up to 600 notifications per second per project, shared by all workers through Redis
+PUSH_RATE_LIMIT = float(os.getenv('PUSH_RATE_LIMIT', 600))
+
+# errors reported by Expo in tickets and receipts which are worth sending again later
+EXPO_RETRIABLE_ERRORS = ('MessageRateExceeded',)
+
+PUSH_DRAIN_BATCH_SIZE = int(os.getenv('PUSH_DRAIN_BATCH_SIZE', 1000))
+PUSH_MAX_CONCURRENT_REQUESTS = int(os.getenv('PUSH_MAX_CONCURRENT_REQUESTS', 6))
+PUSH_CONSUMERS = int(os.getenv('PUSH_CONSUMERS', 4))
+PUSH_WORKER_NAME = os.getenv('PUSH_WORKER_NAME', socket.gethostname())
+PUSH_CONSUMER_GROUP = os.getenv('PUSH_CONSUMER_GROUP', 'push_notifications')
+
+# entries pending longer than this in a consumer are considered abandoned and claimed by others
+PUSH_CLAIM_IDLE_MS = int(os.getenv('PUSH_CLAIM_IDLE_MS', 5 * 60 * 1000))
+
+PUSH_MAX_ATTEMPTS = int(os.getenv('PUSH_MAX_ATTEMPTS', 6))
+PUSH_RETRY_BASE_DELAY = float(os.getenv('PUSH_RETRY_BASE_DELAY', 2))
+PUSH_RETRY_MAX_DELAY = float(os.getenv('PUSH_RETRY_MAX_DELAY', 600))
+
+# Expo keeps receipts for 24 hours and recommends fetching them about 15 minutes after sending
+PUSH_RECEIPTS_DELAY = float(os.getenv('PUSH_RECEIPTS_DELAY', 15 * 60))
+PUSH_RECEIPTS_INTERVAL = float(os.getenv('PUSH_RECEIPTS_INTERVAL', 60))
+PUSH_RECEIPTS_TTL = 24 * 60 * 60
+
+PUSH_METRICS_INTERVAL = float(os.getenv('PUSH_METRICS_INTERVAL', 60))
+
+# tokens of uninstalled apps are collected from Expo responses and cleared in the database in batches
+PUSH_PRUNE_INTERVAL = float(os.getenv('PUSH_PRUNE_INTERVAL', 30))
+PUSH_PRUNE_BATCH_SIZE = int(os.getenv('PUSH_PRUNE_BATCH_SIZE', 1000))
+
+# how often notifications merged by the importer are checked for the end of their coalescing window
+PUSH_COALESCE_INTERVAL = float(os.getenv('PUSH_COALESCE_INTERVAL', 5))
 
+# how long a consumer blocks on an empty queue before it checks for shutdown again
+PUSH_POLL_TIMEOUT = 1
+
+# seconds a loop waits after failing (e.g. while redis is down), doubled on every further failure
+PUSH_ERROR_BACKOFF = float(os.getenv('PUSH_ERROR_BACKOFF', 1))
+PUSH_ERROR_MAX_BACKOFF = float(os.getenv('PUSH_ERROR_MAX_BACKOFF', 30))
+
+log = logging.getLogger('push_notifications')
+
+
+class PushDeliveryError(Exception):
+
+    def __init__(self, message, retriable=True):
+        super(PushDeliveryError, self).__init__(message)
+        self.retriable = retriable
+
+
+def create_http_client() -> httpx.AsyncClient:
+    # one pooled HTTP/2 client for the whole worker, requests are multiplexed over few connections
+    return httpx.AsyncClient(http2=True,
+                             timeout=httpx.Timeout(30.0, connect=10.0),
+                             limits=httpx.Limits(max_connections=PUSH_MAX_CONCURRENT_REQUESTS,
+                                                 max_keepalive_connections=PUSH_MAX_CONCURRENT_REQUESTS))
+
+
+def build_push_message(item):
     if not item or 'id' not in item or not item['id']:
-        print("not item or 'id' not in item or not item['id']")
-        return
-        
-    try:
+        log.warning(f"Notification without a push token is skipped :: {item}")
+        return None
+
+    return {
+        "to": item['id'],
+        "title": item['subject'],
+        "body": item['message']
+    }
+
+
+def expo_error(ticket_or_receipt):
+    if not ticket_or_receipt or ticket_or_receipt.get('status') == 'ok':
+        return None
+
+    details = ticket_or_receipt.get('details') or {}
+    return details.get('error') or ticket_or_receipt.get('message') or 'UnknownError'
+
+
+class RedisTokenBucket:
+    """
+    Token bucket rate limiter shared by all consumers of all workers.
+
+    Tokens are reserved even when the bucket is short of them, the caller then waits until
+    the reserved tokens have been refilled. Waiting callers are served in order of arrival,
+    and the bucket never hands out more than `rate` tokens per second on average.
+    """
+
+    # refill by elapsed time on the Redis clock, reserve, and return the seconds to wait for the reservation
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local requested = tonumber(ARGV[3])
+
+        local t = redis.call('TIME')
+        local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or capacity
+        local ts = tonumber(bucket[2]) or now
+
+        tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - requested
+
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 60)
+
+        if tokens >= 0 then
+            return '0'
+        end
+        return tostring(-tokens / rate)
+    """
+
+    def __init__(self, redis_client, key, rate=PUSH_RATE_LIMIT, capacity=None):
+        self.redis_client = redis_client
+        self.key = key
+        self.rate = rate
+        # by default at most one second worth of tokens can be spent at once
+        self.capacity = capacity or rate
+        self.script = redis_client.register_script(self.SCRIPT)
+
+    async def reserve(self, tokens):
+        """
+        :return: Seconds to wait before the reserved tokens may be used
+        """
+        return float(await self.script(keys=[self.key], args=[self.rate, self.capacity, tokens]))
+
+    async def acquire(self, tokens):
+        wait = await self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class ExpoPushSender:
+
+    def __init__(self, client: httpx.AsyncClient, url: str = EXPO_PUSH_URL, receipts_url: str = EXPO_RECEIPTS_URL,
+                 max_concurrent_requests: int = PUSH_MAX_CONCURRENT_REQUESTS, rate_limiter: RedisTokenBucket = None):
+        self.client = client
+        self.url = url
+        self.receipts_url = receipts_url
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.rate_limiter = rate_limiter
+
+    async def post(self, url, payload):
+        async with self.semaphore:
+            try:
+                res = await self.client.post(url, json=payload)
+            except httpx.HTTPError as e:
+                raise PushDeliveryError(f"{type(e).__name__}: {e}")
+
+        if res.status_code == 429 or res.status_code >= 500:
+            raise PushDeliveryError(f"HTTP {res.status_code}")
+
+        if res.status_code != 200:
+            raise PushDeliveryError(f"HTTP {res.status_code}: {res.text}", retriable=False)
+
+        return res.json().get('data')
+
+    async def send_batch(self, messages):
+        """
+        Send at most EXPO_BATCH_SIZE messages in one request.
+
+        :return: One ticket per message, in the same order as messages
+        """
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(len(messages))
+
+        tickets = await self.post(self.url, messages) or []
+        if len(tickets) != len(messages):
+            raise PushDeliveryError(f"Expected {len(messages)} tickets, got {len(tickets)}")
+
+        return tickets
+
+    async def get_receipts(self, ticket_ids):
+        return await self.post(self.receipts_url, {'ids': ticket_ids}) or {}
+
+
+class PushQueue:
+    """
+    At-least-once push notification queue on top of a Redis stream consumed by a consumer group.
+
+    Every entry is delivered to a single consumer of the group and stays pending until it
+    is acknowledged, entries left pending by a crashed consumer are claimed by the others.
+    Failed messages are rescheduled in a sorted set scored by their next attempt time, and
+    end up in a dead-letter list once attempts are exhausted. Expo ticket ids wait in
+    another sorted set until their receipts can be fetched.
+
+    Notifications merged per device token by the importer wait in a hash until their
+    coalescing window, tracked in a sorted set, is over.
+    """
+
+    def __init__(self, redis_client, name, group=PUSH_CONSUMER_GROUP, max_attempts=PUSH_MAX_ATTEMPTS,
+                 retry_base_delay=PUSH_RETRY_BASE_DELAY, retry_max_delay=PUSH_RETRY_MAX_DELAY,
+                 claim_idle_ms=PUSH_CLAIM_IDLE_MS):
+        self.redis_client = redis_client
+        self.name = name
+        self.group = group
+        self.retry_key = f'{name}:retry'
+        self.dead_letter_key = f'{name}:dead'
+        self.receipts_key = f'{name}:receipts'
+        self.dead_tokens_key = f'{name}:dead_tokens'
+        self.coalesced_key = f'{name}:coalesced'
+        self.coalesce_due_key = f'{name}:coalesce_due'
+        self.rate_limit_key = f'{name}:rate_limit'
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.claim_idle_ms = claim_idle_ms
+
+    async def ensure_group(self):
+        try:
+            await self.redis_client.xgroup_create(self.name, self.group, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @staticmethod
+    def entries(entries):
+        return [(entry_id, fields['payload']) for entry_id, fields in entries if fields]
+
+    async def add(self, raws):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for raw in raws:
+                pipe.xadd(self.name, {'payload': raw})
+            await pipe.execute()
+
+    async def claim(self, consumer, max_items=PUSH_DRAIN_BATCH_SIZE, timeout=PUSH_POLL_TIMEOUT):
+        """
+        Claim a batch of entries for a consumer, taking over entries idle for too long
+        in other consumers first.
+
+        :return: List of (entry id, serialized message)
+        """
+        _, claimed, *_ = await self.redis_client.xautoclaim(self.name, self.group, consumer,
+                                                            min_idle_time=self.claim_idle_ms,
+                                                            start_id='0-0', count=max_items)
+        if claimed:
+            return self.entries(claimed)
+
+        res = await self.redis_client.xreadgroup(self.group, consumer, {self.name: '>'},
+                                                 count=max_items, block=int(timeout * 1000))
+        return self.entries(res[0][1]) if res else []
+
+    async def pending(self, consumer, max_items=PUSH_DRAIN_BATCH_SIZE):
+        # entries delivered to this consumer by a previous run and never acknowledged
+        res = await self.redis_client.xreadgroup(self.group, consumer, {self.name: '0'}, count=max_items)
+        return self.entries(res[0][1]) if res else []
+
+    async def ack(self, entry_ids):
+        if not entry_ids:
+            return
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.xack(self.name, self.group, *entry_ids)
+            pipe.xdel(self.name, *entry_ids)
+            await pipe.execute()
+
+    def retry_delay(self, attempts):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempts))
+
+    async def fail(self, entry_id, item, error, retriable=True):
+        """
+        Reschedule a message with backoff, or dead-letter it when it can not succeed.
+
+        :param entry_id: Stream entry holding the message, None if it is not in the stream
+        :param item: Deserialized message
+        :param error: Reason of the failure, stored with the message
+        :param retriable: False for errors which would fail again
+        """
+        item = dict(item, _attempts=item.get('_attempts', 0) + 1, _error=error)
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            if entry_id is not None:
+                pipe.xack(self.name, self.group, entry_id)
+                pipe.xdel(self.name, entry_id)
+
+            if retriable and item['_attempts'] < self.max_attempts:
+                pipe.zadd(self.retry_key, {json.dumps(item): time.time() + self.retry_delay(item['_attempts'])})
+            else:
+                log.critical(f"Dead-lettering push notification to {item.get('id')}: {error}")
+                pipe.rpush(self.dead_letter_key, json.dumps(dict(item, _failed_at=time.time())))
+
+            await pipe.execute()
+
+    async def requeue_due_retries(self, now=None):
+        due = await self.redis_client.zrangebyscore(self.retry_key, '-inf', now or time.time(),
+                                                    start=0, num=PUSH_DRAIN_BATCH_SIZE)
+
+        # only the worker which removed an entry requeues it
+        requeued = []
+        for raw in due:
+            if await self.redis_client.zrem(self.retry_key, raw):
+                requeued.append(raw)
+
+        if requeued:
+            await self.add(requeued)
+
+        return len(requeued)
+
+    async def release_coalesced(self, now=None):
+        """
+        Queue merged notifications whose coalescing window is over.
+
+        :return: Number of released notifications
+        """
+        due = await self.redis_client.zrangebyscore(self.coalesce_due_key, '-inf', now or time.time(),
+                                                    start=0, num=PUSH_DRAIN_BATCH_SIZE)
+
+        released = []
+        for token in due:
+            # only the worker which removed a token releases it, changes arriving later open a new window
+            if not await self.redis_client.zrem(self.coalesce_due_key, token):
+                continue
+
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hget(self.coalesced_key, token)
+                pipe.hdel(self.coalesced_key, token)
+                pipe.delete(f'{self.coalesced_key}:{token}')
+                raw, *_ = await pipe.execute()
+
+            if raw:
+                released.append(raw)
+
+        if released:
+            await self.add(released)
+
+        return len(released)
+
+    async def track_receipts(self, tickets_with_items):
+        if not tickets_with_items:
+            return
+
+        now = time.time()
+        await self.redis_client.zadd(self.receipts_key, {json.dumps({'ticket': ticket_id, 'item': item}): now
+                                                         for ticket_id, item in tickets_with_items})
+
+    async def due_receipts(self, delay=PUSH_RECEIPTS_DELAY, now=None):
+        due = await self.redis_client.zrangebyscore(self.receipts_key, '-inf', (now or time.time()) - delay,
+                                                    start=0, num=EXPO_RECEIPTS_BATCH_SIZE, withscores=True)
+        return [(raw, json.loads(raw), score) for raw, score in due]
+
+    async def dead_letters(self, limit=100):
+        return [json.loads(raw) for raw in await self.redis_client.lrange(self.dead_letter_key, 0, limit - 1)]
+
+    async def replay_dead_letters(self, limit=None):
+        raws = await self.redis_client.lrange(self.dead_letter_key, 0, -1 if limit is None else limit - 1)
+        if not raws:
+            return 0
+
+        items = [json.loads(raw) for raw in raws]
+        for item in items:
+            for key in ('_attempts', '_error', '_failed_at'):
+                item.pop(key, None)
 
-        payload = {
-            "to": item['id'],
-            "title": item['subject'],
-            "body": item['message']
+        # new dead letters are appended on the right, so trimming what we have read is safe
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.ltrim(self.dead_letter_key, len(raws), -1)
+            for item in items:
+                pipe.xadd(self.name, {'payload': json.dumps(item)})
+            await pipe.execute()
+
+        return len(items)
+
+    async def mark_dead_tokens(self, tokens):
+        if tokens:
+            await self.redis_client.sadd(self.dead_tokens_key, *tokens)
+
+    async def pop_dead_tokens(self, count=PUSH_PRUNE_BATCH_SIZE):
+        return await self.redis_client.spop(self.dead_tokens_key, count) or []
+
+    async def purge_dead_letters(self):
+        return await self.redis_client.delete(self.dead_letter_key)
+
+    async def metrics(self):
+        """
+        Queue depth and per-consumer lag of the consumer group.
+
+        :return: Stream length, group lag (entries not yet delivered to any consumer),
+                 pending entries and per-consumer pending count and idle time in ms
+        """
+        group = next((g for g in await self.redis_client.xinfo_groups(self.name) if g['name'] == self.group), {})
+
+        return {
+            'length': await self.redis_client.xlen(self.name),
+            'lag': group.get('lag'),
+            'pending': group.get('pending', 0),
+            'retries': await self.redis_client.zcard(self.retry_key),
+            'dead_letters': await self.redis_client.llen(self.dead_letter_key),
+            'coalesced': await self.redis_client.zcard(self.coalesce_due_key),
+            'consumers': {c['name']: {'pending': c['pending'], 'idle': c['idle']}
+                          for c in (await self.redis_client.xinfo_consumers(self.name, self.group) if group else [])}
         }
 
-        async with httpx.AsyncClient() as client:
 
-            print("SENDING", payload)
-            
-            res = await client.post('https://exp.host/--/api/v2/push/send', json=payload)
-            
-            print(res.json())
+async def deliver(queue: PushQueue, sender: ExpoPushSender, entries):
+    to_send = []
+    to_ack = []
+
+    for entry_id, raw in entries:
+        item = json.loads(raw)
+        message = build_push_message(item)
+        if message:
+            to_send.append((entry_id, item, message))
+        else:
+            to_ack.append(entry_id)
+
+    async def deliver_batch(batch):
+        try:
+            tickets = await sender.send_batch([message for entry_id, item, message in batch])
+        except PushDeliveryError as e:
+            for entry_id, item, message in batch:
+                await queue.fail(entry_id, item, str(e), retriable=e.retriable)
+            return
+
+        sent = []
+        dead_tokens = []
+        for (entry_id, item, message), ticket in zip(batch, tickets):
+            error = expo_error(ticket)
+            if not error:
+                sent.append((ticket.get('id'), item))
+                to_ack.append(entry_id)
+            elif error == 'DeviceNotRegistered':
+                dead_tokens.append(message['to'])
+                to_ack.append(entry_id)
+            else:
+                await queue.fail(entry_id, item, error, retriable=error in EXPO_RETRIABLE_ERRORS)
+
+        await queue.track_receipts([(ticket_id, item) for ticket_id, item in sent if ticket_id])
+        await queue.mark_dead_tokens(dead_tokens)
+
+    batches = [to_send[i:i + EXPO_BATCH_SIZE] for i in range(0, len(to_send), EXPO_BATCH_SIZE)]
+    await asyncio.gather(*[deliver_batch(batch) for batch in batches])
+
+    await queue.ack(to_ack)
 
-    except Exception as e:
-        
-        print("ERROR",e)
-    
-        log.critical(f"Error sending push notification: {e}")
 
+async def check_receipts(queue: PushQueue, sender: ExpoPushSender, delay=PUSH_RECEIPTS_DELAY):
+    due = await queue.due_receipts(delay)
+    if not due:
+        return 0
 
-async def read_redis_queue(queue_name):
-    redis_host = os.getenv('REDIS_SERVER')
-    redis_client = redis.Redis(host=redis_host, port=6379, db=0)
+    try:
+        receipts = await sender.get_receipts([entry['ticket'] for raw, entry, sent_at in due])
+    except PushDeliveryError as e:
+        log.critical(f'Error fetching push receipts :: {str(e)}')
+        return 0
 
-    log = logging.getLogger('push_notifications')
-    log.info("Worker started")
+    dead_tokens = []
+    for raw, entry, sent_at in due:
+        receipt = receipts.get(entry['ticket'])
+        if not receipt and sent_at > time.time() - PUSH_RECEIPTS_TTL:
+            # receipt is not ready yet
+            continue
 
-    while True:
-        res = redis_client.blpop(queue_name.encode('utf-8'), 5) # *6
-        if not res:
-            print('.')
+        # only the worker which removed the entry acts on its receipt
+        if not await queue.redis_client.zrem(queue.receipts_key, raw):
             continue
 
-        #breakpoint()
+        error = expo_error(receipt)
+        if error == 'DeviceNotRegistered':
+            dead_tokens.append(entry['item']['id'])
+        elif error:
+            await queue.fail(None, entry['item'], error, retriable=error in EXPO_RETRIABLE_ERRORS)
+
+    await queue.mark_dead_tokens(dead_tokens)
+
+    return len(due)
+
+
+# clears dead tokens and returns the sessions bookmarked by their users, whose subscriber sets still hold them
+CLEAR_PUSH_TOKENS_SQL = """
+    WITH cleared AS (
+        UPDATE conferences_users_anonymous u
+           SET push_notification_token = NULL
+          FROM (SELECT id, push_notification_token AS token
+                  FROM conferences_users_anonymous
+                 WHERE push_notification_token = ANY($1::varchar[])) dead
+         WHERE u.id = dead.id
+     RETURNING u.id, dead.token
+    )
+    SELECT DISTINCT c.token, b.session_id
+      FROM cleared c
+      JOIN conferences_anonymous_bookmarks b ON b.user_id = c.id
+"""
+
+
+async def clear_push_tokens(db_pool: asyncpg.Pool, tokens):
+    """
+    :return: session id -> cleared tokens of users who bookmarked the session
+    """
+    tokens_by_session = {}
+    for row in await db_pool.fetch(CLEAR_PUSH_TOKENS_SQL, list(tokens)):
+        tokens_by_session.setdefault(str(row['session_id']), set()).add(row['token'])
+    return tokens_by_session
 
-        queue, item = res
 
-        item = item.decode('utf-8')
-        item = json.loads(item)
+async def prune_push_tokens(db_pool: asyncpg.Pool, subscribers, tokens):
+    # fan-out reads the subscriber sets while they are ready, pruned tokens must leave them as well
+    await subscribers.remove_tokens(await clear_push_tokens(db_pool, tokens))
 
+
+async def flush_dead_tokens(queue: PushQueue, prune_tokens, batch_size=PUSH_PRUNE_BATCH_SIZE):
+    pruned = 0
+    while tokens := await queue.pop_dead_tokens(batch_size):
         try:
-            await send_notification(item)
+            await prune_tokens(tokens)
+        except Exception:
+            # keep the tokens for the next attempt
+            await queue.mark_dead_tokens(tokens)
+            raise
+
+        pruned += len(tokens)
+
+    if pruned:
+        log.info(f"Pruned {pruned} dead push notification tokens")
+
+    return pruned
+
+
+async def sleep_until_stopped(stop: asyncio.Event, seconds):
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+def error_backoff(failures):
+    return min(PUSH_ERROR_BACKOFF * 2 ** (failures - 1), PUSH_ERROR_MAX_BACKOFF)
+
+
+async def consume(queue: PushQueue, sender: ExpoPushSender, consumer, stop: asyncio.Event):
+    resumed = False
+    failures = 0
+
+    # shutdown is only checked between batches, so a claimed batch is always settled before exiting
+    while not stop.is_set():
+        try:
+            if not resumed:
+                pending = await queue.pending(consumer)
+                if pending:
+                    log.info(f"{consumer} resumes {len(pending)} pending notifications")
+                    await deliver(queue, sender, pending)
+                resumed = True
+
+            entries = await queue.claim(consumer)
+            if entries:
+                await deliver(queue, sender, entries)
+            failures = 0
+        except Exception as e:
+            # unacknowledged entries stay pending and are claimed again later
+            failures += 1
+            log.critical(f'Error consuming push notifications in {consumer} :: {str(e)}')
+            await sleep_until_stopped(stop, error_backoff(failures))
+
+
+async def requeue_retries(queue: PushQueue, stop: asyncio.Event, interval=1):
+    failures = 0
+
+    while not stop.is_set():
+        try:
+            await queue.requeue_due_retries()
+            failures = 0
         except Exception as e:
-            print("EXCEPTION", e)
+            failures += 1
+            log.critical(f'Error requeueing push notification retries :: {str(e)}')
+            await sleep_until_stopped(stop, error_backoff(failures))
             continue
-            
+
+        await sleep_until_stopped(stop, interval)
+
+
+async def release_coalesced(queue: PushQueue, stop: asyncio.Event, interval=PUSH_COALESCE_INTERVAL):
+    while not stop.is_set():
+        try:
+            await queue.release_coalesced()
+        except Exception as e:
+            log.critical(f'Error releasing coalesced push notifications :: {str(e)}')
+        await sleep_until_stopped(stop, interval)
+
+
+async def poll_receipts(queue: PushQueue, sender: ExpoPushSender, stop: asyncio.Event,
+                        interval=PUSH_RECEIPTS_INTERVAL, delay=PUSH_RECEIPTS_DELAY):
+    while not stop.is_set():
+        try:
+            await check_receipts(queue, sender, delay)
+        except Exception as e:
+            log.critical(f'Error checking push receipts :: {str(e)}')
+        await sleep_until_stopped(stop, interval)
+
+
+async def prune_dead_tokens(queue: PushQueue, prune_tokens, stop: asyncio.Event, interval=PUSH_PRUNE_INTERVAL):
+    while not stop.is_set():
+        await sleep_until_stopped(stop, interval)
+        try:
+            await flush_dead_tokens(queue, prune_tokens)
+        except Exception as e:
+            log.critical(f'Error pruning dead push tokens :: {str(e)}')
+
+
+async def report_metrics(queue: PushQueue, stop: asyncio.Event, interval=PUSH_METRICS_INTERVAL):
+    while not stop.is_set():
+        try:
+            log.info(f"Queue metrics {json.dumps(await queue.metrics())}")
+            log.info(f"Redis pools {json.dumps(pool_stats())}")
+        except Exception as e:
+            log.critical(f'Error reporting push queue metrics :: {str(e)}')
+        await sleep_until_stopped(stop, interval)
+
+
+async def read_redis_queue(queue: PushQueue, stop: asyncio.Event = None, http_client: httpx.AsyncClient = None,
+                           url: str = EXPO_PUSH_URL, receipts_url: str = EXPO_RECEIPTS_URL,
+                           consumers: int = PUSH_CONSUMERS, worker_name: str = PUSH_WORKER_NAME,
+                           receipts_interval=PUSH_RECEIPTS_INTERVAL, receipts_delay=PUSH_RECEIPTS_DELAY,
+                           prune_tokens=None, prune_interval=PUSH_PRUNE_INTERVAL, rate_limit=PUSH_RATE_LIMIT):
+    stop = stop or asyncio.Event()
+
+    log.info(f"Worker {worker_name} started with {consumers} consumers")
+
+    await queue.ensure_group()
+
+    async with http_client or create_http_client() as client:
+        rate_limiter = RedisTokenBucket(queue.redis_client, queue.rate_limit_key, rate_limit) if rate_limit else None
+        sender = ExpoPushSender(client, url=url, receipts_url=receipts_url, rate_limiter=rate_limiter)
+        await asyncio.gather(*[consume(queue, sender, f'{worker_name}:{i}', stop) for i in range(consumers)],
+                             requeue_retries(queue, stop),
+                             release_coalesced(queue, stop),
+                             poll_receipts(queue, sender, stop, receipts_interval, receipts_delay),
+                             report_metrics(queue, stop),
+                             *([prune_dead_tokens(queue, prune_tokens, stop, prune_interval)] if prune_tokens else []))
+
+    log.info("Worker stopped")
+
+
+def create_queue(queue_name, consumers=PUSH_CONSUMERS):
+    # every consumer holds a connection while blocked in XREADGROUP, others wait for a free one
+    return PushQueue(get_async_redis(decode_responses=True, max_connections=2 * consumers + 4), queue_name)
+
+
+async def create_db_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(user=os.getenv('DB_USERNAME'), password=os.getenv('DB_PASSWORD'),
+                                     host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
+                                     database=os.getenv('DB_NAME'), min_size=1, max_size=2)
+
+
+async def main(queue_name):
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    from conferences.controller.subscribers import SessionSubscribers
+    from shared.redis_client import AsyncRedisClientHandler
+    from shared.spool import replay_spools
+
+    queue = create_queue(queue_name)
+    db_pool = await create_db_pool()
+    subscribers = SessionSubscribers(AsyncRedisClientHandler(redis_instance=queue.redis_client))
+
+    async def prune_tokens(tokens):
+        await prune_push_tokens(db_pool, subscribers, tokens)
+
+    # error logs spooled while redis was down are sent once it is back
+    replaying = asyncio.create_task(replay_spools(stop))
+
+    try:
+        await read_redis_queue(queue, stop=stop, prune_tokens=prune_tokens)
+    finally:
+        stop.set()
+        await replaying
+        await db_pool.close()
+        await queue.redis_client.aclose()
+
+
+async def stats_command(queue_name):
+    queue = create_queue(queue_name, consumers=0)
+    try:
+        await queue.ensure_group()
+        print(json.dumps(await queue.metrics(), indent=1))
+    finally:
+        await queue.redis_client.aclose()
+
+
+async def dead_letter_command(queue_name, command, limit):
+    queue = create_queue(queue_name, consumers=0)
+    try:
+        if command == 'list':
+            for item in await queue.dead_letters(limit or 100):
+                print(json.dumps(item, ensure_ascii=False))
+        elif command == 'replay':
+            print(f"Replayed {await queue.replay_dead_letters(limit)} notifications")
+        elif command == 'purge':
+            await queue.purge_dead_letters()
+            print("Dead-letter queue purged")
+    finally:
+        await queue.redis_client.aclose()
+
 
 if __name__ == "__main__":
-    setup_logger('push_notifications')
+    parser = argparse.ArgumentParser(description='Push notification worker')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'stats', 'dead-letter'])
+    parser.add_argument('dead_letter_command', nargs='?', default='list', choices=['list', 'replay', 'purge'])
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
     queue_name = "opencon_push_notification"
-    asyncio.run(read_redis_queue(queue_name))
+
+    if args.command == 'stats':
+        asyncio.run(stats_command(queue_name))
+    elif args.command == 'dead-letter':
+        asyncio.run(dead_letter_command(queue_name, args.dead_letter_command, args.limit))
+    else:
+        setup_logger('push_notifications')
+        # errors end up in the log_list of the admin panel as well, spooled while redis is down
+        setup_redis_logger('push_notifications', logging.WARNING)
+        asyncio.run(main(queue_name))
@@ -0,0 +1,44 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import asyncio
+import logging
+import signal
+
+import dotenv
+from tortoise import Tortoise
+
+dotenv.load_dotenv()
+
+from conferences.controller.reminders import SessionReminderScheduler
+from db_config import db_config
+from shared.spool import replay_spools
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger('conference_logger')
+
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await Tortoise.init(config=db_config())
+
+    # reminders spooled while redis was down are sent once it is back, not with the next reminder
+    replaying = asyncio.create_task(replay_spools(stop))
+
+    log.info("Session reminders started")
+    try:
+        await SessionReminderScheduler().run(stop)
+    finally:
+        stop.set()
+        await replaying
+        await Tortoise.close_connections()
+        log.info("Session reminders stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
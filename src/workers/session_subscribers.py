@@ -0,0 +1,35 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2023 Digital CUBE <https://digitalcube.rs>
+
+import argparse
+import asyncio
+import logging
+
+import dotenv
+from tortoise import Tortoise
+
+dotenv.load_dotenv()
+
+from conferences.controller.subscribers import SessionSubscribers
+from db_config import db_config
+
+
+async def rebuild():
+    logging.basicConfig(level=logging.INFO)
+
+    await Tortoise.init(config=db_config())
+
+    try:
+        print(f"Rebuilt {await SessionSubscribers().rebuild()} session subscribers")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Redis sets of push notification tokens per session')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='reconstruct all subscriber sets from Postgres')
+
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        asyncio.run(rebuild())
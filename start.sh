@@ -8,5 +8,8 @@ echo "*/5 * * * * /scripts/update-conf.py " > /tmp/cron
 crontab /tmp/cron
 
 
+# schema changes are applied once per container start, the api itself only checks the schema version
+aerich upgrade
+
 python main.py 
 